@@ -15,6 +15,9 @@ class _LogViewPageState extends State<LogViewPage> {
   String _logContent = '';
   bool _isLoading = false;
   String? _errorMessage;
+  // 已显示到的日志行号和日志文件名（刷新时服务端只返回之后新增的行）
+  int? _logCursor;
+  String? _logFileName;
 
   @override
   void initState() {
@@ -46,7 +49,6 @@ class _LogViewPageState extends State<LogViewPage> {
     setState(() {
       _isLoading = true;
       _errorMessage = null;
-      _logContent = '';
     });
 
     try {
@@ -64,7 +66,10 @@ class _LogViewPageState extends State<LogViewPage> {
       // 通过WebSocket发送get_logs命令（不指定target_we_chat_id，服务端会根据登录手机号自动匹配）
       final result = await wsService.sendCommandAsync(
         'get_logs',
-        {},
+        {
+          if (_logCursor != null) 'cursor': _logCursor,
+          if (_logFileName != null) 'cursor_log_file_name': _logFileName,
+        },
         '', // target_we_chat_id为空，服务端会根据登录手机号匹配Windows端
       );
 
@@ -75,23 +80,33 @@ class _LogViewPageState extends State<LogViewPage> {
         if (status == 'completed') {
           // 解析结果
           String resultStr = '';
+          Map? resultJson;
           
           if (resultData is String) {
             try {
-              final resultJson = jsonDecode(resultData);
-              resultStr = resultJson['decrypted_log_content'] ?? resultData;
+              resultJson = jsonDecode(resultData) as Map?;
+              resultStr = resultJson?['decrypted_log_content'] ?? resultData;
             } catch (e) {
               resultStr = resultData;
             }
           } else if (resultData is Map) {
+            resultJson = resultData;
             resultStr = resultData['decrypted_log_content'] ?? resultData.toString();
           } else {
             resultStr = resultData.toString();
           }
 
+          // reset为false时只返回了上次之后新增的行，追加显示；否则替换显示的内容
+          final append = resultJson?['reset'] == false && _logContent.isNotEmpty;
           setState(() {
             _isLoading = false;
-            _logContent = resultStr;
+            if (!append) {
+              _logContent = resultStr;
+            } else if (resultStr.isNotEmpty) {
+              _logContent = '$_logContent\n$resultStr';
+            }
+            _logCursor = resultJson?['total_lines'] as int?;
+            _logFileName = resultJson?['log_file_name'] as String?;
           });
         } else if (status == 'error') {
           setState(() {
@@ -10,18 +10,27 @@ from app.models.database import AsyncSessionLocal, AccountInfo
 from app.models.schemas import AccountInfoResponse
 from app.utils.encryption_service import encryption_service
 from app.utils.http_session_manager import http_session_manager
+from app.services.account_buffer import account_buffer
 
 router = APIRouter()
 
 
+def _to_response(account_info: AccountInfo) -> AccountInfoResponse:
+    """转换为响应模型（叠加写缓冲中尚未写入数据库的字段）"""
+    account_dict = AccountInfoResponse.model_validate(account_info).model_dump()
+    return AccountInfoResponse.model_validate(account_buffer.apply(account_info.wxid, account_dict))
+
+
 @router.get("/account")
 async def get_account_info(request: Request, wxid: Optional[str] = None, phone: Optional[str] = None):
     """获取账号信息（支持加密响应）"""
     async with AsyncSessionLocal() as session:
         try:
+            # 写缓冲中最近更新（且手机号匹配）的账号比数据库中的账号更新
+            buffered_wxid = wxid or account_buffer.latest_wxid(phone or None)
             stmt = select(AccountInfo)
-            if wxid:
-                stmt = stmt.where(AccountInfo.wxid == wxid)
+            if buffered_wxid:
+                stmt = stmt.where(AccountInfo.wxid == buffered_wxid)
             elif phone:
                 # 如果指定了手机号，根据手机号查询
                 stmt = stmt.where(AccountInfo.phone == phone)
@@ -31,11 +40,16 @@ async def get_account_info(request: Request, wxid: Optional[str] = None, phone:
             
             result = await session.execute(stmt)
             account_info = result.scalar_one_or_none()
+            if not account_info and buffered_wxid and account_buffer.pending(buffered_wxid) is not None:
+                # 新账号还在写缓冲中，写入数据库后重新查询
+                await account_buffer.ensure_flushed(buffered_wxid)
+                result = await session.execute(stmt)
+                account_info = result.scalar_one_or_none()
             
             if not account_info:
                 return None
             
-            account_data = AccountInfoResponse.model_validate(account_info)
+            account_data = _to_response(account_info)
             
             # 检查是否有会话ID（HTTP密钥交换）
             session_id = request.headers.get("X-Session-ID")
@@ -44,7 +58,7 @@ async def get_account_info(request: Request, wxid: Optional[str] = None, phone:
                 try:
                     account_dict = account_data.model_dump(mode='json')
                     account_json = json.dumps(account_dict, ensure_ascii=False)
-                    encrypted_data = encryption_service.encrypt_string_for_http(session_id, account_json)
+                    encrypted_data = await encryption_service.encrypt_string_for_http(session_id, account_json)
                     return {
                         "encrypted": True,
                         "data": encrypted_data
@@ -80,7 +94,7 @@ async def get_all_accounts(request: Request, limit: int = 100, offset: int = 0):
             result = await session.execute(stmt)
             accounts = result.scalars().all()
             
-            accounts_data = [AccountInfoResponse.model_validate(account) for account in accounts]
+            accounts_data = [_to_response(account) for account in accounts]
             
             # 检查是否有会话ID（HTTP密钥交换）
             session_id = request.headers.get("X-Session-ID")
@@ -89,7 +103,7 @@ async def get_all_accounts(request: Request, limit: int = 100, offset: int = 0):
                 try:
                     accounts_list = [account.model_dump(mode='json') for account in accounts_data]
                     accounts_json = json.dumps(accounts_list, ensure_ascii=False)
-                    encrypted_data = encryption_service.encrypt_string_for_http(session_id, accounts_json)
+                    encrypted_data = await encryption_service.encrypt_string_for_http(session_id, accounts_json)
                     return {
                         "encrypted": True,
                         "data": encrypted_data
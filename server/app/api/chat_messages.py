@@ -0,0 +1,62 @@
+"""
+聊天记录API接口
+"""
+from fastapi import APIRouter, HTTPException, Request
+from typing import Optional
+
+from app.models.schemas import ChatMessageResponse, ChatMessagePage
+from app.services.chat_message_service import ChatMessageService
+from app.utils.http_response_encrypt import encrypt_response_body
+
+router = APIRouter()
+
+
+@router.get("/chat/messages")
+async def get_chat_messages(
+    request: Request,
+    wxid: str,
+    peer_wxid: str,
+    cursor: Optional[str] = None,
+    limit: int = 50
+):
+    """分页获取与某个好友的聊天记录（按发送时间倒序，使用上一页返回的next_cursor翻页）"""
+    try:
+        messages, next_cursor = await ChatMessageService.get_conversation(wxid, peer_wxid, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+
+    page = ChatMessagePage(
+        messages=[ChatMessageResponse.model_validate(message) for message in messages],
+        next_cursor=next_cursor
+    )
+    return await encrypt_response_body(request, page)
+
+
+@router.get("/chat/search")
+async def search_chat_messages(
+    request: Request,
+    wxid: str,
+    keyword: str,
+    peer_wxid: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50
+):
+    """在微信账号的聊天记录中按关键词搜索（可限定好友，按时间倒序，使用next_cursor翻页）"""
+    keyword = keyword.strip()
+    if not keyword:
+        raise HTTPException(status_code=400, detail="关键词不能为空")
+
+    try:
+        messages, next_cursor = await ChatMessageService.search(wxid, keyword, peer_wxid, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
+
+    page = ChatMessagePage(
+        messages=[ChatMessageResponse.model_validate(message) for message in messages],
+        next_cursor=next_cursor
+    )
+    return await encrypt_response_body(request, page)
@@ -1,23 +1,41 @@
 """
 命令API接口
 """
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse, FileResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import List
+from sqlalchemy import select, update
+from typing import List, Optional, Tuple
+import asyncio
 import uuid
 from datetime import datetime
 
 from app.models.database import AsyncSessionLocal, Command
-from app.models.schemas import CommandRequest, CommandResponse
+from app.models.schemas import (
+    CommandRequest, CommandResponse, CommandBatchRequest, CommandBatchItem, CommandBatchError, CommandBatchResponse,
+    CommandLogPage
+)
+from app.services.log_store import log_store, machine_log_id, iter_string_chunks, LogTooLarge, LogCursorMismatch
 from app.websocket.websocket_manager import websocket_manager
+from app.websocket.command_events import command_events, is_finished, OPEN_STATUSES
 from app.utils.http_request_decrypt import decrypt_request_body
-from app.utils.encryption_service import encryption_service
+from app.utils.http_response_encrypt import encrypt_response_body
+from app.utils.cpu_executor import CpuExecutorBusy
 import json
-import base64
 
 router = APIRouter()
 
+# 长轮询最长等待时间（秒）
+MAX_WAIT_TIMEOUT = 60
+# SSE心跳间隔（秒），同时用于检测客户端断开
+SSE_HEARTBEAT_INTERVAL = 15
+# SSE单次订阅最多的命令ID数量
+MAX_SSE_COMMAND_IDS = 100
+# 批量创建命令的最大数量
+MAX_BATCH_COMMANDS = 1000
+# get_logs命令完成时推送给App端的最后日志行数
+LOG_PUSH_TAIL_LINES = 2000
+
 
 def json_serial(obj):
     """JSON序列化辅助函数，处理datetime对象"""
@@ -39,70 +57,204 @@ async def create_command(request: Request):
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"请求体格式错误: {str(e)}")
         
-        async with AsyncSessionLocal() as session:
-            try:
-                command_id = str(uuid.uuid4())
-                
-                # 保存到数据库
-                command = Command(
-                    command_id=command_id,
-                    command_type=command_request.command_type,
-                    command_data=json.dumps(command_request.command_data, default=json_serial),
-                    target_we_chat_id=command_request.target_we_chat_id or "",  # 如果为空则使用空字符串
-                    status="pending"
-                )
-                session.add(command)
-                await session.commit()
-
-                # 通过WebSocket转发到Windows端
-                await websocket_manager.send_to_windows_client({
-                    "type": "command",
-                    "command_id": command_id,
-                    "command_type": command_request.command_type,
-                    "command_data": command_request.command_data,
-                    "target_we_chat_id": command_request.target_we_chat_id or ""  # 如果为空则使用空字符串
-                })
-
-                from datetime import datetime
-                return CommandResponse(
-                    command_id=command_id,
-                    command_type=command_request.command_type,
-                    status="pending",
-                    result=None,
-                    created_at=datetime.utcnow()
-                )
-            except Exception as e:
-                await session.rollback()
-                raise HTTPException(status_code=500, detail=f"创建命令失败: {str(e)}")
+        try:
+            # 保存到数据库并通过WebSocket下发到Windows端（按target_we_chat_id选择负载最低的Windows端）
+            # 目标Windows端不在线时命令保持pending，上线后按顺序下发，超过下发期限仍未确认则标记为失败
+            command = await websocket_manager.command_dispatcher.submit(Command(
+                command_id=str(uuid.uuid4()),
+                command_type=command_request.command_type,
+                command_data=json.dumps(command_request.command_data, default=json_serial),
+                target_we_chat_id=command_request.target_we_chat_id or ""  # 如果为空则使用空字符串
+            ))
+
+            return _command_response(command)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"创建命令失败: {str(e)}")
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"处理命令失败: {str(e)}")
 
 
-@router.get("/commands/{command_id}", response_model=CommandResponse)
-async def get_command(command_id: str):
-    """获取命令状态"""
+async def _load_command(command_id: str) -> Command:
+    """查询命令，不存在时返回404"""
     async with AsyncSessionLocal() as session:
         try:
             stmt = select(Command).where(Command.command_id == command_id)
             result = await session.execute(stmt)
             command = result.scalar_one_or_none()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
 
-            if not command:
-                raise HTTPException(status_code=404, detail="命令不存在")
+    if not command:
+        raise HTTPException(status_code=404, detail="命令不存在")
+    return command
 
-            return CommandResponse(
-                command_id=command.command_id,
-                command_type=command.command_type,
-                status=command.status,
-                result=command.result,
-                created_at=command.created_at
-            )
-        except HTTPException:
-            raise
+
+def _command_response(command: Command) -> CommandResponse:
+    return CommandResponse(
+        command_id=command.command_id,
+        command_type=command.command_type,
+        status=command.status,
+        result=command.result,
+        created_at=command.created_at
+    )
+
+
+def _sse_event(event: dict) -> str:
+    """格式化一条SSE事件"""
+    data = json.dumps(event, ensure_ascii=False, default=json_serial)
+    return f"event: {event['type']}\ndata: {data}\n\n"
+
+
+@router.get("/commands/events")
+async def command_events_stream(
+    request: Request,
+    command_id: Optional[List[str]] = Query(None),
+    target_we_chat_id: Optional[str] = None
+):
+    """以SSE推送命令状态变化
+
+    可按命令ID（可重复传入多个）或目标微信账号过滤，都不传时推送全部命令。
+    按命令ID订阅时先推送这些命令的当前状态，全部命令结束后关闭连接。
+    """
+    command_ids = list(dict.fromkeys(command_id or []))
+    if len(command_ids) > MAX_SSE_COMMAND_IDS:
+        raise HTTPException(status_code=400, detail=f"命令ID数量不能超过{MAX_SSE_COMMAND_IDS}")
+
+    async def stream():
+        # 先订阅再查询当前状态，避免错过查询期间的状态变化
+        subscription = command_events.subscribe(command_ids, target_we_chat_id)
+        try:
+            remaining = set(command_ids)
+            if command_ids:
+                async with AsyncSessionLocal() as session:
+                    result = await session.execute(select(Command).where(Command.command_id.in_(command_ids)))
+                    commands = result.scalars().all()
+                for command in commands:
+                    yield _sse_event({
+                        "type": "command_status",
+                        "command_id": command.command_id,
+                        "command_type": command.command_type,
+                        "status": command.status,
+                        "result": command.result,
+                        "target_we_chat_id": command.target_we_chat_id or "",
+                        "timestamp": None,
+                    })
+                    if is_finished(command.status):
+                        remaining.discard(command.command_id)
+                # 不存在的命令不再等待
+                remaining &= {command.command_id for command in commands}
+                if not remaining:
+                    return
+            else:
+                yield ": connected\n\n"
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": ping\n\n"
+                    continue
+                yield _sse_event(event)
+                if command_ids and is_finished(event["status"]):
+                    remaining.discard(event["command_id"])
+                    if not remaining:
+                        return
+        finally:
+            command_events.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/commands/batch", response_model=CommandBatchResponse)
+async def create_commands_batch(request: Request):
+    """批量创建命令（如给多个好友发送同一条消息）
+
+    请求体为 {"commands": [CommandRequest, ...]}，每条命令单独校验：
+    校验通过的命令在一个事务中保存并连续下发，校验失败的命令在errors中返回其位置和原因
+    """
+    try:
+        decrypted_body = await decrypt_request_body(request)
+        try:
+            batch_request = CommandBatchRequest.model_validate(decrypted_body)
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+            raise HTTPException(status_code=400, detail=f"请求体格式错误: {str(e)}")
+        if len(batch_request.commands) > MAX_BATCH_COMMANDS:
+            raise HTTPException(status_code=400, detail=f"单次最多创建{MAX_BATCH_COMMANDS}条命令")
+
+        indexes: List[int] = []
+        commands: List[Command] = []
+        errors: List[CommandBatchError] = []
+        for index, item in enumerate(batch_request.commands):
+            try:
+                command_request = CommandRequest.model_validate(item)
+                command_data = json.dumps(command_request.command_data, default=json_serial)
+            except Exception as e:
+                errors.append(CommandBatchError(index=index, error=str(e)))
+                continue
+            indexes.append(index)
+            commands.append(Command(
+                command_id=str(uuid.uuid4()),
+                command_type=command_request.command_type,
+                command_data=command_data,
+                target_we_chat_id=command_request.target_we_chat_id or ""
+            ))
+
+        try:
+            commands = await websocket_manager.command_dispatcher.submit_many(commands)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"创建命令失败: {str(e)}")
+
+        return CommandBatchResponse(
+            commands=[
+                CommandBatchItem(index=index, **_command_response(command).model_dump())
+                for index, command in zip(indexes, commands)
+            ],
+            errors=errors
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"处理命令失败: {str(e)}")
+
+
+@router.get("/commands/{command_id}", response_model=CommandResponse)
+async def get_command(command_id: str):
+    """获取命令状态"""
+    return _command_response(await _load_command(command_id))
+
+
+@router.get("/commands/{command_id}/wait", response_model=CommandResponse)
+async def wait_command_result(command_id: str, timeout: float = 30):
+    """等待命令执行结果（长轮询）
+
+    命令已结束时立即返回；否则等待到命令结束或超时（最长60秒），
+    超时返回等待开始时的状态（status仍为pending/dispatched/acked），客户端可以再次调用
+    """
+    timeout = max(0.0, min(timeout, MAX_WAIT_TIMEOUT))
+    # 先注册再查询，避免错过查询期间到达的结果
+    future = command_events.register_waiter(command_id)
+    try:
+        command = await _load_command(command_id)
+    except HTTPException:
+        command_events.remove_waiter(command_id, future)
+        raise
+    if is_finished(command.status) or timeout == 0:
+        command_events.remove_waiter(command_id, future)
+        return _command_response(command)
+
+    event = await command_events.wait(command_id, future, timeout)
+    if event is not None:
+        command.status = event["status"]
+        command.result = event["result"]
+    return _command_response(command)
 
 
 @router.post("/commands/{command_id}/result")
@@ -115,75 +267,213 @@ async def update_command_result(command_id: str, request: Request):
         # 解析为字典
         if not isinstance(decrypted_body, dict):
             raise HTTPException(status_code=400, detail="请求体格式错误：必须是JSON对象")
-        
-        async with AsyncSessionLocal() as session:
+
+        command = await _load_command(command_id)
+        status = decrypted_body.get("status", "completed")
+        result_data = decrypted_body.get("result", "")
+        app_result = None
+
+        # 旧版本Windows端在结果JSON中返回整个加密日志，同样解密后保存到日志存储
+        if command.command_type == "get_logs" and status == "completed":
             try:
-                stmt = select(Command).where(Command.command_id == command_id)
-                result_query = await session.execute(stmt)
-                command = result_query.scalar_one_or_none()
-
-                if not command:
-                    raise HTTPException(status_code=404, detail="命令不存在")
-
-                command.status = decrypted_body.get("status", "completed")
-                result_data = decrypted_body.get("result", "")
-                
-                # 如果是get_logs命令，需要解密日志内容
-                if command.command_type == "get_logs" and command.status == "completed":
-                    try:
-                        result_json = json.loads(result_data) if isinstance(result_data, str) else result_data
-                        encrypted_log_content = result_json.get("encrypted_log_content", "")
-                        machine_id = result_json.get("machine_id", "")
-                        
-                        if encrypted_log_content and machine_id:
-                            # 根据机器ID生成密钥
-                            encryption_key = encryption_service.get_encryption_key_from_machine_id(machine_id)
-                            
-                            # 解密日志内容（逐行解密）
-                            decrypted_log_lines = []
-                            log_lines = encrypted_log_content.strip().split('\n')
-                            for line in log_lines:
-                                line = line.strip()
-                                if not line:
-                                    continue
-                                try:
-                                    # 使用生成的密钥解密每一行
-                                    decrypted_line = encryption_service._decrypt_bytes_with_key(
-                                        base64.b64decode(line), encryption_key
-                                    ).decode('utf-8')
-                                    decrypted_log_lines.append(decrypted_line)
-                                except Exception as e:
-                                    # 如果某行解密失败，跳过或记录错误
-                                    print(f"解密日志行失败: {e}")
-                                    continue
-                            
-                            # 更新结果，包含解密后的日志内容
-                            result_json["decrypted_log_content"] = "\n".join(decrypted_log_lines)
-                            result_data = json.dumps(result_json, ensure_ascii=False, default=json_serial)
-                    except Exception as e:
-                        print(f"处理get_logs命令结果失败: {e}")
-                        # 如果解密失败，使用原始结果
-                        pass
-                
-                command.result = str(result_data)
-                await session.commit()
-
-                # 通知App端命令执行结果
-                await websocket_manager.send_to_app_client({
-                    "type": "command_result",
-                    "command_id": command_id,
-                    "status": command.status,
-                    "result": command.result
-                })
-
-                return {"success": True}
-            except HTTPException:
-                raise
+                result_json = json.loads(result_data) if isinstance(result_data, str) else result_data
+                encrypted_log_content = result_json.get("encrypted_log_content", "")
+                machine_id = result_json.get("machine_id", "")
+
+                if encrypted_log_content and machine_id:
+                    result_data, app_result = await _store_logs(
+                        command, machine_id, result_json.get("log_file_name", ""),
+                        iter_string_chunks(encrypted_log_content)
+                    )
+            except LogTooLarge as e:
+                status, result_data = "failed", str(e)
             except Exception as e:
-                await session.rollback()
-                raise HTTPException(status_code=500, detail=f"更新失败: {str(e)}")
+                print(f"处理get_logs命令结果失败: {e}")
+                # 如果解密失败，使用原始结果
+                pass
+
+        await _finish_command(command, status, str(result_data), app_result)
+        return {"success": True}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"处理请求失败: {str(e)}")
 
+
+async def _finish_command(command: Command, status: str, result: str, app_result: Optional[str] = None) -> bool:
+    """保存命令结果，并通知等待结果的请求、SSE订阅者和App端
+
+    只更新尚未结束的命令（pending/dispatched/acked），已结束的命令保持原来的状态和结果
+
+    Args:
+        app_result: 推送给App端的结果（为空时与保存的结果相同）
+
+    Returns:
+        bool: 是否已保存（命令已结束时返回False）
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            updated = await session.execute(
+                update(Command)
+                .where(Command.command_id == command.command_id, Command.status.in_(OPEN_STATUSES))
+                .values(status=status, result=result, next_attempt_at=None)
+            )
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            raise HTTPException(status_code=500, detail=f"更新失败: {str(e)}")
+    if not updated.rowcount:
+        print(f"命令已结束，忽略新的结果: {command.command_id}, 状态: {status}")
+        return False
+
+    command.status = status
+    command.result = result
+    websocket_manager.command_finished(command.command_id)
+    # 通知等待结果的请求和SSE订阅者
+    command_events.publish(
+        command.command_id, command.status, command.result,
+        command.target_we_chat_id, command.command_type
+    )
+
+    # 通知App端命令执行结果
+    await websocket_manager.send_to_app_client({
+        "type": "command_result",
+        "command_id": command.command_id,
+        "status": command.status,
+        "result": app_result if app_result is not None else command.result
+    })
+    return True
+
+
+async def _store_logs(
+    command: Command, machine_id: str, log_file_name: str, chunks, offset: int = 0, complete_lines_only: bool = False
+) -> Tuple[str, str]:
+    """解密并保存get_logs命令返回的日志（追加到该Windows机器的日志）
+
+    Returns:
+        Tuple[str, str]: (保存到数据库的结果（只包含日志引用和统计）, 推送给App端的结果（附带App端尚未显示的日志行）)
+    """
+    stats = await log_store.ingest_machine_log(
+        machine_id, command.target_we_chat_id or "", log_file_name, offset, chunks, complete_lines_only
+    )
+    if stats.failed_lines:
+        print(f"解密日志行失败: command_id={command.command_id}, 失败行数={stats.failed_lines}")
+    log_id = machine_log_id(machine_id)
+    summary = {
+        "log_file_name": log_file_name,
+        "machine_id": machine_id,
+        "log_ref": log_id,
+        "log_url": f"/api/commands/{command.command_id}/logs",
+        "from_line": stats.first_line,
+        "new_lines": stats.lines,
+        "total_lines": stats.total_lines,
+        "source_offset": offset + stats.consumed_bytes,
+        "raw_bytes": stats.raw_bytes,
+        "stored_bytes": stats.stored_bytes,
+        "failed_lines": stats.failed_lines,
+    }
+
+    # App端在command_data中传入已显示到的行号（cursor）和日志文件名（cursor_log_file_name）时只推送之后的行，
+    # 日志已从头保存、文件已切换或新增行数过多时推送最后若干行，App端替换显示的内容
+    try:
+        command_data = json.loads(command.command_data or "{}")
+        app_cursor = int(command_data.get("cursor"))
+        same_log = offset > 0 and command_data.get("cursor_log_file_name") == log_file_name
+    except (TypeError, ValueError, AttributeError):
+        app_cursor, same_log = None, False
+    total = stats.total_lines
+    reset = not same_log or app_cursor is None or not 0 <= app_cursor <= total or total - app_cursor > LOG_PUSH_TAIL_LINES
+    from_line = max(total - LOG_PUSH_TAIL_LINES, 0) if reset else app_cursor
+    lines, _ = await log_store.read_lines(log_id, from_line, total - from_line) if total > from_line else ([], total)
+    # App端直接显示decrypted_log_content，完整日志通过分页接口读取
+    app_result = dict(
+        summary,
+        decrypted_log_content="\n".join(lines),
+        from_line=from_line,
+        reset=reset,
+        truncated=reset and from_line > 0
+    )
+    return (
+        json.dumps(summary, ensure_ascii=False),
+        json.dumps(app_result, ensure_ascii=False)
+    )
+
+
+@router.post("/commands/{command_id}/logs")
+async def upload_command_logs(
+    command_id: str, request: Request, machine_id: str, log_file_name: str = "", offset: int = 0
+):
+    """上传get_logs命令的日志（Windows端调用）
+
+    请求体为日志文件从offset字节开始的内容（每行一条base64编码的加密日志），边接收边按块并行解密、压缩保存，
+    不在内存中保留整个日志；完成后命令标记为completed。
+    offset为get_logs命令的command_data中服务器返回的偏移（日志文件名相同时），从头上传时为0；
+    与服务器记录的偏移不一致时返回409，Windows端应从头上传；命令已结束时返回410，Windows端不应重新上传
+    """
+    command = await _load_command(command_id)
+    if command.command_type != "get_logs":
+        raise HTTPException(status_code=400, detail="只有get_logs命令可以上传日志")
+    if is_finished(command.status):
+        raise HTTPException(status_code=410, detail="命令已结束")
+
+    try:
+        result, app_result = await _store_logs(
+            command, machine_id, log_file_name, request.stream(), max(offset, 0), complete_lines_only=True
+        )
+    except LogCursorMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except LogTooLarge as e:
+        await _finish_command(command, "failed", str(e))
+        raise HTTPException(status_code=413, detail=str(e))
+    except CpuExecutorBusy:
+        raise HTTPException(status_code=503, detail="服务器繁忙，请稍后重试")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not await _finish_command(command, "completed", result, app_result):
+        # 上传期间命令已结束（如已超期），日志仍已保存
+        raise HTTPException(status_code=410, detail="命令已结束")
+    return {"success": True, "result": json.loads(result)}
+
+
+async def _command_log(command: Command) -> Tuple[str, str]:
+    """get_logs命令结果中的日志ID和该机器当前的日志文件名，日志不存在时返回404"""
+    try:
+        result = json.loads(command.result or "{}")
+        log_id, machine_id = result.get("log_ref") or "", result.get("machine_id") or ""
+    except (ValueError, AttributeError):
+        log_id, machine_id = "", ""
+    if command.command_type != "get_logs" or not log_id or log_store.log_path(log_id) is None:
+        raise HTTPException(status_code=404, detail="日志不存在")
+    # 同一台机器的日志会随之后的get_logs命令增长或切换到新的日志文件
+    cursor = await log_store.get_cursor(machine_id) if machine_id else None
+    return log_id, cursor.log_file_name if cursor else result.get("log_file_name") or ""
+
+
+@router.get("/commands/{command_id}/logs")
+async def get_command_logs(request: Request, command_id: str, offset: int = 0, limit: int = 500):
+    """分页读取get_logs命令所属Windows机器的日志（按行，offset从0开始，单页最多5000行）
+
+    传入上次的next_offset（或total_lines）即可只读取之后新增的行；log_file_name变化表示日志已切换，需要从0开始读取
+    """
+    log_id, log_file_name = await _command_log(await _load_command(command_id))
+    offset = max(offset, 0)
+    lines, total = await log_store.read_lines(log_id, offset, limit)
+    next_offset = offset + len(lines)
+    page = CommandLogPage(
+        command_id=command_id,
+        log_file_name=log_file_name,
+        offset=offset,
+        lines=lines,
+        total_lines=total,
+        next_offset=next_offset if next_offset < total else None
+    )
+    return await encrypt_response_body(request, page)
+
+
+@router.get("/commands/{command_id}/logs/download")
+async def download_command_logs(command_id: str):
+    """下载get_logs命令的完整日志（gzip压缩，支持Range断点续传）"""
+    log_id, log_file_name = await _command_log(await _load_command(command_id))
+    file_name = log_file_name or f"{command_id}.txt"
+    return FileResponse(log_store.log_path(log_id), media_type="application/gzip", filename=f"{file_name}.gz")
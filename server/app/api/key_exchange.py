@@ -7,6 +7,7 @@ import json
 import base64
 
 from app.utils.rsa_key_manager import rsa_key_manager
+from app.utils.cpu_executor import CpuExecutorBusy
 from app.utils.encryption_service import encryption_service
 from app.utils.http_session_manager import http_session_manager
 from app.utils.http_request_decrypt import decrypt_request_body
@@ -40,10 +41,10 @@ async def exchange_session_key(request: Request):
             raise HTTPException(status_code=400, detail="缺少 encrypted_key 参数")
         
         # 使用RSA私钥解密会话密钥
-        session_key = rsa_key_manager.decrypt_session_key(encrypted_key)
+        session_key = await rsa_key_manager.decrypt_session_key_async(encrypted_key)
         
         # 创建HTTP会话
-        session_id = http_session_manager.create_session(session_key)
+        session_id = await http_session_manager.create_session(session_key)
         
         return {
             "type": "key_exchange_success",
@@ -51,6 +52,9 @@ async def exchange_session_key(request: Request):
         }
     except HTTPException:
         raise
+    except CpuExecutorBusy as e:
+        # 同时进行密钥交换的客户端过多，稍后重试
+        raise HTTPException(status_code=503, detail=f"密钥交换繁忙，请稍后重试: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"密钥交换失败: {str(e)}")
 
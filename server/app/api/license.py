@@ -15,7 +15,7 @@ from app.models.schemas import (
     ExtendLicenseRequest
 )
 from app.utils.license_generator import generate_license_key
-from app.services.license_service import LicenseService
+from app.services.license_service import LicenseService, license_cache
 from app.utils.http_request_decrypt import decrypt_request_body
 
 router = APIRouter()
@@ -133,6 +133,7 @@ async def create_license(request: Request):
             session.add(new_license)
             await session.commit()
             await session.refresh(new_license)
+            license_cache.invalidate(new_license.phone)
             
             return UserLicenseResponse.model_validate(new_license)
     except HTTPException:
@@ -190,6 +191,7 @@ async def update_license(license_id: int, request: Request):
             
             await session.commit()
             await session.refresh(license)
+            license_cache.invalidate(license.phone)
             
             return UserLicenseResponse.model_validate(license)
     except HTTPException:
@@ -215,6 +217,7 @@ async def delete_license(license_id: int):
             license.updated_at = datetime.utcnow()
             
             await session.commit()
+            license_cache.invalidate(license.phone)
             
             return {"message": "删除成功"}
     except HTTPException:
@@ -267,6 +270,7 @@ async def extend_license(license_id: int, request: Request):
             
             await session.commit()
             await session.refresh(license)
+            license_cache.invalidate(license.phone)
             
             return UserLicenseResponse.model_validate(license)
     except HTTPException:
@@ -308,6 +312,7 @@ async def generate_new_key(license_id: int, request: Request):
             
             await session.commit()
             await session.refresh(license)
+            license_cache.invalidate(license.phone)
             
             return UserLicenseResponse.model_validate(license)
     except HTTPException:
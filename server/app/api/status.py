@@ -4,6 +4,13 @@
 """
 from fastapi import APIRouter
 from app.websocket.websocket_manager import websocket_manager
+from app.utils.encryption_service import encryption_service
+from app.services.license_service import license_cache
+from app.services.log_store import log_store
+from app.services.account_buffer import account_buffer
+from app.utils.key_derivation import key_derivation_service
+from app.utils.rsa_key_manager import rsa_executor
+from app.utils.http_session_manager import http_session_manager
 
 router = APIRouter()
 
@@ -23,6 +30,19 @@ async def get_status():
         "app": {
             "status": "connected" if len(websocket_manager.app_clients) > 0 else "disconnected",
             "connected_count": len(websocket_manager.app_clients)
+        },
+        "outbound_queues": websocket_manager.get_queue_stats(),
+        "compression": encryption_service.get_compression_stats(),
+        "commands": await websocket_manager.command_dispatcher.get_stats(),
+        "license_cache": license_cache.get_stats(),
+        "key_derivation": key_derivation_service.get_stats(),
+        "rsa_executor": rsa_executor.get_stats(),
+        "log_store": log_store.get_stats(),
+        "account_buffer": account_buffer.get_stats(),
+        "message_bus": websocket_manager.bus.get_stats(),
+        "crypto_sessions": {
+            "websocket": encryption_service.get_session_stats(),
+            "http": await http_session_manager.get_stats()
         }
     }
 
@@ -12,8 +12,15 @@ from typing import List, Dict
 import os
 
 from app.models import database
-from app.api import commands, status, account, license, key_exchange
+from app.api import commands, status, account, license, key_exchange, chat_messages
 from app.websocket.websocket_manager import websocket_manager
+from app.utils.key_derivation import key_derivation_service
+from app.utils.rsa_key_manager import rsa_executor
+from app.utils.http_session_manager import http_session_manager, session_store_executor
+from app.services.log_store import log_executor
+from app.services.account_buffer import account_buffer
+from app.websocket.message_payload import MessagePayload
+from app.websocket.envelope import ENVELOPE_MAGIC
 
 app = FastAPI(title="MyWeChat后端服务", version="1.0.0")
 
@@ -37,6 +44,7 @@ app.include_router(commands.router, prefix="/api", tags=["命令"])
 app.include_router(status.router, prefix="/api", tags=["状态"])
 app.include_router(account.router, prefix="/api", tags=["账号信息"])
 app.include_router(license.router, prefix="/api", tags=["授权管理"])
+app.include_router(chat_messages.router, prefix="/api", tags=["聊天记录"])
 
 
 @app.on_event("startup")
@@ -45,11 +53,28 @@ async def startup_event():
     # 初始化数据库
     await database.init_db()
     print("数据库初始化完成")
+    # 启动命令下发清扫任务（重新下发未确认的命令、标记超期命令）
+    websocket_manager.command_dispatcher.start()
+    # 连接跨worker进程的消息总线（单进程运行时为空实现）
+    websocket_manager.start_message_bus()
+    # 启动HTTP会话过期清扫任务
+    http_session_manager.start()
+    # 启动账号信息写缓冲的后台写入任务
+    account_buffer.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭事件"""
+    await websocket_manager.command_dispatcher.stop()
+    await websocket_manager.bus.stop()
+    await http_session_manager.stop()
+    # 写入缓冲中剩余的账号信息（需在关闭数据库连接之前）
+    await account_buffer.stop()
+    key_derivation_service.shutdown()
+    rsa_executor.shutdown()
+    log_executor.shutdown()
+    session_store_executor.shutdown()
     await database.close_db()
     print("数据库连接已关闭")
 
@@ -60,41 +85,59 @@ async def root():
     return {"message": "MyWeChat后端服务", "version": "1.0.0"}
 
 
+def _decode_text_frame(websocket: WebSocket, data: str) -> MessagePayload:
+    """解码文本帧：{"encrypted": true, "data": "<base64>"} 加密消息或明文JSON"""
+    # 尝试解密消息（如果客户端发送的是加密消息）
+    # 消息载荷保存明文，转发时直接复用，避免重新序列化；信封格式只解析头部
+    try:
+        message_obj = json.loads(data)
+        if isinstance(message_obj, dict) and message_obj.get("encrypted") == True and message_obj.get("data"):
+            # 加密消息，需要解密（使用会话密钥）
+            encrypted_data = message_obj["data"]
+            ctx = websocket_manager.get_context(websocket)
+            if ctx is not None and ctx.has_session_key():
+                return websocket_manager.decrypt_payload(ctx, encrypted_data)
+            # 会话密钥未设置，可能是密钥交换阶段，使用明文
+            return MessagePayload(message_obj)
+        # 非加密消息，直接使用
+        return MessagePayload(message_obj, text=data)
+    except:
+        # 解析失败，可能是非JSON格式（如明文信封），直接使用原始数据
+        try:
+            if data.startswith(ENVELOPE_MAGIC.decode("ascii")):
+                return MessagePayload.decode(data.encode("utf-8"))
+            return MessagePayload(json.loads(data), text=data)
+        except:
+            return MessagePayload({"type": "unknown", "data": data})
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket端点"""
-    from app.utils.encryption_service import encryption_service
-    
+    """WebSocket端点（同时接受文本帧和二进制帧）"""
     await websocket_manager.connect(websocket)
     try:
         while True:
-            data = await websocket.receive_text()
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
             
-            # 尝试解密消息（如果客户端发送的是加密消息）
-            try:
-                message_obj = json.loads(data)
-                if isinstance(message_obj, dict) and message_obj.get("encrypted") == True and message_obj.get("data"):
-                    # 加密消息，需要解密（使用会话密钥）
-                    encrypted_data = message_obj["data"]
-                    connection_id = str(id(websocket))
-                    if encryption_service.has_session_key(connection_id):
-                        decrypted_data = encryption_service.decrypt_string_for_communication(connection_id, encrypted_data)
-                        message = json.loads(decrypted_data)
-                    else:
-                        # 会话密钥未设置，可能是密钥交换阶段，使用明文
-                        message = message_obj
-                else:
-                    # 非加密消息，直接使用
-                    message = message_obj
-            except:
-                # 解析失败，可能是非JSON格式，直接使用原始数据
+            frame_bytes = frame.get("bytes")
+            if frame_bytes is not None:
+                # 二进制帧：nonce(12字节) + ciphertext + tag(16字节)，使用会话密钥解密
+                ctx = websocket_manager.get_context(websocket)
+                if ctx is None or not ctx.has_session_key():
+                    print("收到二进制帧但会话密钥未设置，忽略")
+                    continue
                 try:
-                    message = json.loads(data)
-                except:
-                    message = {"type": "unknown", "data": data}
+                    payload = websocket_manager.decrypt_frame(ctx, frame_bytes)
+                except Exception as e:
+                    print(f"解密二进制帧失败: {e}")
+                    continue
+            else:
+                payload = _decode_text_frame(websocket, frame.get("text") or "")
             
             # 处理消息
-            await websocket_manager.handle_message(websocket, message)
+            await websocket_manager.handle_payload(websocket, payload)
     except WebSocketDisconnect:
         websocket_manager.disconnect(websocket)
     except Exception as e:
@@ -1,16 +1,19 @@
 """
 数据库模型和连接管理
+引擎按配置档创建（见 engine_config：SQLite WAL参数、连接池、PostgreSQL/asyncpg）
 """
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Index, UniqueConstraint
 from datetime import datetime
+from app.models.engine_config import load_engine_config, create_engine, describe
 
-# 数据库配置
-DATABASE_URL = "sqlite+aiosqlite:///./my_wechat.db"
+# 数据库配置（配置档默认值 < MYWECHAT_DB_CONFIG配置文件 < 环境变量）
+engine_config = load_engine_config()
+DATABASE_URL = engine_config["url"]
 
 # 创建异步引擎
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = create_engine(engine_config)
 
 # 创建异步会话工厂
 AsyncSessionLocal = async_sessionmaker(
@@ -30,11 +33,21 @@ class Command(Base):
     command_type = Column(String(100), comment="命令类型")
     command_data = Column(Text, comment="命令数据（JSON格式）")
     target_we_chat_id = Column(String(100), comment="目标微信ID")
-    status = Column(String(50), default="pending", comment="状态：pending, processing, completed, failed")
+    status = Column(String(50), default="pending", comment="状态：pending, dispatched, acked, completed, failed")
     result = Column(Text, comment="执行结果")
+    attempts = Column(Integer, default=0, comment="下发次数")
+    dispatched_to = Column(String(100), comment="最近一次下发的Windows端连接ID")
+    dispatched_at = Column(DateTime, comment="最近一次下发时间")
+    acked_at = Column(DateTime, comment="Windows端确认收到的时间")
+    next_attempt_at = Column(DateTime, comment="下次重试时间（为空表示等待Windows端上线）")
+    deadline_at = Column(DateTime, comment="下发期限，超过仍未确认则标记为失败")
     created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment="更新时间")
 
+    __table_args__ = (
+        Index("ix_commands_status_target", "status", "target_we_chat_id", "id"),
+    )
+
 
 class AccountInfo(Base):
     """账号信息表"""
@@ -70,11 +83,162 @@ class UserLicense(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment="更新时间")
 
 
+class Contact(Base):
+    """联系人表（每个微信账号的最新好友列表，按FriendId唯一）"""
+    __tablename__ = "contacts"
+    __table_args__ = (
+        UniqueConstraint("wxid", "friend_id", name="uq_contacts_wxid_friend_id"),
+        Index("ix_contacts_wxid_version", "wxid", "version"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    wxid = Column(String(100), nullable=False, comment="所属微信ID")
+    friend_id = Column(String(100), nullable=False, comment="好友ID（FriendId）")
+    content_hash = Column(String(64), comment="联系人内容哈希（用于计算增量）")
+    data = Column(Text, comment="联系人数据（JSON格式，与sync_contacts中的单条记录相同）")
+    version = Column(Integer, default=0, comment="最后一次变更时的联系人版本号")
+    created_version = Column(Integer, default=0, comment="新增时的联系人版本号")
+    deleted = Column(Boolean, default=False, comment="是否已删除（保留删除记录用于计算增量）")
+    created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment="更新时间")
+
+
+class ContactSyncState(Base):
+    """联系人同步状态表（每个微信账号的当前联系人版本号）"""
+    __tablename__ = "contact_sync_state"
+
+    id = Column(Integer, primary_key=True, index=True)
+    wxid = Column(String(100), unique=True, index=True, comment="微信ID")
+    version = Column(Integer, default=0, comment="当前联系人版本号（每次有变更时加1）")
+    contact_count = Column(Integer, default=0, comment="当前联系人数量")
+    created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment="更新时间")
+
+
+class LogCursor(Base):
+    """日志增量读取位置表（每台Windows机器已上传到的日志文件和字节偏移）"""
+    __tablename__ = "log_cursors"
+
+    id = Column(Integer, primary_key=True, index=True)
+    machine_id = Column(String(200), unique=True, index=True, comment="Windows端机器ID")
+    we_chat_id = Column(String(100), index=True, comment="最近一次上传日志的Windows端微信ID")
+    log_file_name = Column(String(255), comment="当前日志文件名（日志文件切换后从头读取）")
+    source_offset = Column(Integer, default=0, comment="已上传到的日志文件字节偏移")
+    total_lines = Column(Integer, default=0, comment="服务器已保存的日志行数")
+    created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment="更新时间")
+
+
+class ChatMessage(Base):
+    """聊天消息表（按msg_id去重，SQLite下同步维护FTS5全文索引）"""
+    __tablename__ = "chat_messages"
+    __table_args__ = (
+        Index("ix_chat_messages_wxid_peer_time", "wxid", "peer_wxid", "send_time", "id"),
+        Index("ix_chat_messages_wxid_id", "wxid", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    msg_id = Column(String(100), unique=True, nullable=False, comment="微信消息ID")
+    wxid = Column(String(100), nullable=False, comment="所属微信ID（当前登录账号）")
+    peer_wxid = Column(String(100), nullable=False, comment="会话对方微信ID")
+    send_wxid = Column(String(100), comment="发送方微信ID")
+    receive_wxid = Column(String(100), comment="接收方微信ID")
+    send_type = Column(Integer, default=0, comment="发送类型：1-自己发送，0-接收")
+    send_time = Column(DateTime, nullable=False, comment="发送时间（UTC）")
+    text = Column(Text, comment="消息内容")
+    created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
+
+
+# 聊天消息全文索引（SQLite FTS5外部内容表，trigram分词支持中文子串搜索，关键词至少3个字符）
+# wxid、peer_wxid为不分词的列，搜索时在全文索引内按账号过滤，按rowid倒序取满一页即停止
+CHAT_MESSAGES_FTS_TABLE = "chat_messages_fts"
+_CHAT_MESSAGES_FTS_COLUMNS = "text, wxid, peer_wxid"
+_CHAT_MESSAGES_FTS_TRIGGERS = ("chat_messages_fts_ai", "chat_messages_fts_ad", "chat_messages_fts_au")
+_CHAT_MESSAGES_FTS_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {CHAT_MESSAGES_FTS_TABLE} USING fts5(
+        text, wxid UNINDEXED, peer_wxid UNINDEXED, content='chat_messages', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ai AFTER INSERT ON chat_messages BEGIN
+        INSERT INTO {CHAT_MESSAGES_FTS_TABLE}(rowid, {_CHAT_MESSAGES_FTS_COLUMNS}) VALUES (new.id, new.text, new.wxid, new.peer_wxid);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ad AFTER DELETE ON chat_messages BEGIN
+        INSERT INTO {CHAT_MESSAGES_FTS_TABLE}({CHAT_MESSAGES_FTS_TABLE}, rowid, {_CHAT_MESSAGES_FTS_COLUMNS}) VALUES ('delete', old.id, old.text, old.wxid, old.peer_wxid);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_messages_fts_au AFTER UPDATE OF text, wxid, peer_wxid ON chat_messages BEGIN
+        INSERT INTO {CHAT_MESSAGES_FTS_TABLE}({CHAT_MESSAGES_FTS_TABLE}, rowid, {_CHAT_MESSAGES_FTS_COLUMNS}) VALUES ('delete', old.id, old.text, old.wxid, old.peer_wxid);
+        INSERT INTO {CHAT_MESSAGES_FTS_TABLE}(rowid, {_CHAT_MESSAGES_FTS_COLUMNS}) VALUES (new.id, new.text, new.wxid, new.peer_wxid);
+    END""",
+]
+
+# 聊天消息全文索引是否可用（init_db时检测，不可用时关键词搜索退回为LIKE扫描）
+chat_fts_enabled = False
+
+
+def dialect_insert(table):
+    """按数据库方言构造支持 ON CONFLICT 的INSERT语句（SQLite/PostgreSQL）"""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def _add_missing_columns(sync_conn):
+    """为已存在的表补充新增的列和索引（create_all不会修改已存在的表）"""
+    from sqlalchemy import inspect
+    inspector = inspect(sync_conn)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=sync_conn.dialect)
+            sync_conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+            print(f"数据库表 {table.name} 已添加列: {column.name}")
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
+async def _drop_outdated_fts(conn) -> bool:
+    """删除不含wxid列的旧版全文索引及其触发器，返回是否需要重建索引"""
+    result = await conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (CHAT_MESSAGES_FTS_TABLE,)
+    )
+    row = result.first()
+    if row is None or "wxid" in row[0]:
+        return False
+    for trigger in _CHAT_MESSAGES_FTS_TRIGGERS:
+        await conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+    await conn.exec_driver_sql(f"DROP TABLE {CHAT_MESSAGES_FTS_TABLE}")
+    return True
+
+
 async def init_db():
     """初始化数据库"""
+    global chat_fts_enabled
+    print(f"数据库: {describe(engine_config)}")
     async with engine.begin() as conn:
+        await conn.run_sync(_add_missing_columns)
         await conn.run_sync(Base.metadata.create_all)
 
+    if engine.dialect.name == "sqlite":
+        try:
+            async with engine.begin() as conn:
+                rebuild = await _drop_outdated_fts(conn)
+                for ddl in _CHAT_MESSAGES_FTS_DDL:
+                    await conn.exec_driver_sql(ddl)
+                if rebuild:
+                    # 按chat_messages重建全文索引
+                    await conn.exec_driver_sql(f"INSERT INTO {CHAT_MESSAGES_FTS_TABLE}({CHAT_MESSAGES_FTS_TABLE}) VALUES ('rebuild')")
+                    print("聊天消息全文索引已重建")
+            chat_fts_enabled = True
+        except Exception as e:
+            # SQLite版本过低（trigram分词需要3.34+）或未编译FTS5
+            print(f"聊天消息全文索引不可用，关键词搜索将使用LIKE: {e}")
+
 
 async def close_db():
     """关闭数据库连接"""
@@ -0,0 +1,169 @@
+"""
+数据库引擎配置
+按配置档（profile）创建异步引擎，配置档的默认值可被配置文件和环境变量覆盖（环境变量优先）：
+- default: 不输出SQL日志；SQLite使用WAL模式（写入不阻塞读取）和连接时设置的缓存/mmap参数，连接池复用连接
+- debug: 输出全部SQL日志，SQLite保持默认的回滚日志模式，每个会话新建连接（调试用，与旧版本行为相同）
+
+pool_size为0时不使用连接池（每个会话新建连接）
+
+SQLite（sqlite+aiosqlite）和PostgreSQL（postgresql+asyncpg，需要 pip install -r requirements-postgres.txt）使用同一套模型
+"""
+import os
+import json
+import importlib.util
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+
+
+# 默认数据库连接地址
+DEFAULT_DATABASE_URL = "sqlite+aiosqlite:///./my_wechat.db"
+# 默认配置档
+DEFAULT_PROFILE = "default"
+
+# 配置档（SQLite参数对PostgreSQL不生效，值为None的SQLite参数不设置）
+ENGINE_PROFILES: Dict[str, Dict[str, Any]] = {
+    "default": {
+        "echo": False,
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout": 30.0,
+        "pool_recycle": 1800,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,          # 负数表示KB，即每个连接64MB页缓存
+        "mmap_size": 268435456,        # 256MB内存映射读取
+        "busy_timeout": 5000,          # 写锁等待时间（毫秒）
+        "temp_store": "MEMORY",
+    },
+    "debug": {
+        "echo": True,
+        "pool_size": 0,
+        "max_overflow": 10,
+        "pool_timeout": 30.0,
+        "pool_recycle": 1800,
+        "journal_mode": None,
+        "synchronous": None,
+        "cache_size": None,
+        "mmap_size": None,
+        "busy_timeout": None,
+        "temp_store": None,
+    },
+}
+
+# 配置项 -> 环境变量
+_ENV_NAMES = {
+    "url": "MYWECHAT_DATABASE_URL",
+    "echo": "MYWECHAT_DB_ECHO",
+    "pool_size": "MYWECHAT_DB_POOL_SIZE",
+    "max_overflow": "MYWECHAT_DB_MAX_OVERFLOW",
+    "pool_timeout": "MYWECHAT_DB_POOL_TIMEOUT",
+    "pool_recycle": "MYWECHAT_DB_POOL_RECYCLE",
+    "journal_mode": "MYWECHAT_SQLITE_JOURNAL_MODE",
+    "synchronous": "MYWECHAT_SQLITE_SYNCHRONOUS",
+    "cache_size": "MYWECHAT_SQLITE_CACHE_SIZE",
+    "mmap_size": "MYWECHAT_SQLITE_MMAP_SIZE",
+    "busy_timeout": "MYWECHAT_SQLITE_BUSY_TIMEOUT",
+    "temp_store": "MYWECHAT_SQLITE_TEMP_STORE",
+}
+
+# 连接时设置的SQLite参数（配置项 -> PRAGMA名）
+_SQLITE_PRAGMAS = ("journal_mode", "synchronous", "cache_size", "mmap_size", "busy_timeout", "temp_store")
+
+
+def _parse_value(value: str, default: Any) -> Any:
+    """按默认值的类型转换环境变量"""
+    if isinstance(default, bool):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+
+def load_engine_config(config_path: Optional[str] = None) -> Dict[str, Any]:
+    """读取数据库引擎配置（配置档默认值 < 配置文件 < 环境变量）
+
+    Args:
+        config_path: JSON配置文件路径，默认读取环境变量 MYWECHAT_DB_CONFIG（未设置时不读取）
+    """
+    file_config: Dict[str, Any] = {}
+    config_path = config_path or os.getenv("MYWECHAT_DB_CONFIG", "")
+    if config_path:
+        with open(config_path, "r", encoding="utf-8") as f:
+            file_config = json.load(f)
+
+    profile = os.getenv("MYWECHAT_DB_PROFILE") or file_config.get("profile") or DEFAULT_PROFILE
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"不支持的数据库配置档: {profile}（可选: {', '.join(ENGINE_PROFILES)}）")
+
+    config: Dict[str, Any] = dict(ENGINE_PROFILES[profile], url=DEFAULT_DATABASE_URL)
+    for key, value in file_config.items():
+        if key == "profile":
+            continue
+        if key not in config:
+            raise ValueError(f"未知的数据库配置项: {key}")
+        config[key] = value
+    for key, env_name in _ENV_NAMES.items():
+        value = os.getenv(env_name)
+        if value:
+            config[key] = _parse_value(value, config[key])
+    config["profile"] = profile
+    return config
+
+
+def _set_sqlite_pragmas(config: Dict[str, Any], dbapi_connection, connection_record):
+    """新建SQLite连接时设置参数（WAL模式写入数据库文件，其余参数只对当前连接有效）"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name in _SQLITE_PRAGMAS:
+            value = config.get(name)
+            if value is not None and value != "":
+                cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def create_engine(config: Dict[str, Any]) -> AsyncEngine:
+    """按配置创建异步引擎"""
+    url = make_url(config["url"])
+    if config["pool_size"] > 0:
+        kwargs: Dict[str, Any] = {
+            "poolclass": AsyncAdaptedQueuePool,
+            "pool_size": config["pool_size"],
+            "max_overflow": config["max_overflow"],
+            "pool_timeout": config["pool_timeout"],
+        }
+    else:
+        kwargs = {"poolclass": NullPool}
+    if url.get_backend_name() == "sqlite":
+        if not url.database or url.database == ":memory:":
+            # 内存数据库每个连接是独立的数据库，使用SQLAlchemy的默认连接池
+            return create_async_engine(url, echo=config["echo"])
+        # aiosqlite默认每个会话新建连接（NullPool），改为连接池复用连接，连接参数只需在新建连接时设置一次
+        engine = create_async_engine(url, echo=config["echo"], **kwargs)
+        event.listen(
+            engine.sync_engine, "connect",
+            lambda dbapi_connection, connection_record: _set_sqlite_pragmas(config, dbapi_connection, connection_record)
+        )
+        return engine
+    if url.get_backend_name() == "postgresql" and url.get_driver_name() == "asyncpg":
+        if importlib.util.find_spec("asyncpg") is None:
+            raise ValueError(
+                f"数据库地址 {url.render_as_string(hide_password=True)} 需要asyncpg驱动，"
+                "请执行 pip install -r requirements-postgres.txt"
+            )
+    # PostgreSQL等服务器数据库：回收长时间空闲的连接，使用前检测连接是否可用
+    if config["pool_size"] > 0:
+        kwargs["pool_recycle"] = config["pool_recycle"]
+    return create_async_engine(url, echo=config["echo"], pool_pre_ping=True, **kwargs)
+
+
+def describe(config: Dict[str, Any]) -> str:
+    """配置摘要（用于启动日志，不输出连接地址中的密码）"""
+    url = make_url(config["url"]).render_as_string(hide_password=True)
+    return f"{url}（配置档: {config['profile']}, SQL日志: {config['echo']}, 连接池: {config['pool_size']}+{config['max_overflow']}）"
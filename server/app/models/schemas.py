@@ -26,6 +26,38 @@ class CommandResponse(BaseModel):
         from_attributes = True
 
 
+class CommandBatchRequest(BaseModel):
+    """批量命令请求（每条命令单独校验，见 POST /api/commands/batch）"""
+    commands: List[Any]
+
+
+class CommandBatchItem(CommandResponse):
+    """批量命令中一条已创建的命令"""
+    index: int  # 在请求commands列表中的位置
+
+
+class CommandBatchError(BaseModel):
+    """批量命令中一条校验失败的命令"""
+    index: int
+    error: str
+
+
+class CommandBatchResponse(BaseModel):
+    """批量命令响应"""
+    commands: List[CommandBatchItem]
+    errors: List[CommandBatchError]
+
+
+class CommandLogPage(BaseModel):
+    """get_logs命令日志分页响应（见 GET /api/commands/{command_id}/logs）"""
+    command_id: str
+    log_file_name: str = ""
+    offset: int
+    lines: List[str]
+    total_lines: int
+    next_offset: Optional[int] = None  # 下一页的起始行，没有更多时为空
+
+
 class AccountInfoResponse(BaseModel):
     """账号信息响应"""
     id: int
@@ -85,3 +117,25 @@ class ExtendLicenseRequest(BaseModel):
     days: Optional[int] = None  # 延期天数
     months: Optional[int] = None  # 延期月数
     years: Optional[int] = None  # 延期年数
+
+
+class ChatMessageResponse(BaseModel):
+    """聊天消息响应"""
+    id: int
+    msg_id: str
+    wxid: str
+    peer_wxid: str
+    send_wxid: Optional[str]
+    receive_wxid: Optional[str]
+    send_type: int
+    send_time: datetime
+    text: Optional[str]
+
+    class Config:
+        from_attributes = True
+
+
+class ChatMessagePage(BaseModel):
+    """聊天消息分页响应"""
+    messages: List[ChatMessageResponse]
+    next_cursor: Optional[str] = None  # 下一页游标，没有更多时为空
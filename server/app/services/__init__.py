@@ -1,7 +1,11 @@
 """
 服务模块
 """
-from .license_service import LicenseService
+from .license_service import LicenseService, LicenseCache, license_cache
+from .contact_service import ContactService, ContactDelta, contact_service
+from .chat_message_service import ChatMessageService
+from .log_store import LogStore, log_store
+from .account_buffer import AccountWriteBuffer, account_buffer
 
-__all__ = ['LicenseService']
+__all__ = ['LicenseService', 'LicenseCache', 'license_cache', 'ContactService', 'ContactDelta', 'contact_service', 'ChatMessageService', 'LogStore', 'log_store', 'AccountWriteBuffer', 'account_buffer']
 
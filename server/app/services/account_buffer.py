@@ -0,0 +1,180 @@
+"""
+账号信息写缓冲
+Windows端会反复发送sync_my_info（例如未读消息数变化时），每次都查询并更新account_info会产生大量小事务。
+写缓冲在内存中按wxid合并更新（每个字段只保留最新值），由后台任务定期（或缓冲的账号数达到上限时）
+用一条 INSERT ... ON CONFLICT(wxid) DO UPDATE 语句批量写入数据库。
+
+读取账号信息时通过写缓冲叠加尚未写入的字段，读到的始终是最新值。
+多个worker进程运行时每个进程有自己的写缓冲，其他进程最多在一个写入间隔后读到更新。
+"""
+import os
+import time
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from app.models.database import AsyncSessionLocal, AccountInfo, dialect_insert
+
+
+# 默认配置（可通过环境变量覆盖）
+# 写入数据库的间隔（秒），为0时每次更新都立即写入（不缓冲）
+ACCOUNT_FLUSH_INTERVAL = float(os.getenv("MYWECHAT_ACCOUNT_FLUSH_INTERVAL", "2"))
+# 缓冲的账号数达到该值时立即写入
+ACCOUNT_FLUSH_SIZE = int(os.getenv("MYWECHAT_ACCOUNT_FLUSH_SIZE", "500"))
+
+# 可更新的字段 -> 新建记录时未提供该字段使用的默认值
+ACCOUNT_FIELDS: Dict[str, Any] = {
+    "nickname": "",
+    "avatar": "",
+    "account": "",
+    "device_id": "",
+    "phone": "",
+    "wx_user_dir": "",
+    "unread_msg_count": 0,
+    "is_fake_device_id": 0,
+    "pid": 0,
+}
+
+
+class AccountWriteBuffer:
+    """账号信息写缓冲（按wxid合并更新，批量写入）"""
+
+    def __init__(self, flush_interval: float = ACCOUNT_FLUSH_INTERVAL, flush_size: int = ACCOUNT_FLUSH_SIZE):
+        self.flush_interval = flush_interval
+        self.flush_size = max(1, flush_size)
+        # wxid -> 尚未写入的字段（包括updated_at），按最后更新时间从早到晚排列
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flusher_task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, Any] = {
+            "updates": 0,
+            "coalesced": 0,
+            "flushes": 0,
+            "flushed_rows": 0,
+            "statements": 0,
+            "failures": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    def start(self):
+        """启动后台写入任务"""
+        if self.flush_interval > 0 and (self._flusher_task is None or self._flusher_task.done()):
+            self._flusher_task = asyncio.create_task(self._flusher_loop())
+
+    async def stop(self):
+        """停止后台写入任务并写入剩余的更新"""
+        if self._flusher_task is not None:
+            self._flusher_task.cancel()
+            try:
+                await self._flusher_task
+            except asyncio.CancelledError:
+                pass
+            self._flusher_task = None
+        await self.flush()
+
+    async def _flusher_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"写入账号信息失败: {e}")
+
+    async def put(self, wxid: str, account_data: Dict):
+        """缓冲一次账号信息更新（只更新account_data中提供的字段）"""
+        values = {name: account_data[name] for name in ACCOUNT_FIELDS if name in account_data}
+        values["updated_at"] = datetime.utcnow()
+        self.stats["updates"] += 1
+        pending = self._pending.pop(wxid, None)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            pending.update(values)
+            values = pending
+        # 重新插入到末尾，保持按最后更新时间排列
+        self._pending[wxid] = values
+        if self.flush_interval <= 0 or len(self._pending) >= self.flush_size:
+            await self.flush()
+
+    def pending(self, wxid: str) -> Optional[Dict[str, Any]]:
+        """wxid尚未写入数据库的字段"""
+        values = self._pending.get(wxid)
+        return dict(values) if values is not None else None
+
+    def apply(self, wxid: str, account: Dict[str, Any]) -> Dict[str, Any]:
+        """在从数据库读取的账号信息上叠加尚未写入的字段"""
+        values = self._pending.get(wxid)
+        if values:
+            account.update(values)
+        return account
+
+    def latest_wxid(self, phone: Optional[str] = None) -> Optional[str]:
+        """最近更新（且手机号匹配）的缓冲账号，缓冲中的更新都比数据库中的更新时间晚"""
+        for wxid in reversed(self._pending):
+            if phone is None or self._pending[wxid].get("phone") == phone:
+                return wxid
+        return None
+
+    async def ensure_flushed(self, wxid: str):
+        """wxid有尚未写入的更新时立即写入（数据库中还没有该账号的记录时使用）"""
+        if wxid in self._pending:
+            await self.flush()
+
+    async def flush(self) -> int:
+        """把缓冲的更新写入数据库
+
+        Returns:
+            int: 写入的账号数
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            started = time.perf_counter()
+            try:
+                statements = await self._write(batch)
+            except Exception:
+                self.stats["failures"] += 1
+                # 写入失败时放回缓冲（写入期间收到的更新更新，覆盖放回的字段）
+                for wxid, values in self._pending.items():
+                    batch.setdefault(wxid, {}).update(values)
+                self._pending = batch
+                raise
+            self.stats["flushes"] += 1
+            self.stats["flushed_rows"] += len(batch)
+            self.stats["statements"] += statements
+            self.stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            return len(batch)
+
+    @staticmethod
+    async def _write(batch: Dict[str, Dict[str, Any]]) -> int:
+        """在一个事务中批量UPSERT，返回执行的语句数
+
+        提供的字段相同的账号使用同一条语句（通常每次同步都提供全部字段，只有一条语句），
+        新建记录时未提供的字段使用默认值，更新时只覆盖提供的字段
+        """
+        groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        for wxid, values in batch.items():
+            columns = tuple(sorted(values))
+            groups.setdefault(columns, []).append(dict(ACCOUNT_FIELDS, wxid=wxid, **values))
+        async with AsyncSessionLocal() as session:
+            for columns, rows in groups.items():
+                stmt = dialect_insert(AccountInfo.__table__)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["wxid"],
+                    set_={name: stmt.excluded[name] for name in columns}
+                )
+                await session.execute(stmt, rows)
+            await session.commit()
+        return len(groups)
+
+    def get_stats(self) -> Dict:
+        """获取写缓冲统计"""
+        return {
+            "pending": len(self._pending),
+            "flush_interval": self.flush_interval,
+            "flush_size": self.flush_size,
+            **self.stats,
+        }
+
+
+# 全局账号信息写缓冲
+account_buffer = AccountWriteBuffer()
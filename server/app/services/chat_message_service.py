@@ -0,0 +1,216 @@
+"""
+聊天消息存储服务
+保存Windows端同步的聊天消息（按msg_id去重），提供会话分页和关键词搜索
+"""
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, and_, or_, text, Integer
+from app.models import database
+from app.models.database import AsyncSessionLocal, ChatMessage, CHAT_MESSAGES_FTS_TABLE, dialect_insert
+
+
+# 单页最大条数
+MAX_PAGE_SIZE = 200
+# FTS5 trigram分词的最短关键词长度，更短的关键词使用LIKE
+_FTS_MIN_KEYWORD_LENGTH = 3
+
+
+def _pick(data: Dict, *keys, default=None):
+    """按顺序取第一个存在的字段（兼容Windows端的PascalCase和下划线命名）"""
+    for key in keys:
+        value = data.get(key)
+        if value is not None and value != "":
+            return value
+    return default
+
+
+def _parse_send_time(value) -> datetime:
+    """解析发送时间，统一转换为不带时区的UTC时间"""
+    if isinstance(value, (int, float)) and value > 0:
+        # 时间戳（秒或毫秒）
+        if value > 1e11:
+            value = value / 1000
+        return datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None)
+    if isinstance(value, str) and value:
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            if parsed.tzinfo is not None:
+                parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+            return parsed
+        except ValueError:
+            pass
+    return datetime.utcnow()
+
+
+def normalize_chat_message(data: Dict, wxid: Optional[str] = None) -> Optional[Dict]:
+    """将sync_chat_message中的消息转换为数据库记录
+
+    Windows端发送的是ChatMessage模型（MsgId/MsgText/SendWxId/ReceiveWxId/SendType/SendTime），
+    消息本身不带当前账号ID，按发送类型推断：自己发送时为发送方，否则为接收方。
+
+    Returns:
+        Dict: 数据库记录；缺少msg_id或无法确定所属账号时返回None
+    """
+    if not isinstance(data, dict):
+        return None
+    msg_id = _pick(data, "MsgId", "msg_id", "msgid", "message_id")
+    if not msg_id:
+        return None
+
+    send_wxid = _pick(data, "SendWxId", "send_wxid", "from_wxid", "from_we_chat_id", default="")
+    receive_wxid = _pick(data, "ReceiveWxId", "receive_wxid", "to_wxid", "to_we_chat_id", default="")
+    try:
+        send_type = int(_pick(data, "SendType", "send_type", default=0))
+    except (TypeError, ValueError):
+        send_type = 0
+
+    owner = wxid or _pick(data, "we_chat_id", "WeChatId", "weChatId")
+    if not owner:
+        owner = send_wxid if send_type == 1 else receive_wxid
+    if not owner:
+        return None
+    peer = receive_wxid if owner == send_wxid else send_wxid
+
+    return {
+        "msg_id": str(msg_id),
+        "wxid": owner,
+        "peer_wxid": peer or "",
+        "send_wxid": send_wxid,
+        "receive_wxid": receive_wxid,
+        "send_type": send_type,
+        "send_time": _parse_send_time(_pick(data, "SendTime", "send_time", "timestamp")),
+        "text": _pick(data, "MsgText", "msg_text", "msg", "content", "text", default=""),
+    }
+
+
+def encode_cursor(message: ChatMessage) -> str:
+    """生成会话分页游标（发送时间+ID）"""
+    return f"{message.send_time.isoformat()}_{message.id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解析会话分页游标
+
+    Raises:
+        ValueError: 游标格式错误
+    """
+    send_time, _, message_id = cursor.rpartition("_")
+    return datetime.fromisoformat(send_time), int(message_id)
+
+
+class ChatMessageService:
+    """聊天消息存储服务"""
+
+    @staticmethod
+    async def save_messages(records: List[Dict]) -> int:
+        """批量保存聊天消息（已规范化的记录），已存在的msg_id忽略
+
+        Returns:
+            int: 新保存的消息数量
+        """
+        if not records:
+            return 0
+        async with AsyncSessionLocal() as session:
+            stmt = dialect_insert(ChatMessage.__table__).on_conflict_do_nothing(index_elements=["msg_id"])
+            # 使用Core的executemany，rowcount为实际插入（未被去重忽略）的行数
+            connection = await session.connection()
+            result = await connection.execute(stmt, records)
+            await session.commit()
+            return max(result.rowcount or 0, 0)
+
+    @staticmethod
+    async def save_sync_message(data, wxid: Optional[str] = None) -> int:
+        """保存sync_chat_message中的消息（data可以是单条消息或消息列表）"""
+        items = data if isinstance(data, list) else [data]
+        records = [record for record in (normalize_chat_message(item, wxid) for item in items) if record]
+        return await ChatMessageService.save_messages(records)
+
+    @staticmethod
+    async def get_conversation(
+        wxid: str,
+        peer_wxid: str,
+        cursor: Optional[str] = None,
+        limit: int = 50
+    ) -> Tuple[List[ChatMessage], Optional[str]]:
+        """按发送时间倒序分页获取会话消息（键集分页，不使用OFFSET）
+
+        Args:
+            wxid: 当前微信账号ID
+            peer_wxid: 会话对方微信ID
+            cursor: 上一页返回的游标（为空时从最新消息开始）
+            limit: 每页条数
+
+        Returns:
+            Tuple[List[ChatMessage], Optional[str]]: (消息列表, 下一页游标；没有更多时为None)
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        stmt = select(ChatMessage).where(ChatMessage.wxid == wxid, ChatMessage.peer_wxid == peer_wxid)
+        if cursor:
+            send_time, message_id = decode_cursor(cursor)
+            stmt = stmt.where(or_(
+                ChatMessage.send_time < send_time,
+                and_(ChatMessage.send_time == send_time, ChatMessage.id < message_id)
+            ))
+        stmt = stmt.order_by(ChatMessage.send_time.desc(), ChatMessage.id.desc()).limit(limit + 1)
+
+        async with AsyncSessionLocal() as session:
+            messages = list((await session.execute(stmt)).scalars().all())
+
+        next_cursor = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            next_cursor = encode_cursor(messages[-1])
+        return messages, next_cursor
+
+    @staticmethod
+    async def search(
+        wxid: str,
+        keyword: str,
+        peer_wxid: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 50
+    ) -> Tuple[List[ChatMessage], Optional[str]]:
+        """在微信账号的聊天记录中按关键词搜索（按消息ID倒序，键集分页）
+
+        SQLite下关键词不少于3个字符时使用FTS5全文索引（在索引内按账号过滤），否则使用LIKE扫描该账号的消息
+
+        Returns:
+            Tuple[List[ChatMessage], Optional[str]]: (消息列表, 下一页游标；没有更多时为None)
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        stmt = select(ChatMessage).where(ChatMessage.wxid == wxid)
+        if peer_wxid:
+            stmt = stmt.where(ChatMessage.peer_wxid == peer_wxid)
+        if cursor:
+            stmt = stmt.where(ChatMessage.id < int(cursor))
+
+        if database.chat_fts_enabled and len(keyword) >= _FTS_MIN_KEYWORD_LENGTH:
+            # 关键词作为短语匹配（双引号转义），避免被解析为FTS5查询语法；
+            # 在全文索引内按账号过滤并按rowid倒序取一页，只读取该账号的匹配行，不收集所有账号的匹配结果
+            phrase = '"' + keyword.replace('"', '""') + '"'
+            conditions = [f"{CHAT_MESSAGES_FTS_TABLE} MATCH :phrase", "wxid = :fts_wxid"]
+            params = {"phrase": phrase, "fts_wxid": wxid, "fts_limit": limit + 1}
+            if peer_wxid:
+                conditions.append("peer_wxid = :fts_peer_wxid")
+                params["fts_peer_wxid"] = peer_wxid
+            if cursor:
+                conditions.append("rowid < :fts_cursor")
+                params["fts_cursor"] = int(cursor)
+            matched = text(
+                f"SELECT rowid FROM {CHAT_MESSAGES_FTS_TABLE} WHERE {' AND '.join(conditions)} "
+                "ORDER BY rowid DESC LIMIT :fts_limit"
+            ).columns(rowid=Integer).subquery()
+            stmt = stmt.where(ChatMessage.id.in_(select(matched.c.rowid))).params(**params)
+        else:
+            escaped = keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            stmt = stmt.where(ChatMessage.text.like(f"%{escaped}%", escape="\\"))
+        stmt = stmt.order_by(ChatMessage.id.desc()).limit(limit + 1)
+
+        async with AsyncSessionLocal() as session:
+            messages = list((await session.execute(stmt)).scalars().all())
+
+        next_cursor = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            next_cursor = str(messages[-1].id)
+        return messages, next_cursor
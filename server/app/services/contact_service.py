@@ -0,0 +1,387 @@
+"""
+联系人存储服务
+按微信账号保存最新的好友列表（以FriendId为键），用每条记录的内容哈希计算与上一版本的增量，
+App端上报已知的联系人版本号后只需要接收增量，不再每次传输完整好友列表
+
+多个worker进程运行时，内存中的哈希只是数据库的缓存：保存时按版本号条件更新contact_sync_state，
+版本号已被其他进程更新时重新加载后重试；读取增量时以数据库中的版本号为准
+"""
+import json
+import asyncio
+import hashlib
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+from sqlalchemy import select, update, insert
+from sqlalchemy.exc import IntegrityError
+from app.models.database import AsyncSessionLocal, Contact, ContactSyncState
+
+
+# 单条SQL中IN参数的最大数量（SQLite默认限制为999）
+_IN_CHUNK_SIZE = 500
+# 版本号冲突（其他进程同时保存）时的最大重试次数
+_MAX_WRITE_ATTEMPTS = 3
+
+
+class _VersionConflict(Exception):
+    """数据库中的联系人版本号与内存状态不一致（其他worker进程已保存）"""
+
+
+class ContactDelta:
+    """联系人增量（从base_version到version的新增、更新和删除）"""
+
+    __slots__ = ("wxid", "base_version", "version", "added", "updated", "removed")
+
+    def __init__(self, wxid: str, base_version: int, version: int):
+        self.wxid = wxid
+        self.base_version = base_version
+        self.version = version
+        # 新增的联系人（完整记录）
+        self.added: List[Dict] = []
+        # 内容有变化的联系人（完整记录）
+        self.updated: List[Dict] = []
+        # 删除的联系人FriendId
+        self.removed: List[str] = []
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.updated or self.removed)
+
+    @property
+    def count(self) -> int:
+        return len(self.added) + len(self.updated) + len(self.removed)
+
+    def to_message(self) -> Dict:
+        """转换为发送给App端的sync_contacts_delta消息"""
+        return {
+            "type": "sync_contacts_delta",
+            "we_chat_id": self.wxid,
+            "base_version": self.base_version,
+            "version": self.version,
+            "added": self.added,
+            "updated": self.updated,
+            "removed": self.removed,
+        }
+
+    def __repr__(self) -> str:
+        return (f"<ContactDelta {self.wxid} {self.base_version}->{self.version} "
+                f"added={len(self.added)} updated={len(self.updated)} removed={len(self.removed)}>")
+
+
+class _ContactState:
+    """单个微信账号的联系人内存状态（数据库的只读镜像，用于快速比较哈希）"""
+
+    __slots__ = ("version", "hashes", "deleted", "snapshot_id", "seen", "batches", "lock")
+
+    def __init__(self, version: int):
+        self.version = version
+        # 当前联系人：FriendId -> 内容哈希
+        self.hashes: Dict[str, str] = {}
+        # 已删除（数据库中保留删除记录）的FriendId
+        self.deleted: Set[str] = set()
+        # 当前正在接收的全量同步轮次、已收到的FriendId和批次序号（用于在收齐所有批次时计算删除）
+        self.snapshot_id: Optional[str] = None
+        self.seen: Set[str] = set()
+        self.batches: Set[int] = set()
+        # 同一微信账号的批次串行处理
+        self.lock = asyncio.Lock()
+
+
+def compute_contact_hash(record: Dict) -> str:
+    """计算单条联系人记录的内容哈希（与字段顺序无关）"""
+    canonical = json.dumps(record, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def get_friend_id(record: Dict) -> str:
+    """获取联系人记录的FriendId"""
+    return str(record.get("friend_id") or record.get("FriendId") or record.get("friendId") or "")
+
+
+class ContactService:
+    """联系人存储服务"""
+
+    def __init__(self):
+        # 微信账号ID -> 联系人内存状态（首次使用时从数据库加载）
+        self._states: Dict[str, _ContactState] = {}
+
+    async def _get_state(self, wxid: str) -> _ContactState:
+        """获取微信账号的联系人状态，不存在时从数据库加载"""
+        state = self._states.get(wxid)
+        if state is not None:
+            return state
+
+        loaded = _ContactState(0)
+        await self._load_state(wxid, loaded)
+        # 加载期间可能有其他协程已经完成加载，以先完成的为准
+        return self._states.setdefault(wxid, loaded)
+
+    @staticmethod
+    async def _load_state(wxid: str, state: _ContactState):
+        """从数据库加载（或重新加载）版本号和联系人哈希（保留当前的同步轮次）"""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(ContactSyncState.version).where(ContactSyncState.wxid == wxid)
+            )
+            version = result.scalar_one_or_none() or 0
+            rows = await session.execute(
+                select(Contact.friend_id, Contact.content_hash, Contact.deleted).where(Contact.wxid == wxid)
+            )
+            hashes: Dict[str, str] = {}
+            deleted: Set[str] = set()
+            for friend_id, content_hash, is_deleted in rows:
+                if is_deleted:
+                    deleted.add(friend_id)
+                else:
+                    hashes[friend_id] = content_hash
+        state.version = version
+        state.hashes = hashes
+        state.deleted = deleted
+
+    def invalidate(self, wxid: str):
+        """丢弃微信账号的内存状态（其他worker进程保存了联系人后调用，下次使用时重新加载）"""
+        self._states.pop(wxid, None)
+
+    @staticmethod
+    async def _read_version(session, wxid: str) -> int:
+        """读取数据库中的联系人版本号"""
+        result = await session.execute(
+            select(ContactSyncState.version).where(ContactSyncState.wxid == wxid)
+        )
+        return result.scalar_one_or_none() or 0
+
+    async def get_version(self, wxid: str) -> int:
+        """获取微信账号当前的联系人版本号（没有保存过联系人时为0）"""
+        async with AsyncSessionLocal() as session:
+            return await self._read_version(session, wxid)
+
+    async def apply_batch(
+        self,
+        wxid: str,
+        records: List[Dict],
+        snapshot_id: Optional[str] = None,
+        last_batch: bool = False,
+        batch_index: Optional[int] = None,
+        batch_count: Optional[int] = None
+    ) -> ContactDelta:
+        """保存一批联系人并计算与上一版本的增量
+
+        Windows端按批次发送好友列表。每批只会产生新增和更新；
+        只有收齐全量同步轮次的所有批次（batch_index 0 ~ batch_count-1，到达顺序不限）时，
+        才把本轮没有出现过的联系人计为删除，丢失或发送失败的批次不会导致误删。
+        没有snapshot_id时，标记了last_batch的单条消息视为完整列表；
+        有snapshot_id但没有batch_count时无法确认是否收齐，不计算删除。
+
+        Args:
+            wxid: 微信账号ID
+            records: 联系人记录列表（sync_contacts中的data）
+            snapshot_id: 全量同步轮次ID（同一轮的各批次相同）
+            last_batch: 是否为本轮的最后一批
+            batch_index: 本批在本轮中的序号（从0开始）
+            batch_count: 本轮的批次总数
+
+        Returns:
+            ContactDelta: 增量（没有变化时为空，版本号不变）
+        """
+        state = await self._get_state(wxid)
+        async with state.lock:
+            # 开始新的同步轮次
+            if snapshot_id is None or snapshot_id != state.snapshot_id:
+                state.snapshot_id = snapshot_id
+                state.seen = set()
+                state.batches = set()
+
+            if snapshot_id is None:
+                complete = last_batch
+            elif batch_count is not None and batch_index is not None and 0 <= batch_index < batch_count:
+                state.batches.add(batch_index)
+                complete = len(state.batches) == batch_count
+            else:
+                complete = False
+
+            for attempt in range(_MAX_WRITE_ATTEMPTS):
+                try:
+                    delta = await self._apply_locked(wxid, state, records, complete)
+                    break
+                except _VersionConflict:
+                    if attempt == _MAX_WRITE_ATTEMPTS - 1:
+                        raise
+                    print(f"联系人版本号已被其他进程更新，重新加载后重试: wxid={wxid}")
+                    await self._load_state(wxid, state)
+
+            if complete:
+                state.snapshot_id = None
+                state.seen = set()
+                state.batches = set()
+            return delta
+
+    async def _apply_locked(self, wxid: str, state: _ContactState, records: List[Dict], complete: bool) -> ContactDelta:
+        """按内存状态计算增量并写入数据库（持有state.lock时调用）
+
+        complete为True时（已收齐本轮所有批次），本轮没有出现过的联系人计为删除。
+
+        数据库中的版本号与state.version不一致时抛出_VersionConflict（事务已回滚，内存状态不变）
+        """
+        # 比较内容哈希，同一批中重复的FriendId以最后一条为准
+        changed: Dict[str, tuple] = {}
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            friend_id = get_friend_id(record)
+            if not friend_id:
+                continue
+            state.seen.add(friend_id)
+            content_hash = compute_contact_hash(record)
+            if state.hashes.get(friend_id) != content_hash:
+                changed[friend_id] = (record, content_hash)
+
+        removed: List[str] = []
+        if complete:
+            removed = [friend_id for friend_id in state.hashes if friend_id not in state.seen]
+
+        delta = ContactDelta(wxid, state.version, state.version)
+        if not changed and not removed:
+            return delta
+
+        version = state.version + 1
+        delta.version = version
+        now = datetime.utcnow()
+        new_rows = []
+        existing_rows = []
+        for friend_id, (record, content_hash) in changed.items():
+            row = {
+                "content_hash": content_hash,
+                "data": json.dumps(record, ensure_ascii=False),
+                "version": version,
+                "deleted": False,
+                "updated_at": now,
+            }
+            if friend_id in state.hashes:
+                delta.updated.append(record)
+                existing_rows.append((friend_id, row))
+            else:
+                delta.added.append(record)
+                if friend_id in state.deleted:
+                    # 之前删除过的联系人，复用删除记录
+                    row["created_version"] = version
+                    existing_rows.append((friend_id, row))
+                else:
+                    new_rows.append(dict(row, wxid=wxid, friend_id=friend_id, created_version=version, created_at=now))
+        delta.removed = removed
+
+        contact_count = len(state.hashes) + len(delta.added) - len(removed)
+        async with AsyncSessionLocal() as session:
+            try:
+                # 先按版本号条件更新同步状态（同时取得写锁），版本号不一致说明其他进程已保存
+                if state.version == 0:
+                    session.add(ContactSyncState(wxid=wxid, version=version, contact_count=contact_count))
+                    await session.flush()
+                else:
+                    result = await session.execute(
+                        update(ContactSyncState)
+                        .where(ContactSyncState.wxid == wxid, ContactSyncState.version == state.version)
+                        .values(version=version, contact_count=contact_count)
+                    )
+                    if result.rowcount != 1:
+                        raise _VersionConflict(wxid)
+                await self._write_changes(session, wxid, new_rows, existing_rows, removed, version, now)
+                await session.commit()
+            except IntegrityError as e:
+                # 其他进程已创建同步状态或新增了同一联系人
+                await session.rollback()
+                raise _VersionConflict(wxid) from e
+            except _VersionConflict:
+                await session.rollback()
+                raise
+
+        # 数据库提交成功后再更新内存状态
+        state.version = version
+        for friend_id, (_, content_hash) in changed.items():
+            state.hashes[friend_id] = content_hash
+            state.deleted.discard(friend_id)
+        for friend_id in removed:
+            state.hashes.pop(friend_id, None)
+            state.deleted.add(friend_id)
+
+        print(f"联系人已保存: wxid={wxid}, 版本 {delta.base_version}->{version}, "
+              f"新增={len(delta.added)}, 更新={len(delta.updated)}, 删除={len(removed)}, 当前数量={contact_count}")
+        return delta
+
+    @staticmethod
+    async def _write_changes(session, wxid: str, new_rows: List[Dict], existing_rows: List[tuple], removed: List[str], version: int, now: datetime):
+        """批量写入新增、更新和删除（不提交）"""
+        if new_rows:
+            await session.execute(insert(Contact), new_rows)
+
+        if existing_rows:
+            # 按主键批量更新
+            ids: Dict[str, int] = {}
+            friend_ids = [friend_id for friend_id, _ in existing_rows]
+            for i in range(0, len(friend_ids), _IN_CHUNK_SIZE):
+                result = await session.execute(
+                    select(Contact.friend_id, Contact.id).where(
+                        Contact.wxid == wxid,
+                        Contact.friend_id.in_(friend_ids[i:i + _IN_CHUNK_SIZE])
+                    )
+                )
+                ids.update(result.all())
+            await session.execute(
+                update(Contact),
+                [dict(row, id=ids[friend_id]) for friend_id, row in existing_rows]
+            )
+
+        for i in range(0, len(removed), _IN_CHUNK_SIZE):
+            await session.execute(
+                update(Contact)
+                .where(Contact.wxid == wxid, Contact.friend_id.in_(removed[i:i + _IN_CHUNK_SIZE]))
+                .values(deleted=True, version=version, updated_at=now)
+            )
+
+    async def get_delta_since(self, wxid: str, since_version: int) -> Optional[ContactDelta]:
+        """获取从指定版本到当前版本的增量
+
+        Args:
+            wxid: 微信账号ID
+            since_version: App端已知的版本号（0表示App端没有任何联系人）
+
+        Returns:
+            ContactDelta: 增量；版本号未知（大于当前版本或小于0）时返回None，调用方应改为全量同步
+        """
+        async with AsyncSessionLocal() as session:
+            # 以数据库中的版本号为准（其他worker进程可能已保存了更新的版本）
+            version = await self._read_version(session, wxid)
+            if since_version < 0 or since_version > version:
+                return None
+
+            delta = ContactDelta(wxid, since_version, version)
+            if since_version == version:
+                return delta
+
+            rows = await session.execute(
+                select(Contact.friend_id, Contact.data, Contact.created_version, Contact.deleted)
+                .where(Contact.wxid == wxid, Contact.version > since_version, Contact.version <= version)
+                .order_by(Contact.id)
+            )
+            for friend_id, data, created_version, deleted in rows:
+                if deleted:
+                    # 在已知版本之后新增又删除的联系人，App端从未收到，无需通知
+                    if created_version <= since_version:
+                        delta.removed.append(friend_id)
+                elif created_version > since_version:
+                    delta.added.append(json.loads(data))
+                else:
+                    delta.updated.append(json.loads(data))
+        return delta
+
+    async def get_contacts(self, wxid: str) -> List[Dict]:
+        """获取微信账号当前的完整联系人列表"""
+        async with AsyncSessionLocal() as session:
+            rows = await session.execute(
+                select(Contact.data)
+                .where(Contact.wxid == wxid, Contact.deleted == False)  # noqa: E712
+                .order_by(Contact.id)
+            )
+            return [json.loads(data) for (data,) in rows]
+
+
+# 全局联系人存储服务实例
+contact_service = ContactService()
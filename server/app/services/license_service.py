@@ -1,11 +1,118 @@
 """
 授权验证服务
 提供授权码验证、检查过期、激活授权等功能
+授权信息按手机号缓存在进程内（有过期时间和数量上限），授权管理接口修改授权后使缓存失效，
+并通过消息总线通知其他worker进程使同一手机号的缓存失效
 """
+import os
+import hmac
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from sqlalchemy import select
-from typing import Optional, Tuple
+from sqlalchemy import select, update
+from typing import Dict, Optional, Tuple
 from app.models.database import AsyncSessionLocal, UserLicense
+from app.websocket.message_bus import MessageBus, message_bus, route_key, ROUTE_WORKERS
+
+
+# 默认配置（可通过环境变量覆盖）
+# 缓存有效期（秒），多进程部署时消息总线断开期间，其他进程修改授权后最多延迟这么久生效
+LICENSE_CACHE_TTL = float(os.getenv("MYWECHAT_LICENSE_CACHE_TTL", "60"))
+LICENSE_CACHE_SIZE = int(os.getenv("MYWECHAT_LICENSE_CACHE_SIZE", "10000"))
+
+# 消息总线事件：其他worker进程修改了授权，使本进程的授权缓存失效
+BUS_EVENT_LICENSE = "license"
+
+
+class LicenseCache:
+    """按手机号缓存授权信息（LRU，手机号不存在的结果也会缓存）
+
+    缓存的是会话关闭后的UserLicense对象，调用方只能读取，不能修改后提交
+    """
+
+    def __init__(self, ttl: float = LICENSE_CACHE_TTL, max_size: int = LICENSE_CACHE_SIZE, bus: Optional[MessageBus] = None):
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        # 跨worker进程的消息总线（发布缓存失效通知）
+        self.bus = bus if bus is not None else message_bus
+        # 手机号 -> (授权信息, 过期时间)
+        self._entries: "OrderedDict[str, Tuple[Optional[UserLicense], float]]" = OrderedDict()
+        # 每次失效递增，查询数据库期间发生失效时不写入缓存，避免写入旧数据
+        self._generation = 0
+        self.stats: Dict[str, int] = {
+            "hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+            "remote_invalidations": 0,
+            "evictions": 0,
+        }
+
+    async def get(self, phone: str) -> Optional[UserLicense]:
+        """获取授权信息（未命中时查询数据库）"""
+        entry = self._entries.get(phone)
+        if entry is not None and entry[1] > time.monotonic():
+            self._entries.move_to_end(phone)
+            self.stats["hits"] += 1
+            return entry[0]
+
+        self.stats["misses"] += 1
+        generation = self._generation
+        async with AsyncSessionLocal() as session:
+            stmt = select(UserLicense).where(UserLicense.phone == phone)
+            result = await session.execute(stmt)
+            license = result.scalar_one_or_none()
+
+        if generation == self._generation and self.ttl > 0:
+            self._entries[phone] = (license, time.monotonic() + self.ttl)
+            self._entries.move_to_end(phone)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return license
+
+    def invalidate(self, phone: Optional[str] = None, publish: bool = True):
+        """使手机号的缓存失效（不指定手机号时清空全部缓存）
+
+        Args:
+            publish: 是否通知其他worker进程（处理其他进程发布的失效通知时为False）
+        """
+        self._generation += 1
+        if publish:
+            self.stats["invalidations"] += 1
+            self.bus.publish(route_key(ROUTE_WORKERS), BUS_EVENT_LICENSE, phone=phone)
+        else:
+            self.stats["remote_invalidations"] += 1
+        if phone is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(phone, None)
+
+    def get_stats(self) -> Dict:
+        """获取缓存统计"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            **self.stats,
+        }
+
+
+# 全局授权缓存
+license_cache = LicenseCache()
+
+
+async def _mark_expired(license: UserLicense):
+    """将已过期的授权标记为expired并使缓存失效"""
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(UserLicense)
+            .where(UserLicense.id == license.id, UserLicense.status == license.status)
+            .values(status="expired")
+        )
+        await session.commit()
+    license_cache.invalidate(license.phone)
 
 
 class LicenseService:
@@ -24,33 +131,26 @@ class LicenseService:
             Tuple[bool, Optional[str]]: (是否有效, 错误信息)
         """
         try:
-            async with AsyncSessionLocal() as session:
-                stmt = select(UserLicense).where(
-                    UserLicense.phone == phone,
-                    UserLicense.license_key == license_key
-                )
-                result = await session.execute(stmt)
-                license = result.scalar_one_or_none()
-                
-                if not license:
-                    return False, "手机号或授权码错误"
-                
-                # 检查状态
-                if license.status == "revoked":
-                    return False, "授权已被撤销"
-                
-                if license.status == "expired":
-                    return False, "授权已过期"
-                
-                # 检查是否过期
-                if license.expire_date and license.expire_date < datetime.utcnow():
-                    # 更新状态为过期
-                    license.status = "expired"
-                    await session.commit()
-                    return False, "授权已过期"
-                
-                # 验证通过
-                return True, None
+            license = await license_cache.get(phone)
+            
+            if not license or not hmac.compare_digest(license.license_key.encode(), license_key.encode()):
+                return False, "手机号或授权码错误"
+            
+            # 检查状态
+            if license.status == "revoked":
+                return False, "授权已被撤销"
+            
+            if license.status == "expired":
+                return False, "授权已过期"
+            
+            # 检查是否过期
+            if license.expire_date and license.expire_date < datetime.utcnow():
+                # 更新状态为过期
+                await _mark_expired(license)
+                return False, "授权已过期"
+            
+            # 验证通过
+            return True, None
                 
         except Exception as e:
             return False, f"验证授权失败: {str(e)}"
@@ -67,28 +167,24 @@ class LicenseService:
             Tuple[bool, Optional[str]]: (是否已授权, 错误信息)
         """
         try:
-            async with AsyncSessionLocal() as session:
-                stmt = select(UserLicense).where(UserLicense.phone == phone)
-                result = await session.execute(stmt)
-                license = result.scalar_one_or_none()
-                
-                if not license:
-                    return False, "该手机号未授权"
-                
-                # 检查状态
-                if license.status == "revoked":
-                    return False, "授权已被撤销"
-                
-                if license.status == "expired":
-                    return False, "授权已过期"
-                
-                # 检查是否过期
-                if license.expire_date and license.expire_date < datetime.utcnow():
-                    license.status = "expired"
-                    await session.commit()
-                    return False, "授权已过期"
-                
-                return True, None
+            license = await license_cache.get(phone)
+            
+            if not license:
+                return False, "该手机号未授权"
+            
+            # 检查状态
+            if license.status == "revoked":
+                return False, "授权已被撤销"
+            
+            if license.status == "expired":
+                return False, "授权已过期"
+            
+            # 检查是否过期
+            if license.expire_date and license.expire_date < datetime.utcnow():
+                await _mark_expired(license)
+                return False, "授权已过期"
+            
+            return True, None
                 
         except Exception as e:
             return False, f"检查授权失败: {str(e)}"
@@ -106,19 +202,16 @@ class LicenseService:
             Tuple[bool, Optional[str]]: (是否匹配, 错误信息)
         """
         try:
-            async with AsyncSessionLocal() as session:
-                stmt = select(UserLicense).where(UserLicense.phone == phone)
-                result = await session.execute(stmt)
-                license = result.scalar_one_or_none()
-                
-                if not license:
-                    return False, "未找到授权信息"
-                
-                # 检查绑定的微信手机号是否匹配
-                if license.bound_wechat_phone != wechat_phone:
-                    return False, f"绑定的微信手机号({license.bound_wechat_phone})与当前微信账号手机号({wechat_phone})不匹配"
-                
-                return True, None
+            license = await license_cache.get(phone)
+            
+            if not license:
+                return False, "未找到授权信息"
+            
+            # 检查绑定的微信手机号是否匹配
+            if license.bound_wechat_phone != wechat_phone:
+                return False, f"绑定的微信手机号({license.bound_wechat_phone})与当前微信账号手机号({wechat_phone})不匹配"
+            
+            return True, None
                 
         except Exception as e:
             return False, f"验证手机号匹配失败: {str(e)}"
@@ -135,15 +228,12 @@ class LicenseService:
             bool: 是否有管理权限
         """
         try:
-            async with AsyncSessionLocal() as session:
-                stmt = select(UserLicense).where(UserLicense.phone == phone)
-                result = await session.execute(stmt)
-                license = result.scalar_one_or_none()
-                
-                if not license:
-                    return False
-                
-                return license.has_manage_permission == True
+            license = await license_cache.get(phone)
+            
+            if not license:
+                return False
+            
+            return license.has_manage_permission == True
                 
         except Exception as e:
             return False
@@ -157,13 +247,10 @@ class LicenseService:
             phone: 登录手机号
             
         Returns:
-            Optional[UserLicense]: 授权信息
+            Optional[UserLicense]: 授权信息（缓存中的对象，只读）
         """
         try:
-            async with AsyncSessionLocal() as session:
-                stmt = select(UserLicense).where(UserLicense.phone == phone)
-                result = await session.execute(stmt)
-                return result.scalar_one_or_none()
+            return await license_cache.get(phone)
         except Exception as e:
             return None
 
@@ -0,0 +1,385 @@
+"""
+日志存储服务
+保存Windows端返回的get_logs日志：逐行加密的日志以流的方式读取，按块在线程池中并行解密，
+每块压缩为一个gzip成员追加到日志文件（多个成员连接起来仍是合法的gzip文件，可以直接下载），
+并在索引文件中记录每块的起始行号、文件偏移和大小，按行分页读取时只解压需要的块。
+数据库中只保存日志的引用和统计，不保存日志内容
+
+每台Windows机器的日志保存在同一个日志ID下，并在log_cursors表中记录已上传到的日志文件和字节偏移，
+下次get_logs命令只需上传该偏移之后新增的日志。
+一次上传的写入和偏移一起生效：从头上传时写入临时文件，偏移保存后再替换原文件；
+追加上传失败时把日志文件和索引截断回上传前的大小，保证日志内容始终与记录的偏移一致
+"""
+import os
+import re
+import gzip
+import json
+import base64
+import asyncio
+import contextlib
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from sqlalchemy import select
+from app.models.database import AsyncSessionLocal, LogCursor, dialect_insert
+from app.utils.cpu_executor import CpuExecutor
+from app.utils.key_derivation import key_derivation_service
+
+
+# 默认配置（可通过环境变量覆盖）
+LOG_STORE_DIR = os.getenv("MYWECHAT_LOG_STORE_DIR", os.path.join(".", "data", "logs"))
+# 每块的行数（每块单独解密、压缩）
+LOG_CHUNK_LINES = int(os.getenv("MYWECHAT_LOG_CHUNK_LINES", "2000"))
+# 并行解密的线程数
+LOG_DECRYPT_WORKERS = int(os.getenv("MYWECHAT_LOG_DECRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 单个日志上传的最大字节数（加密后）
+LOG_MAX_UPLOAD_BYTES = int(os.getenv("MYWECHAT_LOG_MAX_UPLOAD_BYTES", str(256 * 1024 * 1024)))
+
+# 单页最大行数
+MAX_PAGE_LINES = 5000
+# 日志ID只允许的字符（用作文件名）
+_LOG_ID_PATTERN = re.compile(r"[^A-Za-z0-9_.-]")
+# 从内存中的字符串读取日志时每次读取的大小
+_STRING_CHUNK_SIZE = 1024 * 1024
+
+# 日志解密执行器
+log_executor = CpuExecutor("logs", LOG_DECRYPT_WORKERS, 10000)
+
+
+class LogTooLarge(Exception):
+    """日志超过上传大小限制"""
+
+
+class LogCursorMismatch(Exception):
+    """增量上传的起始偏移与服务器记录的偏移不一致（Windows端需要从头上传）"""
+
+
+def machine_log_id(machine_id: str) -> str:
+    """Windows机器的日志ID"""
+    return f"machine_{machine_id}"
+
+
+class LogIngestResult:
+    """一次写入的统计"""
+
+    __slots__ = ("first_line", "lines", "raw_bytes", "stored_bytes", "failed_lines", "total_lines", "consumed_bytes")
+
+    def __init__(self):
+        # 本次写入的第一行的行号
+        self.first_line = 0
+        self.lines = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.failed_lines = 0
+        # 写入后日志的总行数
+        self.total_lines = 0
+        # 已处理的上传字节数（不含末尾未换行的不完整行）
+        self.consumed_bytes = 0
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _decrypt_chunk(cipher: AESGCM, lines: List[bytes]) -> Tuple[bytes, int, int, int]:
+    """解密一块日志行并压缩为gzip成员（在线程池中执行）
+
+    Returns:
+        Tuple[bytes, int, int, int]: (gzip成员, 明文字节数, 解密成功的行数, 解密失败的行数)
+    """
+    plain_lines = []
+    failed = 0
+    for line in lines:
+        try:
+            data = base64.b64decode(line)
+            if len(data) < 28:
+                # 至少需要 12(nonce) + 0(ciphertext) + 16(tag)
+                failed += 1
+                continue
+            plain_lines.append(cipher.decrypt(data[:12], data[12:], None))
+        except Exception:
+            failed += 1
+    if not plain_lines:
+        return b"", 0, 0, failed
+    text = b"\n".join(plain_lines) + b"\n"
+    return gzip.compress(text, compresslevel=6), len(text), len(plain_lines), failed
+
+
+async def iter_string_chunks(text: str) -> AsyncIterator[bytes]:
+    """将内存中的日志字符串按块转换为字节流（兼容旧版本Windows端在JSON中返回整个日志）"""
+    for start in range(0, len(text), _STRING_CHUNK_SIZE):
+        yield text[start:start + _STRING_CHUNK_SIZE].encode("utf-8")
+
+
+class LogStore:
+    """按日志ID保存的压缩日志文件（日志文件 + 块索引）"""
+
+    def __init__(self, directory: str = LOG_STORE_DIR, chunk_lines: int = LOG_CHUNK_LINES):
+        self.directory = directory
+        self.chunk_lines = max(1, chunk_lines)
+        # 同一日志的写入串行执行
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def normalize_log_id(log_id: str) -> str:
+        """日志ID转换为安全的文件名"""
+        normalized = _LOG_ID_PATTERN.sub("_", log_id or "")[:128]
+        if not normalized.strip("._"):
+            raise ValueError("无效的日志ID")
+        return normalized
+
+    def _paths(self, log_id: str) -> Tuple[str, str]:
+        name = self.normalize_log_id(log_id)
+        return os.path.join(self.directory, f"{name}.log.gz"), os.path.join(self.directory, f"{name}.idx")
+
+    def log_path(self, log_id: str) -> Optional[str]:
+        """日志文件路径（不存在时返回None）"""
+        path, _ = self._paths(log_id)
+        return path if os.path.exists(path) else None
+
+    def _load_index(self, log_id: str) -> List[Dict]:
+        """读取块索引（每行一个块：起始行号、行数、文件偏移、压缩后大小、明文大小）"""
+        _, index_path = self._paths(log_id)
+        if not os.path.exists(index_path):
+            return []
+        with open(index_path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def delete(self, log_id: str):
+        """删除日志文件和索引"""
+        self._remove(self._paths(log_id))
+
+    async def ingest_machine_log(
+        self,
+        machine_id: str,
+        we_chat_id: str,
+        log_file_name: str,
+        source_offset: int,
+        chunks: AsyncIterator[bytes],
+        complete_lines_only: bool = True
+    ) -> LogIngestResult:
+        """保存Windows机器从source_offset开始上传的日志，并记录新的偏移
+
+        source_offset为0时覆盖该机器已保存的日志（首次上传或日志文件已切换），
+        否则必须与服务器记录的日志文件和偏移一致，追加到已保存的日志。
+        写入或保存偏移失败时日志保持上传前的内容，偏移不变
+
+        Raises:
+            LogCursorMismatch: 起始偏移与服务器记录不一致
+            LogTooLarge: 日志超过上传大小限制
+        """
+        log_id = machine_log_id(machine_id)
+        cipher = AESGCM(await key_derivation_service.get_machine_key(machine_id))
+        # 检查偏移、写入日志、保存偏移在同一把锁内完成，同一台机器的并发上传不会重复追加
+        async with self._locked(log_id):
+            append = source_offset > 0
+            if append:
+                cursor = await self.get_cursor(machine_id)
+                if cursor is None or cursor.log_file_name != log_file_name or cursor.source_offset != source_offset:
+                    raise LogCursorMismatch(f"日志偏移不一致: {log_file_name}@{source_offset}")
+            with self._staged(log_id, append) as (log_path, index_path, index):
+                result = await self._ingest(
+                    log_path, index_path, index, cipher, chunks, LOG_MAX_UPLOAD_BYTES, complete_lines_only
+                )
+                await self._save_cursor(
+                    machine_id, we_chat_id, log_file_name, source_offset + result.consumed_bytes, result.total_lines
+                )
+            return result
+
+    @contextlib.contextmanager
+    def _staged(self, log_id: str, append: bool):
+        """一次写入的暂存：正常结束时生效，出错时恢复为写入前的内容
+
+        覆盖时写入临时文件，结束后替换原文件；追加时直接写入原文件，出错时截断回写入前的大小
+
+        Yields:
+            Tuple[str, str, List[Dict]]: (写入的日志文件路径, 写入的索引文件路径, 已有的块索引)
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        paths = self._paths(log_id)
+        if append:
+            sizes = [os.path.getsize(path) if os.path.exists(path) else 0 for path in paths]
+            try:
+                yield paths[0], paths[1], self._load_index(log_id)
+            except BaseException:
+                for path, size in zip(paths, sizes):
+                    if os.path.exists(path):
+                        with open(path, "r+b") as f:
+                            f.truncate(size)
+                raise
+            return
+
+        staged = [f"{path}.tmp" for path in paths]
+        self._remove(staged)
+        try:
+            yield staged[0], staged[1], []
+        except BaseException:
+            self._remove(staged)
+            raise
+        for staged_path, path in zip(staged, paths):
+            os.replace(staged_path, path)
+
+    @staticmethod
+    def _remove(paths):
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    @contextlib.asynccontextmanager
+    async def _locked(self, log_id: str):
+        """同一日志的写入串行执行"""
+        lock = self._locks.setdefault(log_id, asyncio.Lock())
+        async with lock:
+            try:
+                yield
+            finally:
+                if not lock._waiters:
+                    self._locks.pop(log_id, None)
+
+    @staticmethod
+    async def get_cursor(machine_id: str) -> Optional[LogCursor]:
+        """查询Windows机器的日志上传偏移"""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(LogCursor).where(LogCursor.machine_id == machine_id))
+            return result.scalar_one_or_none()
+
+    @staticmethod
+    async def find_cursor(we_chat_id: str) -> Optional[LogCursor]:
+        """按Windows端微信ID查询最近一次上传日志的机器的偏移（下发get_logs命令时使用）"""
+        if not we_chat_id:
+            return None
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(LogCursor)
+                .where(LogCursor.we_chat_id == we_chat_id)
+                .order_by(LogCursor.updated_at.desc())
+                .limit(1)
+            )
+            return result.scalar_one_or_none()
+
+    @staticmethod
+    async def _save_cursor(machine_id: str, we_chat_id: str, log_file_name: str, source_offset: int, total_lines: int):
+        values = {
+            "we_chat_id": we_chat_id or "",
+            "log_file_name": log_file_name,
+            "source_offset": source_offset,
+            "total_lines": total_lines,
+            "updated_at": datetime.utcnow(),
+        }
+        async with AsyncSessionLocal() as session:
+            stmt = dialect_insert(LogCursor.__table__).values(machine_id=machine_id, **values)
+            await session.execute(stmt.on_conflict_do_update(index_elements=["machine_id"], set_=values))
+            await session.commit()
+
+    async def _ingest(
+        self, log_path: str, index_path: str, index: List[Dict], cipher: AESGCM, chunks: AsyncIterator[bytes],
+        max_bytes: int, complete_lines_only: bool
+    ) -> LogIngestResult:
+        """解密日志流并追加到log_path（块索引追加到index_path，index为已有的块索引）"""
+        result = LogIngestResult()
+        next_line = index[-1]["line"] + index[-1]["lines"] if index else 0
+        offset = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+        result.first_line = next_line
+
+        # 按顺序写入的解密任务（最多同时进行 2 * 线程数 个，限制内存占用）
+        pending: List[asyncio.Future] = []
+        max_pending = log_executor.max_workers * 2
+
+        with open(log_path, "ab") as log_file, open(index_path, "a", encoding="utf-8") as index_file:
+
+            async def write_next():
+                nonlocal next_line, offset
+                member, raw_size, line_count, failed = await pending.pop(0)
+                result.failed_lines += failed
+                if not member:
+                    return
+                log_file.write(member)
+                index_file.write(json.dumps({
+                    "line": next_line, "lines": line_count, "offset": offset, "size": len(member), "raw": raw_size
+                }) + "\n")
+                next_line += line_count
+                offset += len(member)
+                result.lines += line_count
+                result.raw_bytes += raw_size
+                result.stored_bytes += len(member)
+
+            async def submit(lines: List[bytes]):
+                pending.append(asyncio.ensure_future(log_executor.run(_decrypt_chunk, cipher, lines)))
+                if len(pending) >= max_pending:
+                    await write_next()
+
+            try:
+                received = 0
+                remainder = b""
+                lines: List[bytes] = []
+                async for chunk in chunks:
+                    received += len(chunk)
+                    if received > max_bytes:
+                        raise LogTooLarge(f"日志超过上传大小限制（{max_bytes}字节）")
+                    parts = (remainder + chunk).split(b"\n")
+                    remainder = parts.pop()
+                    for part in parts:
+                        part = part.strip()
+                        if part:
+                            lines.append(part)
+                    while len(lines) >= self.chunk_lines:
+                        await submit(lines[:self.chunk_lines])
+                        lines = lines[self.chunk_lines:]
+                result.consumed_bytes = received - len(remainder)
+                remainder = remainder.strip()
+                if remainder and not complete_lines_only:
+                    lines.append(remainder)
+                    result.consumed_bytes = received
+                if lines:
+                    await submit(lines)
+                while pending:
+                    await write_next()
+            finally:
+                # 出错时丢弃尚未写入的块（线程池中的任务只返回数据，不写文件）
+                for future in pending:
+                    future.cancel()
+                log_file.flush()
+                index_file.flush()
+
+        result.total_lines = next_line
+        return result
+
+    def _read_lines(self, log_id: str, offset: int, limit: int) -> Tuple[List[str], int]:
+        """读取从第offset行开始的limit行（只解压覆盖这些行的块）"""
+        index = self._load_index(log_id)
+        total = index[-1]["line"] + index[-1]["lines"] if index else 0
+        if offset >= total or limit <= 0:
+            return [], total
+
+        log_path, _ = self._paths(log_id)
+        end = min(offset + limit, total)
+        lines: List[str] = []
+        with open(log_path, "rb") as f:
+            for entry in index:
+                chunk_end = entry["line"] + entry["lines"]
+                if chunk_end <= offset:
+                    continue
+                if entry["line"] >= end:
+                    break
+                f.seek(entry["offset"])
+                text = gzip.decompress(f.read(entry["size"])).decode("utf-8", errors="replace")
+                chunk_lines = text.split("\n")[:entry["lines"]]
+                lines.extend(chunk_lines[max(offset - entry["line"], 0):end - entry["line"]])
+        return lines, total
+
+    async def read_lines(self, log_id: str, offset: int = 0, limit: int = 500) -> Tuple[List[str], int]:
+        """分页读取日志行（在线程池中读取和解压）
+
+        Returns:
+            Tuple[List[str], int]: (日志行, 日志总行数)；日志不存在时返回([], 0)
+        """
+        offset = max(offset, 0)
+        limit = max(1, min(limit, MAX_PAGE_LINES))
+        return await log_executor.run(self._read_lines, log_id, offset, limit)
+
+    def get_stats(self) -> Dict:
+        """获取日志解密执行器统计"""
+        return {"directory": os.path.abspath(self.directory), "executor": log_executor.get_stats()}
+
+
+# 全局日志存储
+log_store = LogStore()
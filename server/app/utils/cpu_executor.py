@@ -0,0 +1,121 @@
+"""
+CPU密集型操作执行器
+将私钥运算等CPU密集型操作放到线程池中执行，限制同时执行的数量和排队数量，
+大量客户端同时重连时事件循环仍能在两次运算之间处理其他连接的消息；
+记录每次操作的排队时间和执行时间
+"""
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional
+
+
+class CpuExecutorBusy(Exception):
+    """排队数量超过上限"""
+
+
+class CpuExecutor:
+    """有并发上限和排队上限的线程池执行器"""
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._semaphore = asyncio.Semaphore(self.max_workers)
+        # 等待执行的操作数
+        self._waiting = 0
+        self._running = 0
+        # 最近的排队时间（秒），用于计算分位数
+        self._queue_times: Deque[float] = deque(maxlen=1000)
+        self.stats: Dict[str, float] = {
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "queue_seconds": 0.0,
+            "max_queue_seconds": 0.0,
+            "run_seconds": 0.0,
+        }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """在线程池中执行fn(*args)并返回结果
+
+        Raises:
+            CpuExecutorBusy: 排队数量超过上限
+        """
+        if self._waiting >= self.max_queue and self._semaphore.locked():
+            self.stats["rejected"] += 1
+            raise CpuExecutorBusy(f"{self.name} 执行器繁忙（排队: {self._waiting}）")
+
+        enqueued = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        started = time.perf_counter()
+        queue_time = started - enqueued
+        self._queue_times.append(queue_time)
+        self.stats["queue_seconds"] += queue_time
+        self.stats["max_queue_seconds"] = max(self.stats["max_queue_seconds"], queue_time)
+
+        loop = asyncio.get_running_loop()
+        self._running += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._release(started)
+            raise
+        # 在线程中的操作结束后才释放并发名额（调用方被取消时操作仍在执行）
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._finished, f, started))
+        return await asyncio.wrap_future(future)
+
+    def _finished(self, future, started: float):
+        if future.cancelled() or future.exception() is not None:
+            self.stats["failed"] += 1
+        else:
+            self.stats["completed"] += 1
+        self._release(started)
+
+    def _release(self, started: float):
+        self._running -= 1
+        self.stats["run_seconds"] += time.perf_counter() - started
+        self._semaphore.release()
+
+    def shutdown(self):
+        """关闭线程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def get_stats(self) -> Dict:
+        """获取执行统计（排队时间单位为毫秒）"""
+        queue_times = sorted(self._queue_times)
+        count = self.stats["completed"] + self.stats["failed"]
+
+        def percentile(ratio: float) -> float:
+            if not queue_times:
+                return 0.0
+            return round(queue_times[min(len(queue_times) - 1, int(len(queue_times) * ratio))] * 1000, 2)
+
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "running": self._running,
+            "waiting": self._waiting,
+            "completed": self.stats["completed"],
+            "failed": self.stats["failed"],
+            "rejected": self.stats["rejected"],
+            "avg_queue_ms": round(self.stats["queue_seconds"] / count * 1000, 2) if count else 0.0,
+            "p50_queue_ms": percentile(0.5),
+            "p99_queue_ms": percentile(0.99),
+            "max_queue_ms": round(self.stats["max_queue_seconds"] * 1000, 2),
+            "avg_run_ms": round(self.stats["run_seconds"] / count * 1000, 2) if count else 0.0,
+        }
@@ -5,11 +5,27 @@
 """
 import os
 import base64
+import hashlib
+import secrets
+import zlib
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.backends import default_backend
-from typing import Optional, Dict
+from typing import Optional, Dict, Union
+from app.utils.session_crypto import SessionCrypto
+
+
+# 通讯压缩（加密前压缩，客户端协商后启用）
+# 压缩后的明文格式：MWZ1 + zlib压缩数据；不以该前缀开头的明文为未压缩数据
+COMPRESSION_CODEC = "zlib"
+COMPRESSION_MAGIC = b"MWZ1"
+# 小于该字节数的消息不压缩
+COMPRESSION_THRESHOLD = int(os.getenv("MYWECHAT_COMPRESSION_THRESHOLD", "1024"))
+# zlib压缩级别（1最快，9压缩率最高）
+COMPRESSION_LEVEL = int(os.getenv("MYWECHAT_COMPRESSION_LEVEL", "6"))
+# 解压后的最大字节数（防止压缩炸弹）
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
 
 
 class EncryptionService:
@@ -17,7 +33,9 @@ class EncryptionService:
     
     _instance = None
     _local_key = None  # 本地密钥（用于日志加密）
-    _session_keys: Dict[str, bytes] = {}  # 会话密钥字典（WebSocket连接ID -> 会话密钥）
+    _local_cipher = None  # 本地密钥的AES-GCM实例
+    _sessions: Dict[str, SessionCrypto] = {}  # 会话加密上下文（WebSocket连接ID -> 上下文）
+    _compression_stats: Dict[str, Dict[str, int]] = {}  # 压缩统计（消息类型 -> 计数）
     
     def __new__(cls):
         if cls._instance is None:
@@ -27,6 +45,7 @@ class EncryptionService:
     def __init__(self):
         if self._local_key is None:
             self._local_key = self._get_local_encryption_key()
+            self._local_cipher = AESGCM(self._local_key)
     
     def _get_local_encryption_key(self) -> bytes:
         """获取本地加密密钥（32字节，256位，用于日志加密）"""
@@ -70,70 +89,67 @@ class EncryptionService:
             # Windows端使用：Rfc2898DeriveBytes(machineId, salt, 100000, HashAlgorithmName.SHA256)
             salt = b"MyWeChat_Encryption_Salt_2024"  # 与Windows端保持一致
             
-            kdf = PBKDF2HMAC(
-                algorithm=hashes.SHA256(),
-                length=32,
-                salt=salt,
-                iterations=100000,
-                backend=default_backend()
-            )
+            # 使用hashlib（计算期间释放GIL，可以在线程池中执行而不阻塞事件循环），结果与PBKDF2HMAC相同
             # 使用机器ID作为密码（与Windows端保持一致）
-            key = kdf.derive(machine_id.encode('utf-8'))
+            key = hashlib.pbkdf2_hmac("sha256", machine_id.encode('utf-8'), salt, 100000, 32)
             return key
         except Exception as e:
             print(f"根据机器ID生成密钥失败: {e}")
             # 回退到默认密钥
             return self._get_local_encryption_key()
     
-    def set_session_key(self, connection_id: str, session_key: bytes):
-        """设置会话密钥（用于通讯加密）"""
-        if len(session_key) != 32:
-            raise ValueError("会话密钥必须是32字节")
-        self._session_keys[connection_id] = session_key
+    def create_session(self, connection_id: str, session_key: bytes) -> SessionCrypto:
+        """密钥交换完成后创建连接的会话加密上下文（用于通讯加密）"""
+        crypto = SessionCrypto(connection_id, session_key)
+        self._sessions[connection_id] = crypto
         print(f"会话密钥已设置（连接ID: {connection_id[:8]}...）")
+        return crypto
     
-    def get_session_key(self, connection_id: str) -> Optional[bytes]:
-        """获取会话密钥（用于通讯加密）"""
-        return self._session_keys.get(connection_id)
+    def get_session(self, connection_id: str) -> Optional[SessionCrypto]:
+        """获取连接的会话加密上下文"""
+        return self._sessions.get(connection_id)
     
-    def remove_session_key(self, connection_id: str):
-        """移除会话密钥"""
-        if connection_id in self._session_keys:
-            del self._session_keys[connection_id]
+    def remove_session(self, connection_id: str):
+        """移除连接的会话加密上下文"""
+        if self._sessions.pop(connection_id, None) is not None:
             print(f"会话密钥已移除（连接ID: {connection_id[:8]}...）")
     
     def has_session_key(self, connection_id: str) -> bool:
         """检查是否有会话密钥"""
-        return connection_id in self._session_keys
+        return connection_id in self._sessions
+    
+    def get_session_stats(self) -> Dict[str, int]:
+        """获取WebSocket会话加密统计（当前会话数及收发合计）"""
+        totals = {"sessions": len(self._sessions), "messages_out": 0, "bytes_out": 0, "messages_in": 0, "bytes_in": 0, "decrypt_failures": 0}
+        for crypto in self._sessions.values():
+            for name, value in crypto.get_stats().items():
+                totals[name] += value
+        return totals
     
-    def encrypt_string_for_http(self, session_id: str, plain_text: str) -> str:
+    async def encrypt_string_for_http(self, session_id: str, plain_text: str) -> str:
         """加密字符串（用于HTTP API，使用HTTP会话密钥）"""
         from app.utils.http_session_manager import http_session_manager
         
-        session_key = http_session_manager.get_session_key(session_id)
-        if session_key is None:
+        crypto = await http_session_manager.get_session_crypto(session_id)
+        if crypto is None:
             raise ValueError(f"HTTP会话 {session_id} 的会话密钥未找到或已过期")
         
         try:
-            plain_bytes = plain_text.encode('utf-8')
-            encrypted = self._encrypt_bytes_with_key(plain_bytes, session_key)
-            return base64.b64encode(encrypted).decode('utf-8')
+            return crypto.encrypt_b64(plain_text.encode('utf-8'))
         except Exception as e:
             print(f"加密HTTP字符串失败: {e}")
             raise
     
-    def decrypt_string_for_http(self, session_id: str, cipher_text: str) -> str:
+    async def decrypt_string_for_http(self, session_id: str, cipher_text: str) -> str:
         """解密字符串（用于HTTP API，使用HTTP会话密钥）"""
         from app.utils.http_session_manager import http_session_manager
         
-        session_key = http_session_manager.get_session_key(session_id)
-        if session_key is None:
+        crypto = await http_session_manager.get_session_crypto(session_id)
+        if crypto is None:
             raise ValueError(f"HTTP会话 {session_id} 的会话密钥未找到或已过期")
         
         try:
-            cipher_bytes = base64.b64decode(cipher_text)
-            decrypted = self._decrypt_bytes_with_key(cipher_bytes, session_key)
-            return decrypted.decode('utf-8')
+            return crypto.decrypt_b64(cipher_text).decode('utf-8')
         except Exception as e:
             print(f"解密HTTP字符串失败: {e}")
             raise
@@ -143,14 +159,12 @@ class EncryptionService:
         if not plain_text:
             return ""
         
-        session_key = self.get_session_key(connection_id)
-        if session_key is None:
+        crypto = self.get_session(connection_id)
+        if crypto is None:
             raise ValueError(f"连接 {connection_id} 的会话密钥未设置")
         
         try:
-            plain_bytes = plain_text.encode('utf-8')
-            encrypted = self._encrypt_bytes_with_key(plain_bytes, session_key)
-            return base64.b64encode(encrypted).decode('utf-8')
+            return crypto.encrypt_b64(plain_text.encode('utf-8'))
         except Exception as e:
             print(f"加密通讯字符串失败: {e}")
             raise
@@ -160,18 +174,64 @@ class EncryptionService:
         if not cipher_text:
             return ""
         
-        session_key = self.get_session_key(connection_id)
-        if session_key is None:
+        crypto = self.get_session(connection_id)
+        if crypto is None:
             raise ValueError(f"连接 {connection_id} 的会话密钥未设置")
         
         try:
-            cipher_bytes = base64.b64decode(cipher_text)
-            decrypted = self._decrypt_bytes_with_key(cipher_bytes, session_key)
-            return decrypted.decode('utf-8')
+            return crypto.decrypt_b64(cipher_text).decode('utf-8')
         except Exception as e:
             print(f"解密通讯字符串失败: {e}")
             raise
     
+    def compress_for_communication(self, plain_bytes: Union[bytes, memoryview], message_type: str = "unknown") -> Union[bytes, memoryview]:
+        """加密前压缩明文（小于阈值或压缩后没有变小时返回原数据）
+        
+        Args:
+            plain_bytes: 明文字节
+            message_type: 消息类型（用于统计各类型的压缩率）
+        
+        Returns:
+            压缩后的明文（MWZ1 + zlib数据）或原明文
+        """
+        stats = self._compression_stats.setdefault(message_type or "unknown", {
+            "messages": 0,
+            "compressed": 0,
+            "raw_bytes": 0,
+            "sent_bytes": 0,
+        })
+        stats["messages"] += 1
+        stats["raw_bytes"] += len(plain_bytes)
+        
+        if len(plain_bytes) >= COMPRESSION_THRESHOLD:
+            compressed = COMPRESSION_MAGIC + zlib.compress(plain_bytes, COMPRESSION_LEVEL)
+            if len(compressed) < len(plain_bytes):
+                stats["compressed"] += 1
+                stats["sent_bytes"] += len(compressed)
+                return compressed
+        
+        stats["sent_bytes"] += len(plain_bytes)
+        return plain_bytes
+    
+    def decompress_for_communication(self, data: bytes) -> bytes:
+        """解压客户端发送的压缩明文（未压缩的数据原样返回）"""
+        if data[:len(COMPRESSION_MAGIC)] != COMPRESSION_MAGIC:
+            return data
+        
+        decompressor = zlib.decompressobj()
+        plain = decompressor.decompress(memoryview(data)[len(COMPRESSION_MAGIC):], MAX_DECOMPRESSED_SIZE)
+        if decompressor.unconsumed_tail:
+            raise ValueError(f"解压后的数据超过限制（{MAX_DECOMPRESSED_SIZE}字节）")
+        return plain
+    
+    def get_compression_stats(self) -> Dict[str, Dict]:
+        """获取各消息类型的压缩统计（压缩率 = 压缩后字节数 / 原始字节数）"""
+        result = {}
+        for message_type, stats in self._compression_stats.items():
+            ratio = stats["sent_bytes"] / stats["raw_bytes"] if stats["raw_bytes"] else 1.0
+            result[message_type] = dict(stats, ratio=round(ratio, 4))
+        return result
+    
     def encrypt_string_for_log(self, plain_text: str) -> str:
         """加密字符串（用于日志，使用本地密钥）"""
         if not plain_text:
@@ -179,7 +239,7 @@ class EncryptionService:
         
         try:
             plain_bytes = plain_text.encode('utf-8')
-            encrypted = self._encrypt_bytes_with_key(plain_bytes, self._local_key)
+            encrypted = self._encrypt_bytes_with_cipher(plain_bytes, self._local_cipher)
             return base64.b64encode(encrypted).decode('utf-8')
         except Exception as e:
             print(f"加密日志字符串失败: {e}")
@@ -192,7 +252,7 @@ class EncryptionService:
         
         try:
             cipher_bytes = base64.b64decode(cipher_text)
-            decrypted = self._decrypt_bytes_with_key(cipher_bytes, self._local_key)
+            decrypted = self._decrypt_bytes_with_cipher(cipher_bytes, self._local_cipher)
             return decrypted.decode('utf-8')
         except Exception as e:
             print(f"解密日志字符串失败: {e}")
@@ -205,13 +265,29 @@ class EncryptionService:
         if not plain_bytes:
             return b""
         
+        return self._encrypt_bytes_with_cipher(plain_bytes, AESGCM(key))
+    
+    def _decrypt_bytes_with_key(self, cipher_bytes: bytes, key: bytes) -> bytes:
+        """使用指定密钥解密字节数组
+        格式：nonce(12字节) + ciphertext + tag(16字节)
+        """
+        if not cipher_bytes or len(cipher_bytes) < 28:  # 至少需要 12(nonce) + 0(ciphertext) + 16(tag)
+            return b""
+        
+        return self._decrypt_bytes_with_cipher(cipher_bytes, AESGCM(key))
+    
+    def _encrypt_bytes_with_cipher(self, plain_bytes: bytes, aesgcm: AESGCM) -> bytes:
+        """使用指定AESGCM实例加密字节数组
+        格式：nonce(12字节) + ciphertext + tag(16字节)
+        """
+        if not plain_bytes:
+            return b""
+        
         try:
             # 生成随机 nonce（12字节）
-            import secrets
             nonce = secrets.token_bytes(12)
             
             # 加密
-            aesgcm = AESGCM(key)
             ciphertext = aesgcm.encrypt(nonce, plain_bytes, None)
             
             # 组合：nonce + ciphertext（ciphertext 已经包含 tag）
@@ -223,8 +299,8 @@ class EncryptionService:
             print(f"加密字节数组失败: {e}")
             raise
     
-    def _decrypt_bytes_with_key(self, cipher_bytes: bytes, key: bytes) -> bytes:
-        """使用指定密钥解密字节数组
+    def _decrypt_bytes_with_cipher(self, cipher_bytes: bytes, aesgcm: AESGCM) -> bytes:
+        """使用指定AESGCM实例解密字节数组
         格式：nonce(12字节) + ciphertext + tag(16字节)
         """
         if not cipher_bytes or len(cipher_bytes) < 28:  # 至少需要 12(nonce) + 0(ciphertext) + 16(tag)
@@ -236,7 +312,6 @@ class EncryptionService:
             ciphertext_with_tag = cipher_bytes[12:]
             
             # 解密
-            aesgcm = AESGCM(key)
             plaintext = aesgcm.decrypt(nonce, ciphertext_with_tag, None)
             return plaintext
         except Exception as e:
@@ -44,7 +44,7 @@ async def decrypt_request_body(request: Request) -> dict:
             
             try:
                 # 使用HTTP会话密钥解密
-                decrypted_data = encryption_service.decrypt_string_for_http(session_id, encrypted_data)
+                decrypted_data = await encryption_service.decrypt_string_for_http(session_id, encrypted_data)
                 
                 # 解析解密后的JSON
                 decrypted_json = json.loads(decrypted_data)
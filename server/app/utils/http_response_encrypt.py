@@ -0,0 +1,42 @@
+"""
+HTTP响应加密工具
+按请求头加密返回给客户端的响应（与 http_request_decrypt 对应）
+"""
+from fastapi import Request, HTTPException
+from pydantic import BaseModel
+from app.utils.encryption_service import encryption_service
+import json
+
+
+async def encrypt_response_body(request: Request, body: BaseModel):
+    """
+    按请求头返回加密或明文响应
+    
+    请求包含 X-Session-ID 时使用HTTP会话密钥加密；
+    包含 X-Encryption 时使用固定密钥加密（旧方式）；
+    否则原样返回（向后兼容）
+    """
+    # 检查是否有会话ID（HTTP密钥交换）
+    session_id = request.headers.get("X-Session-ID")
+    if session_id:
+        try:
+            body_json = json.dumps(body.model_dump(mode='json'), ensure_ascii=False)
+            encrypted_data = await encryption_service.encrypt_string_for_http(session_id, body_json)
+            return {
+                "encrypted": True,
+                "data": encrypted_data
+            }
+        except Exception as e:
+            # 会话密钥无效或过期，返回错误
+            raise HTTPException(status_code=401, detail=f"会话密钥无效或已过期: {str(e)}")
+
+    # 检查请求头是否要求加密（旧方式，使用固定密钥）
+    if request.headers.get("X-Encryption"):
+        body_json = json.dumps(body.model_dump(mode='json'), ensure_ascii=False)
+        return {
+            "encrypted": True,
+            "data": encryption_service.encrypt_string_for_log(body_json)
+        }
+
+    # 返回明文响应
+    return body
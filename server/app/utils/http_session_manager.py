@@ -1,96 +1,256 @@
 """
 HTTP会话密钥管理器
 管理HTTP请求的会话密钥（用于无状态HTTP API的密钥交换）
+
+会话保存在可替换的会话存储中（见 session_store），多个worker进程共享同一个存储时，
+任何一个worker创建的X-Session-ID在其他worker上同样可用；
+每个worker在本地缓存会话加密上下文，只有缓存未命中或需要重新校验时才读取会话存储。
+
+本地缓存按最后使用时间从早到晚排列（使用时移到末尾），后台清扫任务定期从头部移除过期的会话，
+耗时只与过期的会话数有关；会话存储中的过期会话和超出上限的会话也由清扫任务删除
+
+会话存储可能阻塞（SQLite等待其他worker的写锁），访问存储的方法都是协程，阻塞的存储在单独的线程中调用
 """
+import os
+import asyncio
 import secrets
 import time
+from collections import OrderedDict
 from typing import Optional, Dict
-from datetime import datetime, timedelta
+from app.utils.cpu_executor import CpuExecutor
+from app.utils.session_crypto import SessionCrypto
+from app.utils.session_store import SessionStore, create_session_store
+
+
+# 默认配置（可通过环境变量覆盖）
+# 每个worker本地缓存的最大会话数
+SESSION_CACHE_SIZE = int(os.getenv("MYWECHAT_SESSION_CACHE_SIZE", "10000"))
+# 本地缓存重新校验的间隔（秒），超过后从会话存储确认会话仍然存在（可能已被其他worker移除或判定过期）
+SESSION_CACHE_TTL = float(os.getenv("MYWECHAT_SESSION_CACHE_TTL", "30"))
+# 过期会话清扫间隔（秒）
+SESSION_SWEEP_INTERVAL = float(os.getenv("MYWECHAT_SESSION_SWEEP_INTERVAL", "60"))
+
+# 最后使用时间写回会话存储的最小间隔（秒），避免每个请求都写存储
+_TOUCH_INTERVAL = 60
+
+# 会话存储执行器（单线程：SQLite连接按线程创建，操作按顺序执行）
+session_store_executor = CpuExecutor("session_store", 1, 10000)
 
 
 class HTTPSessionManager:
     """HTTP会话密钥管理器"""
     
     _instance = None
-    _sessions: Dict[str, dict] = {}  # session_id -> {session_key, created_at, last_used}
     _session_timeout = 3600  # 会话超时时间（秒，1小时）
-    _cleanup_interval = 300  # 清理间隔（秒，5分钟）
-    _last_cleanup = time.time()
     
-    def __new__(cls):
+    def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super(HTTPSessionManager, cls).__new__(cls)
         return cls._instance
     
-    def create_session(self, session_key: bytes) -> str:
+    def __init__(self, store: Optional[SessionStore] = None):
+        if getattr(self, "store", None) is not None and store is None:
+            return
+        self.store = store or create_session_store()
+        # 本地缓存：session_id -> {crypto, last_used, checked_at, touched_at}
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._sweeper_task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {
+            "created": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "cache_evicted": 0,
+            "expired": 0,
+            "sweeps": 0,
+            "store_errors": 0,
+        }
+        # 最近一次清扫的耗时（毫秒）
+        self.last_sweep_ms = 0.0
+    
+    def start(self):
+        """启动后台清扫任务"""
+        if self._sweeper_task is None or self._sweeper_task.done():
+            self._sweeper_task = asyncio.create_task(self._sweeper_loop())
+    
+    async def stop(self):
+        """停止后台清扫任务"""
+        if self._sweeper_task is not None:
+            self._sweeper_task.cancel()
+            try:
+                await self._sweeper_task
+            except asyncio.CancelledError:
+                pass
+            self._sweeper_task = None
+    
+    async def _sweeper_loop(self):
+        while True:
+            await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+            try:
+                await self.expire_sessions()
+            except Exception as e:
+                print(f"清理过期的HTTP会话失败: {e}")
+    
+    async def _call_store(self, fn, *args):
+        """调用会话存储的方法（可能阻塞的存储在线程中执行）"""
+        if self.store.blocking:
+            return await session_store_executor.run(fn, *args)
+        return fn(*args)
+    
+    async def create_session(self, session_key: bytes) -> str:
         """创建新会话，返回session_id"""
         if len(session_key) != 32:
             raise ValueError("会话密钥必须是32字节")
         
         # 生成唯一的session_id
         session_id = secrets.token_urlsafe(32)
+        now = time.time()
         
-        # 存储会话信息
-        self._sessions[session_id] = {
-            "session_key": session_key,
-            "created_at": time.time(),
-            "last_used": time.time()
-        }
-        
-        # 定期清理过期会话
-        self._cleanup_expired_sessions()
+        # 先写入共享的会话存储，再放入本地缓存（会话加密上下文在密钥交换时创建一次，之后每个请求直接使用）
+        await self._call_store(self.store.put, session_id, session_key, now)
+        self._cache_put(session_id, SessionCrypto(session_id, session_key), now)
+        self.stats["created"] += 1
         
         print(f"HTTP会话已创建（session_id: {session_id[:16]}...）")
         return session_id
     
-    def get_session_key(self, session_id: str) -> Optional[bytes]:
-        """获取会话密钥"""
+    async def get_session_crypto(self, session_id: str) -> Optional[SessionCrypto]:
+        """获取会话加密上下文（本地缓存未命中时从会话存储读取）"""
         if not session_id:
             return None
         
-        session = self._sessions.get(session_id)
-        if not session:
+        now = time.time()
+        entry = self._cache.get(session_id)
+        if entry is not None and now - entry["checked_at"] < SESSION_CACHE_TTL \
+                and now - entry["last_used"] <= self._session_timeout:
+            self.stats["cache_hits"] += 1
+            self._cache.move_to_end(session_id)
+            await self._touch(session_id, entry, now)
+            return entry["crypto"]
+        
+        # 缓存未命中或需要重新校验
+        self.stats["cache_misses"] += 1
+        try:
+            record = await self._call_store(self.store.get, session_id)
+        except Exception as e:
+            self.stats["store_errors"] += 1
+            print(f"读取HTTP会话失败: {e}")
+            return None
+        if record is None:
+            self._cache.pop(session_id, None)
             return None
         
+        session_key, _, last_used = record
+        if entry is not None:
+            last_used = max(last_used, entry["last_used"])
+        
         # 检查是否过期
-        if time.time() - session["last_used"] > self._session_timeout:
+        if now - last_used > self._session_timeout:
             # 会话已过期，删除
-            del self._sessions[session_id]
+            await self.remove_session(session_id)
+            self.stats["expired"] += 1
             print(f"HTTP会话已过期（session_id: {session_id[:16]}...）")
             return None
         
-        # 更新最后使用时间
-        session["last_used"] = time.time()
-        return session["session_key"]
+        # 同一会话只构建一次加密上下文（重新校验时沿用缓存中的上下文）
+        crypto = entry["crypto"] if entry is not None else SessionCrypto(session_id, session_key)
+        entry = self._cache_put(session_id, crypto, now)
+        await self._touch(session_id, entry, now)
+        return crypto
     
-    def remove_session(self, session_id: str):
+    async def remove_session(self, session_id: str):
         """移除会话"""
-        if session_id in self._sessions:
-            del self._sessions[session_id]
-            print(f"HTTP会话已移除（session_id: {session_id[:16]}...）")
+        self._cache.pop(session_id, None)
+        try:
+            await self._call_store(self.store.delete, session_id)
+        except Exception as e:
+            self.stats["store_errors"] += 1
+            print(f"删除HTTP会话失败: {e}")
+            return
+        print(f"HTTP会话已移除（session_id: {session_id[:16]}...）")
     
-    def _cleanup_expired_sessions(self):
-        """清理过期会话"""
-        current_time = time.time()
-        
-        # 每5分钟清理一次
-        if current_time - self._last_cleanup < self._cleanup_interval:
+    def _cache_put(self, session_id: str, crypto: SessionCrypto, now: float) -> dict:
+        """放入本地缓存，超过上限时淘汰最久未使用的会话（会话仍保存在会话存储中）"""
+        entry = {"crypto": crypto, "last_used": now, "checked_at": now, "touched_at": now}
+        self._cache[session_id] = entry
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > SESSION_CACHE_SIZE:
+            self._cache.popitem(last=False)
+            self.stats["cache_evicted"] += 1
+        return entry
+    
+    async def _touch(self, session_id: str, entry: dict, now: float):
+        """更新最后使用时间，按间隔写回会话存储（其他worker据此判断会话是否过期）"""
+        entry["last_used"] = now
+        if now - entry["touched_at"] < _TOUCH_INTERVAL:
             return
+        entry["touched_at"] = now
+        try:
+            await self._call_store(self.store.touch, session_id, now)
+        except Exception as e:
+            self.stats["store_errors"] += 1
+            print(f"更新HTTP会话失败: {e}")
+    
+    async def get_stats(self) -> Dict:
+        """获取HTTP会话统计"""
+        try:
+            sessions = await self._call_store(self.store.count)
+        except Exception:
+            sessions = -1
+        return {
+            "store": self.store.name,
+            "sessions": sessions,
+            "max_sessions": self.store.max_sessions,
+            "evicted": self.store.evicted,
+            "cached": len(self._cache),
+            "cache_size": SESSION_CACHE_SIZE,
+            "last_sweep_ms": round(self.last_sweep_ms, 2),
+            "store_executor": session_store_executor.get_stats() if self.store.blocking else None,
+            **self.stats,
+        }
+    
+    async def expire_sessions(self, now: Optional[float] = None):
+        """清理过期会话，并淘汰会话存储中超出上限的会话"""
+        started = time.perf_counter()
+        if now is None:
+            now = time.time()
+        expire_before = now - self._session_timeout
         
-        self._last_cleanup = current_time
-        
-        expired_sessions = []
-        for session_id, session in self._sessions.items():
-            if current_time - session["last_used"] > self._session_timeout:
-                expired_sessions.append(session_id)
+        # 本地缓存按最后使用时间排列，从头部检查到不会在下次写回前过期的会话为止：过期的移除；
+        # 即将过期、但最后使用时间还没写回的会话先写回，避免被会话存储按旧的时间判定为过期
+        expired_ids = []
+        touches = []
+        for session_id, entry in self._cache.items():
+            if entry["last_used"] >= expire_before + _TOUCH_INTERVAL:
+                break
+            if entry["last_used"] < expire_before:
+                expired_ids.append(session_id)
+            elif entry["touched_at"] < entry["last_used"]:
+                entry["touched_at"] = entry["last_used"]
+                touches.append((session_id, entry["last_used"]))
+        for session_id in expired_ids:
+            del self._cache[session_id]
+        # 遍历结束后再访问存储（等待期间本地缓存可能被其他请求修改）
+        for session_id, last_used in touches:
+            try:
+                await self._call_store(self.store.touch, session_id, last_used)
+            except Exception as e:
+                self.stats["store_errors"] += 1
+                print(f"更新HTTP会话失败: {e}")
         
-        for session_id in expired_sessions:
-            del self._sessions[session_id]
+        try:
+            expired = await self._call_store(self.store.purge_expired, expire_before)
+            evicted = await self._call_store(self.store.trim)
+        except Exception as e:
+            self.stats["store_errors"] += 1
+            print(f"清理过期的HTTP会话失败: {e}")
+            return
         
-        if expired_sessions:
-            print(f"已清理 {len(expired_sessions)} 个过期的HTTP会话")
+        self.stats["sweeps"] += 1
+        self.stats["expired"] += expired
+        self.last_sweep_ms = (time.perf_counter() - started) * 1000
+        if expired or evicted:
+            print(f"已清理 {expired} 个过期的HTTP会话，淘汰 {evicted} 个超出上限的HTTP会话")
 
 
 # 全局HTTP会话管理器实例
 http_session_manager = HTTPSessionManager()
-
@@ -0,0 +1,100 @@
+"""
+机器ID密钥派生服务
+get_logs命令结果使用根据Windows端机器ID派生的密钥加密，每次派生是10万次PBKDF2-SHA256（几十毫秒的CPU计算）。
+派生在线程池中执行（hashlib计算期间释放GIL），不阻塞事件循环；结果按机器ID缓存（LRU），
+同一机器ID的并发请求共享同一次派生
+"""
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from app.utils.encryption_service import encryption_service
+
+
+# 默认配置（可通过环境变量覆盖）
+KDF_CACHE_SIZE = int(os.getenv("MYWECHAT_KDF_CACHE_SIZE", "256"))
+KDF_WORKERS = int(os.getenv("MYWECHAT_KDF_WORKERS", "2"))
+
+
+class KeyDerivationService:
+    """按机器ID缓存派生密钥"""
+
+    def __init__(self, cache_size: int = KDF_CACHE_SIZE, workers: int = KDF_WORKERS):
+        self.cache_size = max(1, cache_size)
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        # 正在派生的机器ID -> 派生结果
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._workers = max(1, workers)
+        self.stats: Dict[str, float] = {
+            "hits": 0,
+            "misses": 0,
+            "shared": 0,
+            "derive_seconds": 0.0,
+        }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="kdf")
+        return self._executor
+
+    async def get_machine_key(self, machine_id: str) -> bytes:
+        """获取机器ID对应的加密密钥（与Windows端保持一致）"""
+        key = self._cache.get(machine_id)
+        if key is not None:
+            self._cache.move_to_end(machine_id)
+            self.stats["hits"] += 1
+            return key
+
+        inflight = self._inflight.get(machine_id)
+        if inflight is not None:
+            # 同一机器ID正在派生，等待同一个结果
+            self.stats["shared"] += 1
+            return await asyncio.shield(inflight)
+
+        self.stats["misses"] += 1
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._inflight[machine_id] = future
+        try:
+            started = time.perf_counter()
+            key = await loop.run_in_executor(
+                self._get_executor(), encryption_service.get_encryption_key_from_machine_id, machine_id
+            )
+            self.stats["derive_seconds"] += time.perf_counter() - started
+            self._cache[machine_id] = key
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            future.set_result(key)
+            return key
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "Future exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self._inflight[machine_id]
+
+    def shutdown(self):
+        """关闭线程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def get_stats(self) -> Dict:
+        """获取缓存统计"""
+        return {
+            "size": len(self._cache),
+            "max_size": self.cache_size,
+            "inflight": len(self._inflight),
+            **{name: round(value, 3) if isinstance(value, float) else value for name, value in self.stats.items()},
+        }
+
+
+# 全局密钥派生服务
+key_derivation_service = KeyDerivationService()
@@ -1,6 +1,7 @@
 """
 RSA密钥管理服务（服务器端）
 用于密钥交换协议
+私钥解密在有并发上限的线程池中执行（decrypt_session_key_async），避免大量客户端同时重连时阻塞事件循环
 """
 import os
 import base64
@@ -8,6 +9,17 @@ from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.backends import default_backend
 from typing import Optional, Tuple
+from app.utils.cpu_executor import CpuExecutor
+
+
+# 默认配置（可通过环境变量覆盖）
+# 同时执行私钥解密的线程数
+RSA_WORKERS = int(os.getenv("MYWECHAT_RSA_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 排队等待私钥解密的最大数量，超过后拒绝密钥交换（客户端重连后重试）
+RSA_MAX_QUEUE = int(os.getenv("MYWECHAT_RSA_MAX_QUEUE", "2000"))
+
+# 私钥运算执行器
+rsa_executor = CpuExecutor("rsa", RSA_WORKERS, RSA_MAX_QUEUE)
 
 
 class RSAKeyManager:
@@ -127,6 +139,14 @@ class RSAKeyManager:
         except Exception as e:
             print(f"解密会话密钥失败: {e}")
             raise
+    
+    async def decrypt_session_key_async(self, encrypted_key_b64: str) -> bytes:
+        """在私钥运算执行器中解密会话密钥
+        
+        Raises:
+            CpuExecutorBusy: 排队等待解密的请求过多
+        """
+        return await rsa_executor.run(self.decrypt_session_key, encrypted_key_b64)
 
 
 # 全局RSA密钥管理器实例
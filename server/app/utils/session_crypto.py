@@ -0,0 +1,98 @@
+"""
+会话加密上下文
+每次密钥交换（WebSocket连接或HTTP会话）创建一个，保存预先构建的AES-GCM实例和收发字节计数，
+之后每条消息的加解密不再重新构建AESGCM
+
+同一个会话密钥可能同时存在多个加密上下文（多个worker进程共享HTTP会话、会话移出本地缓存后重新加载），
+因此每条消息使用12字节随机nonce，不依赖上下文内的计数
+
+密文格式与客户端保持一致：nonce(12字节) + ciphertext + tag(16字节)
+"""
+import os
+import time
+import base64
+from typing import Dict, Union
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+
+class SessionCrypto:
+    """单个会话的加密上下文"""
+
+    __slots__ = (
+        "session_id",
+        "cipher",
+        "created_at",
+        "messages_out",
+        "bytes_out",
+        "messages_in",
+        "bytes_in",
+        "decrypt_failures",
+    )
+
+    def __init__(self, session_id: str, session_key: bytes):
+        if len(session_key) != 32:
+            raise ValueError("会话密钥必须是32字节")
+        # 稳定的会话ID（WebSocket连接ID或HTTP会话ID）
+        self.session_id = session_id
+        self.cipher = AESGCM(session_key)
+        self.created_at = time.time()
+        # 收发计数（明文字节数）
+        self.messages_out = 0
+        self.bytes_out = 0
+        self.messages_in = 0
+        self.bytes_in = 0
+        self.decrypt_failures = 0
+
+    @staticmethod
+    def next_nonce() -> bytes:
+        """生成nonce（96位随机数）"""
+        return os.urandom(NONCE_SIZE)
+
+    def encrypt(self, plain_bytes: Union[bytes, memoryview]) -> bytes:
+        """加密为 nonce + ciphertext + tag（空明文返回空字节）"""
+        if not plain_bytes:
+            return b""
+        nonce = self.next_nonce()
+        encrypted = nonce + self.cipher.encrypt(nonce, plain_bytes, None)
+        self.messages_out += 1
+        self.bytes_out += len(plain_bytes)
+        return encrypted
+
+    def decrypt(self, cipher_bytes: Union[bytes, memoryview]) -> bytes:
+        """解密 nonce + ciphertext + tag（长度不足时返回空字节）"""
+        if not cipher_bytes or len(cipher_bytes) < NONCE_SIZE + TAG_SIZE:
+            return b""
+        view = memoryview(cipher_bytes)
+        try:
+            plain = self.cipher.decrypt(view[:NONCE_SIZE], view[NONCE_SIZE:], None)
+        except Exception:
+            self.decrypt_failures += 1
+            raise
+        self.messages_in += 1
+        self.bytes_in += len(plain)
+        return plain
+
+    def encrypt_b64(self, plain_bytes: Union[bytes, memoryview]) -> str:
+        """加密并编码为base64字符串（空明文返回空字符串）"""
+        if not plain_bytes:
+            return ""
+        return base64.b64encode(self.encrypt(plain_bytes)).decode("ascii")
+
+    def decrypt_b64(self, cipher_text: str) -> bytes:
+        """解密base64密文为明文字节（不做UTF-8解码）"""
+        if not cipher_text:
+            return b""
+        return self.decrypt(base64.b64decode(cipher_text))
+
+    def get_stats(self) -> Dict:
+        return {
+            "messages_out": self.messages_out,
+            "bytes_out": self.bytes_out,
+            "messages_in": self.messages_in,
+            "bytes_in": self.bytes_in,
+            "decrypt_failures": self.decrypt_failures,
+        }
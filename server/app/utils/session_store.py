@@ -0,0 +1,214 @@
+"""
+HTTP会话存储
+保存HTTP密钥交换创建的会话密钥，可替换后端：
+- memory: 进程内字典（单进程运行时使用）
+- sqlite: 本机SQLite文件（WAL模式），同一台机器上的多个worker进程共享，不需要额外的服务
+
+存储只负责持久化和过期时间，会话加密上下文由各worker的HTTPSessionManager按需构建并缓存。
+存储的方法都是同步的；blocking为True的存储（SQLite）由HTTPSessionManager放到单独的线程中调用，
+其他worker持有写锁时不会阻塞事件循环
+"""
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+# 默认配置（可通过环境变量覆盖）
+# 会话存储后端：memory / sqlite（未设置时多worker运行使用sqlite，否则使用memory）
+SESSION_STORE_BACKEND = os.getenv("MYWECHAT_SESSION_STORE", "")
+# SQLite会话存储文件路径
+SESSION_STORE_PATH = os.getenv("MYWECHAT_SESSION_STORE_PATH", os.path.join(".", "data", "http_sessions.db"))
+# 最多保存的会话数，超过后淘汰最久未使用的会话
+SESSION_MAX_COUNT = int(os.getenv("MYWECHAT_SESSION_MAX", "100000"))
+
+# 会话记录：(会话密钥, 创建时间, 最后使用时间)
+SessionRecord = Tuple[bytes, float, float]
+
+
+class SessionStore(ABC):
+    """HTTP会话存储接口（后端需要实现全部抽象方法，否则无法实例化）"""
+
+    name = "base"
+    # 操作是否可能阻塞（需要在线程中调用）
+    blocking = False
+
+    def __init__(self, max_sessions: int = SESSION_MAX_COUNT):
+        self.max_sessions = max_sessions
+        # 因超出上限被淘汰的会话数
+        self.evicted = 0
+
+    @abstractmethod
+    def put(self, session_id: str, session_key: bytes, created_at: float):
+        """保存新会话"""
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[SessionRecord]:
+        """读取会话（不存在时返回None，不检查过期）"""
+
+    @abstractmethod
+    def touch(self, session_id: str, last_used: float):
+        """更新最后使用时间"""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """删除会话"""
+
+    @abstractmethod
+    def purge_expired(self, expire_before: float) -> int:
+        """删除最后使用时间早于expire_before的会话，返回删除数量"""
+
+    @abstractmethod
+    def trim(self) -> int:
+        """会话数超过上限时删除最久未使用的会话，返回删除数量"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """当前保存的会话数"""
+
+
+class MemorySessionStore(SessionStore):
+    """进程内会话存储
+
+    会话按最后使用时间从早到晚排列（更新最后使用时间时移到末尾），
+    清理过期会话和淘汰超出上限的会话都只需从头部移除，不扫描全部会话
+    """
+
+    name = "memory"
+
+    def __init__(self, max_sessions: int = SESSION_MAX_COUNT):
+        super().__init__(max_sessions)
+        self._sessions: "OrderedDict[str, list]" = OrderedDict()
+
+    def put(self, session_id: str, session_key: bytes, created_at: float):
+        self._sessions[session_id] = [session_key, created_at, created_at]
+        self._sessions.move_to_end(session_id)
+        # 进程内存储在写入时直接淘汰，内存不会超过上限
+        self.trim()
+
+    def get(self, session_id: str) -> Optional[SessionRecord]:
+        record = self._sessions.get(session_id)
+        return tuple(record) if record else None
+
+    def touch(self, session_id: str, last_used: float):
+        record = self._sessions.get(session_id)
+        if record and last_used > record[2]:
+            record[2] = last_used
+            self._sessions.move_to_end(session_id)
+
+    def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    def purge_expired(self, expire_before: float) -> int:
+        purged = 0
+        while self._sessions:
+            session_id, record = next(iter(self._sessions.items()))
+            if record[2] >= expire_before:
+                break
+            del self._sessions[session_id]
+            purged += 1
+        return purged
+
+    def trim(self) -> int:
+        trimmed = 0
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            trimmed += 1
+        self.evicted += trimmed
+        return trimmed
+
+    def count(self) -> int:
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """本机SQLite会话存储（多个worker进程共享同一个文件）
+
+    每次操作都是一条主键查询或更新，但其他worker持有写锁时最多等待5秒，因此由HTTPSessionManager在线程中调用；
+    只有worker本地缓存未命中、创建会话和定期更新最后使用时间时才访问
+    """
+
+    name = "sqlite"
+    blocking = True
+
+    def __init__(self, path: str = SESSION_STORE_PATH, max_sessions: int = SESSION_MAX_COUNT):
+        super().__init__(max_sessions)
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # 每个线程使用自己的连接（sqlite3连接不能跨线程使用）
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS http_sessions ("
+                "session_id TEXT PRIMARY KEY, session_key BLOB NOT NULL, "
+                "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_http_sessions_last_used ON http_sessions(last_used)")
+        # 文件中保存的是会话密钥，只允许当前用户读写
+        try:
+            os.chmod(path, 0o600)
+        except OSError:
+            pass
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, session_id: str, session_key: bytes, created_at: float):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO http_sessions (session_id, session_key, created_at, last_used) VALUES (?, ?, ?, ?)",
+            (session_id, session_key, created_at, created_at)
+        )
+
+    def get(self, session_id: str) -> Optional[SessionRecord]:
+        row = self._connect().execute(
+            "SELECT session_key, created_at, last_used FROM http_sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return (bytes(row[0]), row[1], row[2]) if row else None
+
+    def touch(self, session_id: str, last_used: float):
+        self._connect().execute(
+            "UPDATE http_sessions SET last_used = ? WHERE session_id = ? AND last_used < ?",
+            (last_used, session_id, last_used)
+        )
+
+    def delete(self, session_id: str):
+        self._connect().execute("DELETE FROM http_sessions WHERE session_id = ?", (session_id,))
+
+    def purge_expired(self, expire_before: float) -> int:
+        return self._connect().execute("DELETE FROM http_sessions WHERE last_used < ?", (expire_before,)).rowcount
+
+    def trim(self) -> int:
+        excess = self.count() - self.max_sessions
+        if excess <= 0:
+            return 0
+        # 按last_used索引从最早的开始删除
+        trimmed = self._connect().execute(
+            "DELETE FROM http_sessions WHERE session_id IN "
+            "(SELECT session_id FROM http_sessions ORDER BY last_used LIMIT ?)",
+            (excess,)
+        ).rowcount
+        self.evicted += trimmed
+        return trimmed
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM http_sessions").fetchone()[0]
+
+
+def create_session_store(backend: str = SESSION_STORE_BACKEND) -> SessionStore:
+    """按配置创建会话存储"""
+    if not backend:
+        backend = "sqlite" if int(os.getenv("MYWECHAT_WORKERS", "1")) > 1 else "memory"
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    if backend == "memory":
+        return MemorySessionStore()
+    raise ValueError(f"不支持的会话存储: {backend}")
@@ -0,0 +1,465 @@
+"""
+命令下发调度器
+命令持久化在commands表中，按 pending -> dispatched -> acked -> completed/failed 流转：
+- pending: 已创建，等待下发（目标Windows端不在线或下发失败）
+- dispatched: 已放入Windows端的发送队列，等待确认
+- acked: Windows端已确认收到（协商了command_ack的连接发送command_ack消息；旧版本连接在消息写出后视为已确认）
+- completed/failed: 已返回执行结果，或超过下发期限仍未确认
+
+后台清扫任务按退避时间重新下发未确认的命令，超过期限后标记为失败；
+Windows端上线（sync_my_info）时按创建顺序下发该微信账号积压的命令。
+状态变化提交后通过 command_events 通知等待结果的HTTP请求和SSE订阅者。
+"""
+import os
+import json
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.exc import IntegrityError
+from app.models.database import AsyncSessionLocal, Command
+from app.websocket.command_events import command_events, OPEN_STATUSES
+
+
+# 命令状态
+STATUS_PENDING = "pending"
+STATUS_DISPATCHED = "dispatched"
+STATUS_ACKED = "acked"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+# 尚未确认的状态（需要下发或重新下发）
+UNACKED_STATUSES = (STATUS_PENDING, STATUS_DISPATCHED)
+# 尚未返回结果的状态见 command_events.OPEN_STATUSES
+
+# 默认配置（可通过环境变量覆盖）
+# 下发后等待确认的时间（秒），之后按指数退避重新下发
+COMMAND_ACK_TIMEOUT = float(os.getenv("MYWECHAT_COMMAND_ACK_TIMEOUT", "30"))
+# 下发失败（队列已满或连接断开）后的首次重试间隔（秒）
+COMMAND_RETRY_BASE = float(os.getenv("MYWECHAT_COMMAND_RETRY_BASE", "2"))
+# 重试间隔上限（秒）
+COMMAND_RETRY_MAX = float(os.getenv("MYWECHAT_COMMAND_RETRY_MAX", "300"))
+# 下发期限（秒），超过期限仍未确认的命令标记为失败
+COMMAND_DEADLINE = float(os.getenv("MYWECHAT_COMMAND_DEADLINE", "600"))
+# 清扫间隔（秒）
+COMMAND_SWEEP_INTERVAL = float(os.getenv("MYWECHAT_COMMAND_SWEEP_INTERVAL", "5"))
+
+# 单次清扫最多处理的命令数
+_SWEEP_BATCH_SIZE = 200
+# 超期命令的结果说明
+_EXPIRED_RESULT = "超过下发期限，Windows端未确认收到命令"
+
+
+class CommandDispatcher:
+    """命令下发调度器"""
+
+    def __init__(
+        self,
+        manager,
+        ack_timeout: float = COMMAND_ACK_TIMEOUT,
+        retry_base: float = COMMAND_RETRY_BASE,
+        retry_max: float = COMMAND_RETRY_MAX,
+        deadline: float = COMMAND_DEADLINE,
+        sweep_interval: float = COMMAND_SWEEP_INTERVAL
+    ):
+        # WebSocket连接管理器（用于选择Windows端和发送命令）
+        self.manager = manager
+        self.ack_timeout = ack_timeout
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.deadline = deadline
+        self.sweep_interval = sweep_interval
+        # 命令状态通知中心
+        self.events = command_events
+        # 下发操作串行执行，避免清扫任务和上线积压下发重复下发同一条命令
+        self._lock = asyncio.Lock()
+        self._sweeper_task: Optional[asyncio.Task] = None
+        # 微信账号ID -> 正在执行的积压下发任务
+        self._drain_tasks: Dict[str, asyncio.Task] = {}
+        # 下发任务执行期间再次收到下发请求的微信账号（任务结束后再执行一次）
+        self._drain_rerun: Set[str] = set()
+        self.stats: Dict[str, int] = {
+            "dispatched": 0,
+            "redelivered": 0,
+            "acked": 0,
+            "expired": 0,
+            "drained": 0,
+            "drain_coalesced": 0,
+        }
+
+    def start(self):
+        """启动后台清扫任务"""
+        if self._sweeper_task is None or self._sweeper_task.done():
+            self._sweeper_task = asyncio.create_task(self._sweeper_loop())
+
+    async def stop(self):
+        """停止后台清扫任务"""
+        if self._sweeper_task is not None:
+            self._sweeper_task.cancel()
+            try:
+                await self._sweeper_task
+            except asyncio.CancelledError:
+                pass
+            self._sweeper_task = None
+
+    @staticmethod
+    def build_message(command: Command) -> Dict:
+        """构造下发给Windows端的command消息"""
+        return {
+            "type": "command",
+            "command_id": command.command_id,
+            "command_type": command.command_type,
+            "command_data": json.loads(command.command_data) if command.command_data else {},
+            "target_we_chat_id": command.target_we_chat_id or "",
+        }
+
+    def _ack_delay(self, attempts: int) -> float:
+        """第attempts次下发后等待确认的时间（指数退避）"""
+        return min(self.ack_timeout * (2 ** max(attempts - 1, 0)), max(self.retry_max, self.ack_timeout))
+
+    def _retry_delay(self, attempts: int) -> float:
+        """第attempts次下发失败后的重试间隔（指数退避）"""
+        return min(self.retry_base * (2 ** max(attempts - 1, 0)), self.retry_max)
+
+    async def record_forwarded(self, command: Command, connection_id: str) -> bool:
+        """记录由App端通过WebSocket直接转发给指定Windows端的命令（如get_logs）
+
+        命令以acked状态保存（不设下发期限，清扫任务不会重新下发），
+        Windows端之后可以通过HTTP结果接口返回结果
+
+        Returns:
+            bool: 是否已保存（命令ID已存在时返回False）
+        """
+        now = datetime.utcnow()
+        command.status = STATUS_ACKED
+        command.attempts = 1
+        command.dispatched_to = connection_id
+        command.dispatched_at = now
+        command.acked_at = now
+        try:
+            async with AsyncSessionLocal() as session:
+                session.add(command)
+                await session.commit()
+        except IntegrityError:
+            return False
+        self._publish(command)
+        return True
+
+    async def submit(self, command: Command) -> Command:
+        """保存新命令并立即尝试下发
+
+        Args:
+            command: 尚未保存的命令（status为pending）
+
+        Returns:
+            Command: 下发后的命令（目标Windows端不在线时保持pending，等待上线后下发）
+        """
+        return (await self.submit_many([command]))[0]
+
+    async def submit_many(self, commands: List[Command]) -> List[Command]:
+        """在一个事务中批量保存新命令，并连续放入各目标Windows端的发送队列
+
+        发送队列剩余空间不足一半的Windows端不再继续放入，剩余命令保持pending，
+        由清扫任务按顺序下发，避免一次批量下发占满队列导致连接被断开
+
+        Returns:
+            List[Command]: 下发后的命令（顺序与参数相同）
+        """
+        if not commands:
+            return []
+        now = datetime.utcnow()
+        for command in commands:
+            command.status = STATUS_PENDING
+            command.attempts = 0
+            command.deadline_at = now + timedelta(seconds=self.deadline)
+        watchers: List[tuple] = []
+        async with self._lock:
+            async with AsyncSessionLocal() as session:
+                session.add_all(commands)
+                await session.commit()
+                # 队列已满的目标，其后的命令也不下发，保持顺序
+                deferred: Set[str] = set()
+                for command in commands:
+                    target = command.target_we_chat_id or ""
+                    if target in deferred or not self._has_headroom(target):
+                        deferred.add(target)
+                        command.next_attempt_at = now + timedelta(seconds=self.retry_base)
+                        continue
+                    self._dispatch(command, now, watchers)
+                await session.commit()
+        dispatched = {id(command) for command, _, _ in watchers}
+        for command in commands:
+            if id(command) not in dispatched:
+                self._publish(command)
+        self._watch(watchers)
+        # 目标Windows端不在本进程时（已提交为等待上线），通知持有该连接的worker进程下发
+        offline = {
+            command.target_we_chat_id or "" for command in commands
+            if command.status == STATUS_PENDING and command.next_attempt_at is None
+        }
+        for target in offline:
+            self.manager.notify_drain(target)
+        return commands
+
+    def _has_headroom(self, target: str) -> bool:
+        """目标Windows端不在线（由 _dispatch 处理），或有发送队列剩余空间过半的Windows端"""
+        candidates = self.manager.get_windows_clients_by_wxid(target) if target else self.manager.windows_clients
+        if not candidates:
+            return True
+        return any(ctx.outbound.qsize() < ctx.outbound.maxsize // 2 for ctx in candidates)
+
+    def _publish(self, command: Command):
+        """通知命令的当前状态"""
+        self.events.publish(
+            command.command_id, command.status, command.result,
+            command.target_we_chat_id, command.command_type
+        )
+
+    def _dispatch(self, command: Command, now: datetime, watchers: List[tuple]) -> bool:
+        """下发一条命令并更新命令状态
+
+        不提交，调用方持有锁并负责提交；提交后再调用 _watch 开始等待发送结果，
+        避免在dispatched状态提交前就处理发送结果
+        """
+        done = asyncio.get_running_loop().create_future()
+        ctx = self.manager.dispatch_command(self.build_message(command), done)
+        if ctx is None:
+            # 目标Windows端不在线，等待上线后下发
+            command.status = STATUS_PENDING
+            command.next_attempt_at = None
+            command.result = self.manager.offline_error(command.target_we_chat_id) + "，等待上线后下发"
+            done.cancel()
+            return False
+
+        command.status = STATUS_DISPATCHED
+        command.attempts = (command.attempts or 0) + 1
+        command.dispatched_to = ctx.connection_id
+        command.dispatched_at = now
+        command.next_attempt_at = now + timedelta(seconds=self._ack_delay(command.attempts))
+        command.result = None
+        self.stats["dispatched"] += 1
+        if command.attempts > 1:
+            self.stats["redelivered"] += 1
+        watchers.append((command, ctx, done))
+        return True
+
+    def _watch(self, watchers: List[tuple]):
+        """通知已下发的命令，并在后台等待发送结果"""
+        for command, ctx, done in watchers:
+            self._publish(command)
+            asyncio.create_task(self._watch_delivery(
+                command.command_id, command.target_we_chat_id, command.command_type, ctx, done, command.attempts
+            ))
+
+    async def _watch_delivery(self, command_id: str, target: str, command_type: str, ctx, done: asyncio.Future, attempts: int):
+        """等待写任务发送结果：发送失败时退回pending，旧版本连接发送成功即视为已确认"""
+        delivered = await done
+        now = datetime.utcnow()
+        if delivered and ctx.command_ack:
+            # 等待Windows端发送command_ack
+            return
+
+        if delivered:
+            values = {"status": STATUS_ACKED, "acked_at": now, "next_attempt_at": None}
+        else:
+            values = {"status": STATUS_PENDING, "next_attempt_at": now + timedelta(seconds=self._retry_delay(attempts))}
+        try:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    update(Command)
+                    .where(
+                        Command.command_id == command_id,
+                        Command.status == STATUS_DISPATCHED,
+                        Command.dispatched_to == ctx.connection_id
+                    )
+                    .values(**values)
+                )
+                await session.commit()
+            if result.rowcount:
+                if delivered:
+                    self.stats["acked"] += 1
+                self.events.publish(command_id, values["status"], None, target, command_type)
+        except Exception as e:
+            print(f"更新命令下发状态失败: {command_id}, {e}")
+
+    async def ack(self, command_id: str):
+        """Windows端确认收到命令"""
+        if not command_id:
+            return
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(Command)
+                .where(Command.command_id == command_id, Command.status.in_(UNACKED_STATUSES))
+                .values(status=STATUS_ACKED, acked_at=datetime.utcnow(), next_attempt_at=None)
+                .returning(Command.target_we_chat_id, Command.command_type)
+            )
+            row = result.first()
+            await session.commit()
+        if row is not None:
+            self.stats["acked"] += 1
+            self.events.publish(command_id, STATUS_ACKED, None, row.target_we_chat_id, row.command_type)
+            print(f"Windows端已确认收到命令: {command_id}")
+
+    async def complete(self, command_id: str, status: str, result: Optional[str] = None):
+        """记录通过WebSocket返回的命令执行结果（HTTP结果接口直接更新命令）"""
+        if not command_id:
+            return
+        values = {"status": status or STATUS_COMPLETED, "next_attempt_at": None}
+        if result is not None:
+            values["result"] = result if isinstance(result, str) else json.dumps(result, ensure_ascii=False)
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(Command)
+                .where(Command.command_id == command_id, Command.status.in_(OPEN_STATUSES))
+                .values(**values)
+                .returning(Command.target_we_chat_id, Command.command_type)
+            )
+            row = result.first()
+            await session.commit()
+        if row is not None:
+            self.events.publish(command_id, values["status"], values.get("result"), row.target_we_chat_id, row.command_type)
+
+    def schedule_drain(self, wxid: str):
+        """在后台下发微信账号积压的命令（Windows端上线，或其他worker进程通知）
+
+        同一微信账号的下发任务合并执行：已有任务时只标记任务结束后再执行一次，
+        频繁触发时不会排队多次完整的积压查询
+        """
+        task = self._drain_tasks.get(wxid)
+        if task is not None and not task.done():
+            self._drain_rerun.add(wxid)
+            self.stats["drain_coalesced"] += 1
+            return
+        self._drain_tasks[wxid] = asyncio.create_task(self._drain_loop(wxid))
+
+    async def _drain_loop(self, wxid: str):
+        """执行下发任务，期间再次收到下发请求时重新执行（可能有新提交的命令）"""
+        try:
+            while True:
+                self._drain_rerun.discard(wxid)
+                await self.drain(wxid)
+                if wxid not in self._drain_rerun:
+                    break
+        finally:
+            self._drain_tasks.pop(wxid, None)
+
+    async def drain(self, wxid: str) -> int:
+        """按创建顺序下发微信账号积压的命令（包括未指定目标的命令）
+
+        Returns:
+            int: 下发的命令数
+        """
+        live_connections = {ctx.connection_id for ctx in self.manager.windows_clients}
+        watchers: List[tuple] = []
+        count = 0
+        try:
+            async with self._lock:
+                async with AsyncSessionLocal() as session:
+                    result = await session.execute(
+                        select(Command)
+                        .where(
+                            Command.status.in_(UNACKED_STATUSES),
+                            or_(Command.target_we_chat_id == wxid, Command.target_we_chat_id == "")
+                        )
+                        .order_by(Command.id)
+                    )
+                    now = datetime.utcnow()
+                    for command in result.scalars():
+                        # 已下发到仍在线的连接、等待确认的命令不重复下发
+                        if command.status == STATUS_DISPATCHED and command.dispatched_to in live_connections:
+                            continue
+                        if not self._dispatch(command, now, watchers):
+                            break
+                        count += 1
+                    await session.commit()
+        except Exception as e:
+            print(f"下发积压命令失败: wxid={wxid}, {e}")
+        self._watch(watchers)
+        if count:
+            self.stats["drained"] += count
+            print(f"Windows端上线，已下发积压命令: wxid={wxid}, 数量={count}")
+        return count
+
+    async def _sweeper_loop(self):
+        """后台清扫：标记超期命令为失败，重新下发到期的命令"""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"命令清扫失败: {e}")
+
+    async def sweep(self):
+        """执行一次清扫"""
+        now = datetime.utcnow()
+        watchers: List[tuple] = []
+        async with self._lock:
+            async with AsyncSessionLocal() as session:
+                # 超过下发期限仍未确认的命令标记为失败
+                expired = (await session.execute(
+                    update(Command)
+                    .where(Command.status.in_(UNACKED_STATUSES), Command.deadline_at < now)
+                    .values(status=STATUS_FAILED, result=_EXPIRED_RESULT, next_attempt_at=None)
+                    .returning(Command.command_id, Command.target_we_chat_id, Command.command_type)
+                )).all()
+                if expired:
+                    self.stats["expired"] += len(expired)
+                    print(f"已将 {len(expired)} 条超期命令标记为失败")
+
+                # 只处理目标Windows端在线的命令，离线积压等待上线后下发
+                online_wxids: Set[str] = {ctx.wxid for ctx in self.manager.windows_clients if ctx.wxid}
+                if not self.manager.windows_clients:
+                    await session.commit()
+                    self._publish_expired(expired)
+                    return
+                result = await session.execute(
+                    select(Command)
+                    .where(
+                        Command.status.in_(UNACKED_STATUSES),
+                        or_(Command.next_attempt_at.is_(None), Command.next_attempt_at <= now),
+                        or_(Command.target_we_chat_id.in_(online_wxids), Command.target_we_chat_id == "")
+                    )
+                    .order_by(Command.id)
+                    .limit(_SWEEP_BATCH_SIZE)
+                )
+                for command in result.scalars():
+                    self._dispatch(command, now, watchers)
+                await session.commit()
+        self._publish_expired(expired)
+        self._watch(watchers)
+
+    def _publish_expired(self, expired: List):
+        """通知超期失败的命令"""
+        for command_id, target, command_type in expired:
+            self.events.publish(command_id, STATUS_FAILED, _EXPIRED_RESULT, target, command_type)
+
+    async def get_stats(self) -> Dict:
+        """获取命令队列统计（各状态数量、最早未完成命令的等待时间、按目标微信账号的积压）"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as session:
+            rows = await session.execute(
+                select(Command.status, Command.target_we_chat_id, func.count(), func.min(Command.created_at))
+                .where(Command.status.in_(OPEN_STATUSES))
+                .group_by(Command.status, Command.target_we_chat_id)
+            )
+            depth = {status: 0 for status in OPEN_STATUSES}
+            oldest = {}
+            by_target: Dict[str, Dict] = {}
+            for status, target, count, created_at in rows:
+                depth[status] += count
+                target_stats = by_target.setdefault(target or "", {"depth": 0, "oldest_age": 0.0})
+                target_stats["depth"] += count
+                if created_at is not None:
+                    age = (now - created_at).total_seconds()
+                    oldest[status] = max(oldest.get(status, 0.0), age)
+                    target_stats["oldest_age"] = round(max(target_stats["oldest_age"], age), 1)
+
+        top_targets: List = sorted(by_target.items(), key=lambda item: item[1]["depth"], reverse=True)[:20]
+        return {
+            "depth": depth,
+            "oldest_age": {status: round(age, 1) for status, age in oldest.items()},
+            "by_target": dict(top_targets),
+            "events": self.events.get_stats(),
+            **self.stats,
+        }
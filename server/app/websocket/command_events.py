@@ -0,0 +1,153 @@
+"""
+命令状态通知
+命令状态变化（下发、确认、返回结果、超期失败）时在进程内通知等待中的HTTP请求：
+- 长轮询等待某条命令的结果（GET /api/commands/{command_id}/wait）
+- SSE订阅命令状态变化（GET /api/commands/events，按命令ID或目标微信账号过滤）
+等待中的请求不查询数据库，直到收到通知或超时
+"""
+import asyncio
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set
+
+
+# 尚未返回结果的状态（其他状态均视为已结束）
+OPEN_STATUSES = ("pending", "dispatched", "acked")
+
+# 单个订阅者最多缓存的事件数，超过后丢弃最早的事件
+_SUBSCRIBER_QUEUE_SIZE = 256
+
+
+def is_finished(status: Optional[str]) -> bool:
+    """命令是否已结束（已返回结果或失败）"""
+    return bool(status) and status not in OPEN_STATUSES
+
+
+class CommandSubscription:
+    """一个SSE订阅（按命令ID或目标微信账号过滤，两者都为空时接收全部事件）"""
+
+    __slots__ = ("command_ids", "wxid", "queue", "dropped")
+
+    def __init__(self, command_ids: Optional[Iterable[str]] = None, wxid: Optional[str] = None):
+        self.command_ids: Set[str] = set(command_ids or ())
+        self.wxid = wxid or None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=_SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = 0
+
+    def matches(self, event: Dict) -> bool:
+        if self.command_ids and event["command_id"] not in self.command_ids:
+            return False
+        if self.wxid and event.get("target_we_chat_id") != self.wxid:
+            return False
+        return True
+
+    def put(self, event: Dict) -> bool:
+        """放入事件，队列已满时丢弃最早的事件，返回是否丢弃了事件"""
+        dropped = False
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            dropped = True
+        self.queue.put_nowait(event)
+        return dropped
+
+
+class CommandEventHub:
+    """命令状态通知中心"""
+
+    def __init__(self):
+        # 命令ID -> 等待结果的Future集合
+        self._waiters: Dict[str, Set[asyncio.Future]] = {}
+        self._subscriptions: Set[CommandSubscription] = set()
+        self.stats: Dict[str, int] = {
+            "published": 0,
+            "waits": 0,
+            "wait_resolved": 0,
+            "wait_timeouts": 0,
+            "dropped": 0,
+        }
+
+    def publish(
+        self,
+        command_id: str,
+        status: str,
+        result: Optional[str] = None,
+        target_we_chat_id: Optional[str] = None,
+        command_type: Optional[str] = None
+    ):
+        """发布命令状态变化（状态已提交到数据库后调用）"""
+        if not command_id:
+            return
+        event = {
+            "type": "command_status",
+            "command_id": command_id,
+            "command_type": command_type,
+            "status": status,
+            "result": result,
+            "target_we_chat_id": target_we_chat_id or "",
+            "timestamp": datetime.utcnow().isoformat(),
+        }
+        self.stats["published"] += 1
+
+        if is_finished(status):
+            waiters = self._waiters.pop(command_id, None)
+            if waiters:
+                for future in waiters:
+                    if not future.done():
+                        future.set_result(event)
+
+        for subscription in self._subscriptions:
+            if subscription.matches(event) and subscription.put(event):
+                self.stats["dropped"] += 1
+
+    def register_waiter(self, command_id: str) -> asyncio.Future:
+        """注册等待命令结果（在查询数据库之前注册，避免错过查询后到达的结果）"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(command_id, set()).add(future)
+        self.stats["waits"] += 1
+        return future
+
+    def remove_waiter(self, command_id: str, future: asyncio.Future):
+        """移除等待（超时、客户端断开或已从数据库得到结果）"""
+        waiters = self._waiters.get(command_id)
+        if waiters is None:
+            return
+        waiters.discard(future)
+        if not waiters:
+            del self._waiters[command_id]
+
+    async def wait(self, command_id: str, future: asyncio.Future, timeout: float) -> Optional[Dict]:
+        """等待命令结果
+
+        Returns:
+            Optional[Dict]: 命令结束事件；超时返回None
+        """
+        try:
+            event = await asyncio.wait_for(asyncio.shield(future), timeout)
+            self.stats["wait_resolved"] += 1
+            return event
+        except asyncio.TimeoutError:
+            self.stats["wait_timeouts"] += 1
+            return None
+        finally:
+            self.remove_waiter(command_id, future)
+
+    def subscribe(self, command_ids: Optional[Iterable[str]] = None, wxid: Optional[str] = None) -> CommandSubscription:
+        """订阅命令状态变化"""
+        subscription = CommandSubscription(command_ids, wxid)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: CommandSubscription):
+        self._subscriptions.discard(subscription)
+
+    def get_stats(self) -> Dict:
+        """获取通知统计"""
+        return {
+            "waiters": sum(len(waiters) for waiters in self._waiters.values()),
+            "subscriptions": len(self._subscriptions),
+            **self.stats,
+        }
+
+
+# 全局命令状态通知中心
+command_events = CommandEventHub()
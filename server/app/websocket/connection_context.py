@@ -0,0 +1,86 @@
+"""
+WebSocket连接上下文
+每个连接一条紧凑记录，保存客户端类型、手机号、微信账号ID和会话加密上下文
+"""
+import asyncio
+from fastapi import WebSocket
+from typing import Optional, Set
+from app.utils.encryption_service import encryption_service
+from app.utils.session_crypto import SessionCrypto
+from app.websocket.outbound_queue import OutboundQueue
+
+
+# 客户端类型
+CLIENT_TYPE_PENDING = "pending"
+CLIENT_TYPE_WINDOWS = "windows"
+CLIENT_TYPE_APP = "app"
+
+
+class ConnectionContext:
+    """单个WebSocket连接的上下文"""
+
+    __slots__ = (
+        "websocket",
+        "connection_id",
+        "client_type",
+        "phone",
+        "wechat_phone",
+        "wxid",
+        "contacts_version",
+        "crypto",
+        "binary_frames",
+        "compression",
+        "command_ack",
+        "inflight_commands",
+        "outbound",
+        "writer_task",
+    )
+
+    def __init__(self, websocket: WebSocket, connection_id: str, outbound: OutboundQueue):
+        self.websocket = websocket
+        # 稳定的连接ID（连接建立时生成，不随对象回收而复用）
+        self.connection_id = connection_id
+        # 客户端类型：pending/windows/app
+        self.client_type: str = CLIENT_TYPE_PENDING
+        # 登录手机号（login/quick_login）
+        self.phone: Optional[str] = None
+        # Windows端同步的微信账号手机号（sync_my_info）
+        self.wechat_phone: Optional[str] = None
+        # 当前微信账号ID
+        self.wxid: Optional[str] = None
+        # App端已知的联系人版本号（未上报时为None，按原方式转发完整列表）
+        self.contacts_version: Optional[int] = None
+        # 会话加密上下文（密钥交换后创建，包含预先构建的AES-GCM实例和nonce生成器）
+        self.crypto: Optional[SessionCrypto] = None
+        # 是否使用二进制帧收发加密消息（nonce||ciphertext||tag，不做base64和JSON包装）
+        self.binary_frames = False
+        # 是否在加密前压缩发送给该连接的消息（客户端协商后启用）
+        self.compression = False
+        # Windows端是否会在收到命令后发送command_ack（客户端协商后启用）
+        self.command_ack = False
+        # 已下发给该Windows端、尚未返回结果的命令ID（用于选择负载最低的Windows端）
+        self.inflight_commands: Set[str] = set()
+        # 有界发送队列及其写任务
+        self.outbound = outbound
+        self.writer_task: Optional[asyncio.Task] = None
+
+    def set_session_key(self, session_key: bytes):
+        """设置会话密钥并创建会话加密上下文（重新交换密钥时替换）"""
+        self.crypto = encryption_service.create_session(self.connection_id, session_key)
+
+    def release_session(self):
+        """连接断开时从加密服务中移除会话（上下文对象保留，断开后仍在途的加密不会退回明文）"""
+        if self.crypto is not None:
+            encryption_service.remove_session(self.connection_id)
+
+    def has_session_key(self) -> bool:
+        """检查是否已完成密钥交换"""
+        return self.crypto is not None
+
+    @property
+    def load(self) -> int:
+        """当前负载（发送队列深度 + 未返回结果的命令数）"""
+        return self.outbound.qsize() + len(self.inflight_commands)
+
+    def __repr__(self) -> str:
+        return f"<ConnectionContext {self.connection_id[:8]} type={self.client_type} wxid={self.wxid} phone={self.phone}>"
@@ -0,0 +1,76 @@
+"""
+消息信封格式（可选）
+批量同步消息可以把路由信息放在一个很小的头部中，服务器只解析头部即可路由，
+消息体作为不透明字节原样转发给App端，无需对整个消息做JSON解析
+
+格式（加密前的明文）：
+    MWENV1 <头部JSON>\n<消息体>
+
+头部字段：
+    type        消息类型（sync_contacts/sync_moments/sync_tags/sync_chat_message/sync_official_account）
+    we_chat_id  微信账号ID（路由依据）
+    seq         发送方的消息序号（可选）
+    size        消息体字节数
+    count       消息体中的数据条数（可选，仅用于日志）
+
+消息体是完整的原格式消息JSON（例如 {"type": "sync_contacts", "data": [...]}），
+App端收到的内容与不使用信封时完全相同。不以信封前缀开头的消息按原格式处理。
+"""
+import json
+from typing import Dict, Optional, Tuple
+
+
+ENVELOPE_MAGIC = b"MWENV1 "
+ENVELOPE_FEATURE = "envelope_v1"
+
+# 支持只解析头部即可路由的消息类型
+ROUTABLE_TYPES = frozenset({
+    "sync_contacts",
+    "sync_moments",
+    "sync_tags",
+    "sync_chat_message",
+    "sync_official_account",
+})
+
+# 头部最大长度，防止把整个消息当成头部解析
+MAX_HEADER_SIZE = 4096
+
+
+def is_envelope(data: bytes) -> bool:
+    """检查明文是否为信封格式"""
+    return data[:len(ENVELOPE_MAGIC)] == ENVELOPE_MAGIC
+
+
+def parse_envelope(data: bytes) -> Tuple[Dict, memoryview]:
+    """解析信封，只解析头部，返回(头部, 消息体)
+
+    Raises:
+        ValueError: 信封格式错误
+    """
+    if not is_envelope(data):
+        raise ValueError("不是信封格式的消息")
+
+    header_end = data.find(b"\n", len(ENVELOPE_MAGIC), len(ENVELOPE_MAGIC) + MAX_HEADER_SIZE)
+    if header_end < 0:
+        raise ValueError("信封头部缺少结束符或超过长度限制")
+
+    header = json.loads(data[len(ENVELOPE_MAGIC):header_end])
+    if not isinstance(header, dict) or not header.get("type"):
+        raise ValueError("信封头部缺少type字段")
+
+    body = memoryview(data)[header_end + 1:]
+    size = header.get("size")
+    if size is not None and size != len(body):
+        raise ValueError(f"信封消息体长度不匹配: 头部={size}, 实际={len(body)}")
+
+    return header, body
+
+
+def build_envelope(message_type: str, we_chat_id: str, body: bytes, seq: Optional[int] = None, count: Optional[int] = None) -> bytes:
+    """构造信封（供客户端实现和基准测试参考）"""
+    header = {"type": message_type, "we_chat_id": we_chat_id, "size": len(body)}
+    if seq is not None:
+        header["seq"] = seq
+    if count is not None:
+        header["count"] = count
+    return ENVELOPE_MAGIC + json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n" + body
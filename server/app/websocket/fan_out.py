@@ -0,0 +1,47 @@
+"""
+多接收方转发结果
+记录一次并发转发的入队情况，供调用方记录日志或统计
+
+转发只等待消息放入各接收方的发送队列，不等待发送完成；
+每条消息的发送期限由写任务的send_timeout（MYWECHAT_WS_SEND_TIMEOUT）保证，超时的连接由写任务断开
+"""
+import time
+from typing import Dict, List
+
+
+class FanOutResult:
+    """一次并发转发的投递汇总"""
+
+    __slots__ = ("recipients", "enqueued", "dropped", "failed", "started_at", "elapsed")
+
+    def __init__(self, recipients: int):
+        # 接收方数量
+        self.recipients = recipients
+        # 已放入发送队列的接收方数量（不代表已发送）
+        self.enqueued = 0
+        # 入队时挤掉了旧批量消息的接收方数量
+        self.dropped = 0
+        # 入队失败的连接ID（队列溢出或连接已关闭）
+        self.failed: List[str] = []
+        self.started_at = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def failed_count(self) -> int:
+        return len(self.failed)
+
+    def finish(self):
+        """记录耗时"""
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def to_dict(self) -> Dict:
+        return {
+            "recipients": self.recipients,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "failed": len(self.failed),
+            "elapsed_ms": round(self.elapsed * 1000, 2),
+        }
+
+    def __repr__(self) -> str:
+        return f"<FanOutResult {self.to_dict()}>"
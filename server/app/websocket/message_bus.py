@@ -0,0 +1,460 @@
+"""
+跨worker进程的消息总线
+多worker运行时，Windows端和App端可能连接到不同的worker进程。每个worker按连接的路由键
+（微信账号ID、手机号等）向本机的总线代理订阅；转发时接收方不在本进程的，发布到总线，
+由持有接收方连接的worker进程投递。
+
+- 代理（MessageBroker）由 run.py 在主进程中启动，监听Unix域套接字（Windows下为本机回环TCP端口）
+- 代理把订阅变化广播给所有worker，worker据此同步判断接收方是否在其他进程上，不需要请求-响应
+- 未配置总线地址（单进程运行）时使用空实现，所有判断都在本进程内完成
+
+帧格式: 4字节元数据长度 + 4字节消息长度（大端）+ 元数据JSON + 消息明文
+"""
+import os
+import json
+import struct
+import asyncio
+import secrets
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from app.websocket.message_payload import MessagePayload
+
+
+# 默认配置（可通过环境变量覆盖）
+# 总线代理地址: unix:<路径> 或 tcp:<主机>:<端口>（为空时不启用总线）
+MESSAGE_BUS_ADDRESS = os.getenv("MYWECHAT_BUS_ADDRESS", "")
+# 总线认证令牌（由 run.py 生成并传给worker进程，代理拒绝令牌不匹配的连接）
+MESSAGE_BUS_TOKEN = os.getenv("MYWECHAT_BUS_TOKEN", "")
+# 断开后重连间隔（秒）
+MESSAGE_BUS_RECONNECT_DELAY = float(os.getenv("MYWECHAT_BUS_RECONNECT_DELAY", "1"))
+# 单个连接待写出的最大字节数，超过后丢弃新消息（避免慢worker拖垮代理）
+MESSAGE_BUS_WRITE_LIMIT = int(os.getenv("MYWECHAT_BUS_WRITE_LIMIT", str(64 * 1024 * 1024)))
+
+# 路由键类型
+ROUTE_APP = "app"                                  # 任意App端
+ROUTE_APP_WXID = "app_wxid"                        # 登录了指定微信账号的App端
+ROUTE_APP_PHONE = "app_phone"                      # 登录了指定手机号的App端
+ROUTE_WINDOWS = "windows"                          # 任意Windows端
+ROUTE_WINDOWS_WXID = "windows_wxid"                # 同步了指定微信账号的Windows端
+ROUTE_WINDOWS_PHONE = "windows_wechat_phone"       # 同步了指定微信手机号的Windows端
+ROUTE_WORKERS = "workers"                          # 所有worker进程（广播，如缓存失效通知）
+
+_HEADER = struct.Struct(">II")
+# 单帧最大长度（与WebSocket单条消息的量级相同）
+_MAX_FRAME = 256 * 1024 * 1024
+
+# 收到其他worker发布的消息时的回调: (事件, 消息载荷, 参数)
+BusHandler = Callable[[str, Optional[MessagePayload], Dict], Awaitable[None]]
+
+
+def route_key(kind: str, value: Optional[str] = None) -> str:
+    """构造路由键，如 app_wxid:wxid_xxx"""
+    return f"{kind}:{value}" if value else kind
+
+
+def parse_address(address: str):
+    """解析总线地址，返回 ("unix", 路径) 或 ("tcp", (主机, 端口))"""
+    scheme, _, rest = address.partition(":")
+    if scheme == "unix" and rest:
+        return "unix", rest
+    if scheme == "tcp" and rest:
+        host, _, port = rest.rpartition(":")
+        return "tcp", (host or "127.0.0.1", int(port))
+    raise ValueError(f"无效的消息总线地址: {address}")
+
+
+def default_address(port: int) -> str:
+    """多worker运行时的默认总线地址（POSIX使用Unix域套接字，Windows使用本机回环端口）"""
+    if os.name == "nt":
+        return f"tcp:127.0.0.1:{port + 1}"
+    return "unix:" + os.path.join(".", "data", "ws_bus.sock")
+
+
+def new_token() -> str:
+    """生成总线认证令牌"""
+    return secrets.token_hex(16)
+
+
+def encode_frame(meta: Dict, data: bytes = b"") -> bytes:
+    """编码一帧"""
+    meta_bytes = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return _HEADER.pack(len(meta_bytes), len(data)) + meta_bytes + data
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    """读取一帧，返回 (元数据, 消息明文, 原始帧)"""
+    header = await reader.readexactly(_HEADER.size)
+    meta_len, data_len = _HEADER.unpack(header)
+    if meta_len + data_len > _MAX_FRAME:
+        raise ValueError(f"消息总线帧过大: {meta_len + data_len}")
+    body = await reader.readexactly(meta_len + data_len)
+    return json.loads(body[:meta_len]), body[meta_len:], header + body
+
+
+class MessageBroker:
+    """总线代理：记录每个路由键由哪些worker持有，并把发布的消息转给持有者"""
+
+    def __init__(self, token: str = MESSAGE_BUS_TOKEN, write_limit: int = MESSAGE_BUS_WRITE_LIMIT):
+        self.token = token
+        self.write_limit = write_limit
+        # worker ID -> 连接写端
+        self._workers: Dict[str, asyncio.StreamWriter] = {}
+        # 路由键 -> 持有该键的worker ID
+        self._routes: Dict[str, Set[str]] = {}
+        self.stats: Dict[str, int] = {
+            "published": 0,
+            "forwarded": 0,
+            "unroutable": 0,
+            "dropped": 0,
+        }
+
+    async def serve(self, address: str):
+        """监听总线地址并一直运行"""
+        server = await self.start(address)
+        async with server:
+            await server.serve_forever()
+
+    async def start(self, address: str) -> asyncio.AbstractServer:
+        """开始监听总线地址"""
+        kind, target = parse_address(address)
+        if kind == "unix":
+            os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+            # 清理上次运行残留的套接字文件
+            if os.path.exists(target):
+                os.unlink(target)
+            server = await asyncio.start_unix_server(self._handle, path=target)
+            # 只允许当前用户连接
+            os.chmod(target, 0o600)
+        else:
+            server = await asyncio.start_server(self._handle, host=target[0], port=target[1])
+        print(f"消息总线代理已启动: {address}")
+        return server
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一个worker连接"""
+        worker_id = None
+        try:
+            meta, _, _ = await read_frame(reader)
+            if meta.get("op") != "hello" or not secrets.compare_digest(str(meta.get("token", "")), self.token):
+                print("消息总线拒绝连接: 认证失败")
+                return
+            worker_id = str(meta["worker"])
+            old = self._workers.pop(worker_id, None)
+            if old is not None:
+                self._remove_worker(worker_id)
+                old.close()
+            self._workers[worker_id] = writer
+            # 先发送当前完整路由表，再登记新worker持有的路由键
+            self._write(writer, encode_frame({
+                "op": "routes",
+                "routes": {key: sorted(workers) for key, workers in self._routes.items()}
+            }))
+            for key in meta.get("keys", ()):
+                self._subscribe(worker_id, key)
+            print(f"worker已连接消息总线: {worker_id}（worker数: {len(self._workers)}）")
+
+            while True:
+                meta, _, frame = await read_frame(reader)
+                op = meta.get("op")
+                if op == "pub":
+                    self._route(worker_id, meta, frame)
+                elif op == "sub":
+                    self._subscribe(worker_id, meta["key"])
+                elif op == "unsub":
+                    self._unsubscribe(worker_id, meta["key"])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            print(f"消息总线连接异常: {e}")
+        finally:
+            if worker_id is not None and self._workers.get(worker_id) is writer:
+                del self._workers[worker_id]
+                self._remove_worker(worker_id)
+                print(f"worker已断开消息总线: {worker_id}（worker数: {len(self._workers)}）")
+            writer.close()
+
+    def _route(self, origin: str, meta: Dict, frame: bytes):
+        """把发布的消息原样转给持有路由键的其他worker（one模式只转给其中一个）"""
+        self.stats["published"] += 1
+        targets = sorted(self._routes.get(meta.get("key"), set()) - {origin})
+        if not targets:
+            self.stats["unroutable"] += 1
+            return
+        if meta.get("one"):
+            targets = targets[:1]
+        for target in targets:
+            writer = self._workers.get(target)
+            if writer is not None and self._write(writer, frame):
+                self.stats["forwarded"] += 1
+
+    def _write(self, writer: asyncio.StreamWriter, frame: bytes) -> bool:
+        """写入一帧（不等待写出），待写出数据超过上限时丢弃"""
+        if writer.transport.get_write_buffer_size() > self.write_limit:
+            self.stats["dropped"] += 1
+            return False
+        writer.write(frame)
+        return True
+
+    def _subscribe(self, worker_id: str, key: str):
+        workers = self._routes.setdefault(key, set())
+        if worker_id not in workers:
+            workers.add(worker_id)
+            self._broadcast_route(key)
+
+    def _unsubscribe(self, worker_id: str, key: str):
+        workers = self._routes.get(key)
+        if workers and worker_id in workers:
+            workers.discard(worker_id)
+            if not workers:
+                del self._routes[key]
+            self._broadcast_route(key)
+
+    def _remove_worker(self, worker_id: str):
+        """worker断开后移除它持有的所有路由键"""
+        for key in [key for key, workers in self._routes.items() if worker_id in workers]:
+            self._unsubscribe(worker_id, key)
+
+    def _broadcast_route(self, key: str):
+        """通知所有worker路由键的持有者变化"""
+        frame = encode_frame({"op": "route", "key": key, "workers": sorted(self._routes.get(key, ()))})
+        for writer in self._workers.values():
+            self._write(writer, frame)
+
+    def get_stats(self) -> Dict:
+        return dict(self.stats, workers=len(self._workers), routes=len(self._routes))
+
+
+class MessageBus:
+    """消息总线（单进程运行时的空实现：没有其他worker，所有接收方都在本进程）"""
+
+    name = "local"
+
+    def __init__(self):
+        # 本进程持有的路由键 -> 持有该键的连接数
+        self._held: Dict[str, int] = {}
+
+    def start(self, handler: BusHandler):
+        """开始接收其他worker发布的消息"""
+
+    async def stop(self):
+        """停止总线连接"""
+
+    def hold(self, key: str):
+        """本进程有连接开始持有路由键"""
+        count = self._held.get(key, 0)
+        self._held[key] = count + 1
+        if count == 0:
+            self._on_hold(key)
+
+    def release(self, key: str):
+        """本进程有连接不再持有路由键"""
+        count = self._held.get(key, 0)
+        if count <= 1:
+            if self._held.pop(key, None) is not None:
+                self._on_release(key)
+        else:
+            self._held[key] = count - 1
+
+    def _on_hold(self, key: str):
+        pass
+
+    def _on_release(self, key: str):
+        pass
+
+    def has_remote(self, key: str) -> bool:
+        """是否有其他worker持有路由键"""
+        return False
+
+    def publish(
+        self,
+        key: str,
+        event: str,
+        payload: Optional[MessagePayload] = None,
+        one: bool = False,
+        **args
+    ) -> bool:
+        """把消息发布给持有路由键的其他worker
+
+        Args:
+            key: 路由键
+            event: 事件类型（接收方据此选择投递方式）
+            payload: 消息载荷（只转发明文，由接收方worker按各连接的会话密钥加密）
+            one: 只投递给其中一个worker
+            args: 附加参数（JSON可序列化）
+
+        Returns:
+            bool: 是否已发布（没有其他worker持有该路由键时为False）
+        """
+        return False
+
+    def get_stats(self) -> Dict:
+        return {"backend": self.name, "held_keys": len(self._held)}
+
+
+class BrokerMessageBus(MessageBus):
+    """通过总线代理连接其他worker进程的消息总线"""
+
+    name = "broker"
+
+    def __init__(self, address: str, token: str = MESSAGE_BUS_TOKEN, worker_id: Optional[str] = None):
+        super().__init__()
+        self.address = address
+        self.token = token
+        self.worker_id = worker_id or f"{os.getpid()}-{secrets.token_hex(4)}"
+        # 路由键 -> 持有该键的worker ID（由代理推送，包括本进程）
+        self._routes: Dict[str, Set[str]] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._handler: Optional[BusHandler] = None
+        # 连接成功并收到路由表后置位
+        self.ready = asyncio.Event()
+        self.stats: Dict[str, int] = {
+            "published": 0,
+            "received": 0,
+            "dropped": 0,
+            "handler_errors": 0,
+            "reconnects": 0,
+        }
+
+    def start(self, handler: BusHandler):
+        self._handler = handler
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _open(self):
+        kind, target = parse_address(self.address)
+        if kind == "unix":
+            return await asyncio.open_unix_connection(target)
+        return await asyncio.open_connection(target[0], target[1])
+
+    async def _run(self):
+        """连接代理并接收消息，断开后自动重连"""
+        while True:
+            writer = None
+            try:
+                reader, writer = await self._open()
+                writer.write(encode_frame({
+                    "op": "hello", "worker": self.worker_id, "token": self.token, "keys": list(self._held)
+                }))
+                self._writer = writer
+                print(f"已连接消息总线: {self.address}（worker: {self.worker_id}）")
+                while True:
+                    meta, data, _ = await read_frame(reader)
+                    await self._dispatch(meta, data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"消息总线连接断开: {e}，{MESSAGE_BUS_RECONNECT_DELAY}秒后重连")
+            finally:
+                self._writer = None
+                self._routes.clear()
+                self.ready.clear()
+                if writer is not None:
+                    writer.close()
+            self.stats["reconnects"] += 1
+            await asyncio.sleep(MESSAGE_BUS_RECONNECT_DELAY)
+
+    async def _dispatch(self, meta: Dict, data: bytes):
+        """处理代理推送的一帧"""
+        op = meta.get("op")
+        if op == "pub":
+            self.stats["received"] += 1
+            if self._handler is None:
+                return
+            if meta.get("header") is not None:
+                # 信封消息：转发方只解析了头部，消息体保持不透明
+                payload = MessagePayload(meta.get("message") or {}, data=data, header=meta["header"])
+            elif data:
+                payload = MessagePayload.decode(data)
+            else:
+                payload = None
+            try:
+                # 按发布顺序逐条投递，保证同一账号的消息顺序不变
+                await self._handler(meta.get("event", ""), payload, meta.get("args") or {})
+            except Exception as e:
+                self.stats["handler_errors"] += 1
+                print(f"处理消息总线消息失败: {meta.get('event')}, {e}")
+        elif op == "route":
+            workers = set(meta.get("workers", ()))
+            if workers:
+                self._routes[meta["key"]] = workers
+            else:
+                self._routes.pop(meta["key"], None)
+        elif op == "routes":
+            self._routes = {key: set(workers) for key, workers in meta.get("routes", {}).items()}
+            self.ready.set()
+
+    def _send(self, meta: Dict, data: bytes = b"") -> bool:
+        writer = self._writer
+        if writer is None or writer.is_closing():
+            return False
+        writer.write(encode_frame(meta, data))
+        return True
+
+    def _on_hold(self, key: str):
+        self._send({"op": "sub", "key": key})
+
+    def _on_release(self, key: str):
+        self._send({"op": "unsub", "key": key})
+
+    def has_remote(self, key: str) -> bool:
+        workers = self._routes.get(key)
+        return bool(workers) and (len(workers) > 1 or self.worker_id not in workers)
+
+    def publish(
+        self,
+        key: str,
+        event: str,
+        payload: Optional[MessagePayload] = None,
+        one: bool = False,
+        **args
+    ) -> bool:
+        if not self.has_remote(key):
+            return False
+        meta = {"op": "pub", "key": key, "event": event, "one": one, "args": args}
+        data = b""
+        if payload is not None:
+            if payload.is_envelope:
+                meta["header"] = payload.header
+                meta["message"] = payload.message
+            data = bytes(payload.data)
+        if not self._send(meta, data):
+            self.stats["dropped"] += 1
+            return False
+        self.stats["published"] += 1
+        return True
+
+    def get_stats(self) -> Dict:
+        return dict(
+            self.stats,
+            backend=self.name,
+            worker=self.worker_id,
+            connected=self._writer is not None,
+            held_keys=len(self._held),
+            remote_keys=sum(1 for key in self._routes if self.has_remote(key)),
+        )
+
+
+def create_message_bus(address: str = MESSAGE_BUS_ADDRESS) -> MessageBus:
+    """按配置创建消息总线（未配置地址时为单进程空实现）"""
+    if address:
+        return BrokerMessageBus(address)
+    return MessageBus()
+
+
+# 全局消息总线实例
+message_bus = create_message_bus()
+
+
+if __name__ == "__main__":
+    # 单独运行总线代理: MYWECHAT_BUS_ADDRESS=unix:./data/ws_bus.sock python -m app.websocket.message_bus
+    asyncio.run(MessageBroker().serve(MESSAGE_BUS_ADDRESS or default_address(8000)))
@@ -0,0 +1,101 @@
+"""
+待转发的消息载荷
+保留客户端发来的解密后明文，转发时最多序列化一次，每个接收方只需单独做AES-GCM加密
+"""
+import json
+from typing import Dict, Optional, Union
+
+from app.websocket.envelope import is_envelope, parse_envelope, ROUTABLE_TYPES
+from app.utils.encryption_service import encryption_service
+
+
+class MessagePayload:
+    """待转发的消息（明文JSON文本和UTF-8字节按需生成并缓存）"""
+
+    __slots__ = ("message", "header", "_text", "_data", "_compressed")
+
+    def __init__(
+        self,
+        message: Dict,
+        text: Optional[str] = None,
+        data: Optional[Union[bytes, memoryview]] = None,
+        header: Optional[Dict] = None
+    ):
+        # 解析后的消息字典（用于路由；信封消息只包含头部中的路由字段）
+        self.message = message
+        # 信封头部（不是信封消息时为None）
+        self.header = header
+        # 客户端发来的明文JSON（如果有，直接复用，不再重新序列化）
+        self._text = text
+        # 客户端发来的明文字节（信封消息为未解析的消息体）
+        self._data = data
+        # 压缩后的明文（只压缩一次，所有协商了压缩的接收方共用）
+        self._compressed: Optional[Union[bytes, memoryview]] = None
+
+    @classmethod
+    def of(cls, message) -> "MessagePayload":
+        """将字典、JSON文本或已有载荷统一转换为MessagePayload"""
+        if isinstance(message, MessagePayload):
+            return message
+        if isinstance(message, str):
+            return cls({}, message)
+        return cls(message)
+
+    @classmethod
+    def decode(cls, plain: bytes) -> "MessagePayload":
+        """解码客户端发来的明文
+
+        信封格式且类型支持只按头部路由时，只解析头部，消息体保持为不透明字节；
+        否则按原格式完整解析JSON
+        """
+        if is_envelope(plain):
+            header, body = parse_envelope(plain)
+            if header["type"] in ROUTABLE_TYPES:
+                message = {"type": header["type"], "we_chat_id": header.get("we_chat_id")}
+                return cls(message, data=body, header=header)
+            # 不支持按头部路由的类型，回退为完整解析消息体
+            plain = bytes(body)
+
+        text = plain.decode("utf-8")
+        return cls(json.loads(text), text=text, data=plain)
+
+    @property
+    def is_envelope(self) -> bool:
+        return self.header is not None
+
+    @property
+    def text(self) -> str:
+        """明文JSON文本（只序列化一次）"""
+        if self._text is None:
+            if self._data is not None:
+                self._text = bytes(self._data).decode("utf-8")
+            else:
+                self._text = json.dumps(self.message, ensure_ascii=False)
+        return self._text
+
+    @property
+    def data(self) -> Union[bytes, memoryview]:
+        """明文UTF-8字节（只编码一次）"""
+        if self._data is None:
+            self._data = self.text.encode("utf-8")
+        return self._data
+
+    @property
+    def compressed_data(self) -> Union[bytes, memoryview]:
+        """加密前压缩后的明文（小于阈值时为原明文，只压缩一次）"""
+        if self._compressed is None:
+            self._compressed = encryption_service.compress_for_communication(self.data, self.message.get("type", "unknown"))
+        return self._compressed
+
+    @property
+    def count(self) -> int:
+        """数据条数（仅用于日志，信封消息取头部中的count）"""
+        if self.header is not None:
+            return self.header.get("count", 0)
+        data = self.message.get("data", [])
+        return len(data) if isinstance(data, (list, dict)) else 0
+
+    @property
+    def size(self) -> int:
+        """明文字节数"""
+        return len(self.data)
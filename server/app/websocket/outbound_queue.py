@@ -0,0 +1,115 @@
+"""
+WebSocket发送队列
+每个连接一个有界发送队列，由独立的写任务消费，避免慢连接阻塞其他连接的消息处理
+"""
+import os
+import asyncio
+from collections import deque
+from typing import Deque, Optional, Tuple, Union
+
+
+# 队列满时的处理策略
+# drop_oldest: 丢弃最早的一条批量同步消息（联系人/朋友圈/标签/公众号），没有可丢弃的批量消息时断开连接
+# disconnect: 直接断开慢连接
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DISCONNECT = "disconnect"
+
+# 入队结果
+ENQUEUED = "enqueued"
+DROPPED_OLDEST = "dropped_oldest"
+OVERFLOW = "overflow"
+CLOSED = "closed"
+
+# 默认配置（可通过环境变量覆盖）
+OUTBOUND_QUEUE_SIZE = int(os.getenv("MYWECHAT_WS_QUEUE_SIZE", "1000"))
+OUTBOUND_QUEUE_POLICY = os.getenv("MYWECHAT_WS_QUEUE_POLICY", POLICY_DROP_OLDEST)
+# 单条消息发送超时（秒），超时视为慢连接
+OUTBOUND_SEND_TIMEOUT = float(os.getenv("MYWECHAT_WS_SEND_TIMEOUT", "10"))
+
+Payload = Union[str, bytes]
+# (消息内容, 是否为可丢弃的批量同步消息, 发送完成通知)
+QueueItem = Tuple[Payload, bool, Optional[asyncio.Future]]
+
+
+class OutboundQueue:
+    """单个连接的有界发送队列"""
+
+    __slots__ = ("maxsize", "policy", "_items", "_not_empty", "_closed", "sent_count", "dropped_count")
+
+    def __init__(self, maxsize: int = OUTBOUND_QUEUE_SIZE, policy: str = OUTBOUND_QUEUE_POLICY):
+        if policy not in (POLICY_DROP_OLDEST, POLICY_DISCONNECT):
+            raise ValueError(f"未知的发送队列策略: {policy}")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self._items: Deque[QueueItem] = deque()
+        self._not_empty = asyncio.Event()
+        self._closed = False
+        self.sent_count = 0
+        self.dropped_count = 0
+
+    def qsize(self) -> int:
+        """当前队列深度"""
+        return len(self._items)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def put_nowait(self, payload: Payload, bulk: bool = False, done: Optional[asyncio.Future] = None) -> str:
+        """入队（不阻塞）
+
+        Args:
+            payload: 消息内容
+            bulk: 是否为可丢弃的批量同步消息
+            done: 可选的发送完成通知（写任务发送后设置为True，丢弃或失败时设置为False）
+
+        Returns:
+            入队结果：ENQUEUED / DROPPED_OLDEST / OVERFLOW / CLOSED
+        """
+        if self._closed:
+            return CLOSED
+
+        result = ENQUEUED
+        if len(self._items) >= self.maxsize:
+            if self.policy != POLICY_DROP_OLDEST or not self._drop_oldest_bulk():
+                return OVERFLOW
+            result = DROPPED_OLDEST
+
+        self._items.append((payload, bulk, done))
+        self._not_empty.set()
+        return result
+
+    def _drop_oldest_bulk(self) -> bool:
+        """丢弃最早的一条批量同步消息"""
+        for index, (_, bulk, done) in enumerate(self._items):
+            if bulk:
+                del self._items[index]
+                self.dropped_count += 1
+                resolve(done, False)
+                return True
+        return False
+
+    async def get(self) -> Optional[Tuple[Payload, Optional[asyncio.Future]]]:
+        """出队，返回(消息内容, 发送完成通知)，队列关闭后返回None"""
+        while not self._items:
+            if self._closed:
+                return None
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        payload, _, done = self._items.popleft()
+        self.sent_count += 1
+        return payload, done
+
+    def close(self):
+        """关闭队列，丢弃未发送的消息并唤醒写任务"""
+        self._closed = True
+        for _, _, done in self._items:
+            resolve(done, False)
+        self._items.clear()
+        self._not_empty.set()
+
+
+def resolve(done: Optional[asyncio.Future], delivered: bool):
+    """设置发送完成通知的结果（True表示已发送，False表示丢弃或失败）"""
+    if done is not None and not done.done():
+        done.set_result(delivered)
@@ -0,0 +1,180 @@
+"""
+离线补发缓冲区
+App端不在线时，按微信账号缓存本应转发给它的同步消息（按条数、字节数和时间淘汰），
+App端重新设置微信账号ID或快速登录后按原顺序补发，已补发的消息不会重复发送
+"""
+import os
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List
+from app.websocket.message_payload import MessagePayload
+
+
+# 默认配置（可通过环境变量覆盖）
+REPLAY_MAX_MESSAGES = int(os.getenv("MYWECHAT_REPLAY_MAX_MESSAGES", "500"))
+REPLAY_MAX_BYTES = int(os.getenv("MYWECHAT_REPLAY_MAX_BYTES", str(8 * 1024 * 1024)))
+# 消息保留时间（秒）
+REPLAY_TTL = float(os.getenv("MYWECHAT_REPLAY_TTL", "600"))
+
+# 全量清理过期缓冲区的最小间隔（秒）
+_SWEEP_INTERVAL = 60
+
+
+class ReplayEntry:
+    """缓冲区中的一条消息"""
+
+    __slots__ = ("seq", "key", "payload", "bulk", "size", "created_at")
+
+    def __init__(self, seq: int, key: str, payload: MessagePayload, bulk: bool):
+        self.seq = seq
+        # 去重键（聊天消息为msg_id，其他消息为明文哈希）
+        self.key = key
+        self.payload = payload
+        self.bulk = bulk
+        self.size = payload.size
+        self.created_at = time.monotonic()
+
+    @property
+    def message_type(self) -> str:
+        return self.payload.message.get("type", "")
+
+
+class _WxidBuffer:
+    """单个微信账号的缓冲区（按去重键保存，保持入队顺序）"""
+
+    __slots__ = ("entries", "bytes")
+
+    def __init__(self):
+        self.entries: "OrderedDict[str, ReplayEntry]" = OrderedDict()
+        self.bytes = 0
+
+
+def replay_key(payload: MessagePayload) -> str:
+    """计算消息的去重键"""
+    message = payload.message
+    if message.get("type") == "sync_chat_message" and not payload.is_envelope:
+        data = message.get("data")
+        if isinstance(data, dict):
+            msg_id = data.get("MsgId") or data.get("msg_id")
+            if msg_id:
+                return f"msg:{msg_id}"
+    return "sha1:" + hashlib.sha1(payload.data).hexdigest()
+
+
+class ReplayBuffer:
+    """按微信账号缓存App端离线期间的消息"""
+
+    def __init__(
+        self,
+        max_messages: int = REPLAY_MAX_MESSAGES,
+        max_bytes: int = REPLAY_MAX_BYTES,
+        ttl: float = REPLAY_TTL
+    ):
+        self.max_messages = max(1, max_messages)
+        self.max_bytes = max(1, max_bytes)
+        self.ttl = ttl
+        self._buffers: Dict[str, _WxidBuffer] = {}
+        self._seq = 0
+        self._last_sweep = time.monotonic()
+        self.stats: Dict[str, int] = {
+            "buffered": 0,
+            "duplicates": 0,
+            "evicted_count": 0,
+            "evicted_bytes": 0,
+            "expired": 0,
+            "replayed": 0,
+        }
+
+    def add(self, wxid: str, payload: MessagePayload, bulk: bool = False) -> bool:
+        """缓存一条消息，返回是否新加入（重复的消息忽略）"""
+        now = time.monotonic()
+        if now - self._last_sweep >= _SWEEP_INTERVAL:
+            self._sweep(now)
+
+        buffer = self._buffers.get(wxid)
+        if buffer is None:
+            buffer = self._buffers[wxid] = _WxidBuffer()
+        else:
+            self._expire(buffer, now)
+
+        key = replay_key(payload)
+        if key in buffer.entries:
+            self.stats["duplicates"] += 1
+            return False
+
+        self._seq += 1
+        entry = ReplayEntry(self._seq, key, payload, bulk)
+        if entry.size > self.max_bytes:
+            # 单条消息超过字节上限，不缓存
+            self.stats["evicted_count"] += 1
+            self.stats["evicted_bytes"] += entry.size
+            return False
+
+        buffer.entries[key] = entry
+        buffer.bytes += entry.size
+        self.stats["buffered"] += 1
+
+        # 超过条数或字节数上限时淘汰最早的消息
+        while len(buffer.entries) > self.max_messages or buffer.bytes > self.max_bytes:
+            _, evicted = buffer.entries.popitem(last=False)
+            buffer.bytes -= evicted.size
+            self.stats["evicted_count"] += 1
+            self.stats["evicted_bytes"] += evicted.size
+        return True
+
+    def pending(self, wxid: str) -> List[ReplayEntry]:
+        """获取微信账号待补发的消息（按入队顺序，不移除）"""
+        buffer = self._buffers.get(wxid)
+        if buffer is None:
+            return []
+        self._expire(buffer, time.monotonic())
+        if not buffer.entries:
+            del self._buffers[wxid]
+            return []
+        return list(buffer.entries.values())
+
+    def acknowledge(self, wxid: str, entries: List[ReplayEntry]):
+        """移除已成功补发的消息"""
+        buffer = self._buffers.get(wxid)
+        if buffer is None:
+            return
+        for entry in entries:
+            current = buffer.entries.get(entry.key)
+            if current is not None and current.seq == entry.seq:
+                del buffer.entries[entry.key]
+                buffer.bytes -= entry.size
+                self.stats["replayed"] += 1
+        if not buffer.entries:
+            del self._buffers[wxid]
+
+    def _expire(self, buffer: _WxidBuffer, now: float):
+        """淘汰超过保留时间的消息（按入队顺序，最早的在前）"""
+        while buffer.entries:
+            key, entry = next(iter(buffer.entries.items()))
+            if now - entry.created_at < self.ttl:
+                break
+            del buffer.entries[key]
+            buffer.bytes -= entry.size
+            self.stats["expired"] += 1
+
+    def _sweep(self, now: float):
+        """清理所有微信账号的过期消息，释放长时间没有新消息的缓冲区"""
+        self._last_sweep = now
+        for wxid in list(self._buffers):
+            buffer = self._buffers[wxid]
+            self._expire(buffer, now)
+            if not buffer.entries:
+                del self._buffers[wxid]
+
+    def get_stats(self) -> Dict:
+        """获取缓冲区统计"""
+        return {
+            "wxids": len(self._buffers),
+            "messages": sum(len(buffer.entries) for buffer in self._buffers.values()),
+            "bytes": sum(buffer.bytes for buffer in self._buffers.values()),
+            "max_messages": self.max_messages,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            **self.stats,
+        }
@@ -3,43 +3,151 @@ WebSocket连接管理器
 管理Windows端和App端的WebSocket连接
 """
 from fastapi import WebSocket
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Optional, Iterable, Union
 import json
+import uuid
 import asyncio
 import base64
 from sqlalchemy import select
-from app.models.database import AsyncSessionLocal, AccountInfo
-from app.services.license_service import LicenseService
-from app.utils.encryption_service import encryption_service
+from app.models.database import AsyncSessionLocal, AccountInfo, Command
+from app.services.license_service import LicenseService, license_cache, BUS_EVENT_LICENSE
+from app.services.contact_service import contact_service, ContactDelta
+from app.services.chat_message_service import ChatMessageService
+from app.services.log_store import log_store
+from app.services.account_buffer import account_buffer
+from app.utils.encryption_service import encryption_service, COMPRESSION_CODEC
 from app.utils.rsa_key_manager import rsa_key_manager
+from app.utils.cpu_executor import CpuExecutorBusy
+from app.websocket.connection_context import (
+    ConnectionContext,
+    CLIENT_TYPE_PENDING,
+    CLIENT_TYPE_WINDOWS,
+    CLIENT_TYPE_APP,
+)
+from app.websocket.outbound_queue import (
+    OutboundQueue,
+    OUTBOUND_QUEUE_SIZE,
+    OUTBOUND_QUEUE_POLICY,
+    OUTBOUND_SEND_TIMEOUT,
+    ENQUEUED,
+    DROPPED_OLDEST,
+    OVERFLOW,
+    CLOSED,
+    resolve,
+)
+from app.websocket.fan_out import FanOutResult
+from app.websocket.message_payload import MessagePayload
+from app.websocket.envelope import ENVELOPE_FEATURE
+from app.websocket.replay_buffer import ReplayBuffer, ReplayEntry
+from app.websocket.command_dispatcher import CommandDispatcher
+from app.websocket.message_bus import (
+    MessageBus,
+    message_bus,
+    route_key,
+    ROUTE_APP,
+    ROUTE_APP_WXID,
+    ROUTE_APP_PHONE,
+    ROUTE_WINDOWS,
+    ROUTE_WINDOWS_WXID,
+    ROUTE_WINDOWS_PHONE,
+    ROUTE_WORKERS,
+)
+
+
+# 可丢弃的批量同步消息类型（新的全量数据会覆盖旧数据）
+BULK_MESSAGE_TYPES = frozenset({"sync_contacts", "sync_moments", "sync_tags", "sync_official_account"})
+
+# 二进制帧模式（客户端在client_type或session_key消息中携带 "binary_frames": true 协商）
+BINARY_FRAMES_FEATURE = "binary_frames"
+# 加密前压缩（客户端在client_type或session_key消息中携带 "compression": "zlib" 协商）
+COMPRESSION_FEATURE = "compression"
+# 命令确认（Windows端在client_type消息中携带 "command_ack": true，收到命令后发送command_ack消息）
+COMMAND_ACK_FEATURE = "command_ack"
+
+# 消息总线事件（接收方不在本worker进程时，由持有接收方连接的worker处理）
+BUS_EVENT_APP_WXID = "app_wxid"          # 转发给登录了指定微信账号的App端
+BUS_EVENT_APP_PHONE = "app_phone"        # 转发给登录了指定手机号的App端
+BUS_EVENT_APP = "app"                    # 转发给任意一个App端
+BUS_EVENT_CONTACTS = "contacts"          # 联系人已保存，按App端的联系人版本号发送增量
+BUS_EVENT_COMMAND = "command"            # App端命令，转发给Windows端
+BUS_EVENT_GET_LOGS = "get_logs"          # get_logs命令，转发给同步了指定微信手机号的Windows端
+BUS_EVENT_DRAIN = "drain"                # 下发微信账号积压的命令
 
 
 class WebSocketManager:
     """WebSocket连接管理器"""
     
-    def __init__(self):
-        # Windows端连接集合
-        self.windows_clients: Set[WebSocket] = set()
-        # App端连接集合
-        self.app_clients: Set[WebSocket] = set()
-        # 临时连接集合（等待client_type消息）
-        self.pending_clients: Set[WebSocket] = set()
-        # App端连接与微信账号ID的映射关系
-        self.app_client_wxid_map: Dict[WebSocket, str] = {}
-        # WebSocket连接与登录手机号的映射关系（用于验证手机号匹配）
-        self.websocket_phone_map: Dict[WebSocket, str] = {}
-        # Windows端连接与手机号的映射关系（用于权限控制）
-        self.windows_client_phone_map: Dict[WebSocket, str] = {}
+    def __init__(
+        self,
+        queue_size: int = OUTBOUND_QUEUE_SIZE,
+        queue_policy: str = OUTBOUND_QUEUE_POLICY,
+        send_timeout: float = OUTBOUND_SEND_TIMEOUT,
+        replay_buffer: Optional[ReplayBuffer] = None,
+        bus: Optional[MessageBus] = None
+    ):
+        # 发送队列配置
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        # 单条消息发送超时（秒）
+        self.send_timeout = send_timeout
+        # 因发送队列溢出或发送超时而断开的慢连接数
+        self.slow_consumer_disconnects = 0
+        # 多接收方转发累计统计
+        self.fan_out_stats: Dict[str, int] = {
+            "messages": 0,
+            "recipients": 0,
+            "enqueued": 0,
+            "failed": 0,
+        }
+        # App端离线期间的消息缓冲区（按微信账号）
+        self.replay_buffer = replay_buffer if replay_buffer is not None else ReplayBuffer()
+        # 跨worker进程的消息总线（接收方连接在其他worker进程上时使用）
+        self.bus = bus if bus is not None else message_bus
+        # 授权缓存（其他worker进程修改授权后按总线通知失效）
+        self.license_cache = license_cache
+        # 连接上下文（WebSocket -> ConnectionContext）
+        self.connections: Dict[WebSocket, ConnectionContext] = {}
+        # 反向索引：客户端类型 -> 连接集合
+        self._type_index: Dict[str, Set[ConnectionContext]] = {
+            CLIENT_TYPE_PENDING: set(),
+            CLIENT_TYPE_WINDOWS: set(),
+            CLIENT_TYPE_APP: set(),
+        }
+        # 持久化命令的下发调度器
+        self.command_dispatcher = CommandDispatcher(self)
+        # 命令ID -> 执行该命令的Windows端连接（收到结果后移除）
+        self._command_owners: Dict[str, ConnectionContext] = {}
+        # 反向索引：微信账号ID -> 连接集合（App端为当前查看的账号，Windows端为sync_my_info同步的账号）
+        self._wxid_index: Dict[str, Set[ConnectionContext]] = {}
+        # 反向索引：登录手机号 -> 连接集合（用于验证手机号匹配和精准转发）
+        self._phone_index: Dict[str, Set[ConnectionContext]] = {}
+        # 反向索引：Windows端同步的微信手机号 -> 连接集合（用于权限控制）
+        self._wechat_phone_index: Dict[str, Set[ConnectionContext]] = {}
+
+    @property
+    def windows_clients(self) -> Set[ConnectionContext]:
+        """Windows端连接集合"""
+        return self._type_index[CLIENT_TYPE_WINDOWS]
+
+    @property
+    def app_clients(self) -> Set[ConnectionContext]:
+        """App端连接集合"""
+        return self._type_index[CLIENT_TYPE_APP]
+
+    @property
+    def pending_clients(self) -> Set[ConnectionContext]:
+        """临时连接集合（等待client_type消息）"""
+        return self._type_index[CLIENT_TYPE_PENDING]
+
+    def get_context(self, websocket: WebSocket) -> Optional[ConnectionContext]:
+        """获取WebSocket连接的上下文"""
+        return self.connections.get(websocket)
 
     async def connect(self, websocket: WebSocket):
         """接受WebSocket连接"""
         await websocket.accept()
         
-        # 先添加到临时连接集合，等待client_type消息后再分类
-        self.pending_clients.add(websocket)
-        print(f"WebSocket连接已建立，等待客户端类型注册（临时连接数: {len(self.pending_clients)}）")
-        
-        # 发送RSA公钥给客户端（用于密钥交换）
+        # 发送RSA公钥给客户端（用于密钥交换，写任务启动前直接发送，保证是第一条消息）
         try:
             public_key_pem = rsa_key_manager.get_public_key_pem()
             await websocket.send_text(json.dumps({
@@ -49,67 +157,371 @@ class WebSocketManager:
             print("已发送RSA公钥给客户端")
         except Exception as e:
             print(f"发送RSA公钥失败: {e}")
+        
+        # 先添加到临时连接集合，等待client_type消息后再分类
+        ctx = ConnectionContext(
+            websocket,
+            self._get_connection_id(websocket),
+            OutboundQueue(self.queue_size, self.queue_policy)
+        )
+        self.connections[websocket] = ctx
+        self._type_index[CLIENT_TYPE_PENDING].add(ctx)
+        ctx.writer_task = asyncio.create_task(self._writer_loop(ctx))
+        print(f"WebSocket连接已建立，等待客户端类型注册（临时连接数: {len(self.pending_clients)}）")
 
     def disconnect(self, websocket: WebSocket):
         """断开WebSocket连接"""
-        # 清理会话密钥
-        connection_id = self._get_connection_id(websocket)
-        encryption_service.remove_session_key(connection_id)
+        ctx = self.connections.pop(websocket, None)
+        if ctx is None:
+            return
         
-        if websocket in self.pending_clients:
-            self.pending_clients.remove(websocket)
-            print(f"临时连接已断开，当前临时连接数: {len(self.pending_clients)}")
+        # 关闭发送队列并停止写任务，移除会话加密上下文
+        ctx.outbound.close()
+        ctx.release_session()
+        if ctx.writer_task is not None and ctx.writer_task is not asyncio.current_task():
+            ctx.writer_task.cancel()
         
-        if websocket in self.windows_clients:
-            self.windows_clients.remove(websocket)
-            # 清理Windows端与手机号的映射
-            if websocket in self.windows_client_phone_map:
-                del self.windows_client_phone_map[websocket]
-            print(f"Windows端连接已断开，当前连接数: {len(self.windows_clients)}")
+        # 清理反向索引和总线路由键
+        self._update_routes(ctx, self._route_keys(ctx), set())
+        self._type_index[ctx.client_type].discard(ctx)
+        self._index_discard(self._wxid_index, ctx.wxid, ctx)
+        self._index_discard(self._phone_index, ctx.phone, ctx)
+        self._index_discard(self._wechat_phone_index, ctx.wechat_phone, ctx)
+        for command_id in ctx.inflight_commands:
+            self._command_owners.pop(command_id, None)
+        ctx.inflight_commands.clear()
         
-        if websocket in self.app_clients:
-            self.app_clients.remove(websocket)
-            # 清理App端映射
-            if websocket in self.app_client_wxid_map:
-                del self.app_client_wxid_map[websocket]
+        if ctx.client_type == CLIENT_TYPE_PENDING:
+            print(f"临时连接已断开，当前临时连接数: {len(self.pending_clients)}")
+        elif ctx.client_type == CLIENT_TYPE_WINDOWS:
+            print(f"Windows端连接已断开，当前连接数: {len(self.windows_clients)}")
+        elif ctx.client_type == CLIENT_TYPE_APP:
             print(f"App端连接已断开，当前连接数: {len(self.app_clients)}")
+
+    async def _writer_loop(self, ctx: ConnectionContext):
+        """写任务：按顺序发送连接发送队列中的消息"""
+        websocket = ctx.websocket
+        done = None
+        try:
+            while True:
+                item = await ctx.outbound.get()
+                if item is None:
+                    break
+                payload, done = item
+                # 每条消息都有发送期限，避免永远无法完成的发送卡住写任务
+                if isinstance(payload, bytes):
+                    await asyncio.wait_for(websocket.send_bytes(payload), self.send_timeout)
+                else:
+                    await asyncio.wait_for(websocket.send_text(payload), self.send_timeout)
+                resolve(done, True)
+                done = None
+        except asyncio.CancelledError:
+            resolve(done, False)
+        except asyncio.TimeoutError:
+            resolve(done, False)
+            print(f"发送消息超时（{self.send_timeout}秒），断开慢连接（连接ID: {ctx.connection_id[:8]}...）")
+            self.slow_consumer_disconnects += 1
+            self._disconnect_batch([ctx])
+        except Exception as e:
+            resolve(done, False)
+            print(f"发送消息失败，断开连接（连接ID: {ctx.connection_id[:8]}...）: {e}")
+            self.disconnect(websocket)
+
+    def _enqueue(self, ctx: ConnectionContext, payload, bulk: bool = False, done: Optional[asyncio.Future] = None) -> bool:
+        """将消息放入连接的发送队列（不阻塞），返回是否入队成功"""
+        result = ctx.outbound.put_nowait(payload, bulk, done)
+        if result == DROPPED_OLDEST:
+            print(f"发送队列已满，丢弃最早的批量同步消息（连接ID: {ctx.connection_id[:8]}..., 已丢弃: {ctx.outbound.dropped_count}）")
+        elif result == OVERFLOW:
+            print(f"发送队列已满（深度: {ctx.outbound.qsize()}），断开慢连接（连接ID: {ctx.connection_id[:8]}...）")
+            self.slow_consumer_disconnects += 1
+            self._disconnect_batch([ctx])
+            return False
+        elif result == CLOSED:
+            return False
+        return True
+
+    def _disconnect_batch(self, contexts: List[ConnectionContext]):
+        """批量断开连接（移除连接并异步关闭底层WebSocket）"""
+        if not contexts:
+            return
+        
+        for ctx in contexts:
+            self.disconnect(ctx.websocket)
+
+        async def _close(ctx: ConnectionContext):
+            try:
+                await ctx.websocket.close(code=1008, reason="slow consumer")
+            except Exception:
+                pass
+
+        for ctx in contexts:
+            asyncio.create_task(_close(ctx))
+
+    async def fan_out(
+        self,
+        recipients: List[ConnectionContext],
+        message: Union[str, MessagePayload],
+        bulk: bool = False
+    ) -> FanOutResult:
+        """并发转发消息到多个接收方
+        
+        每个接收方独立加密并放入自己的发送队列，由各自的写任务并发发送，这里不等待发送完成。
+        每个接收方的发送期限是写任务的send_timeout，超时的连接由写任务断开；
+        入队时队列溢出的连接在最后统一断开。
+        
+        Args:
+            recipients: 接收方连接
+            message: 消息JSON（明文）或消息载荷，明文只序列化和编码一次
+            bulk: 是否为可丢弃的批量同步消息
+        
+        Returns:
+            FanOutResult: 入队汇总
+        """
+        payload = MessagePayload.of(message)
+        result = FanOutResult(len(recipients))
+        failed: List[ConnectionContext] = []
+        
+        for ctx in recipients:
+            status = ctx.outbound.put_nowait(self._encrypt_payload(ctx, payload), bulk)
+            if status in (ENQUEUED, DROPPED_OLDEST):
+                if status == DROPPED_OLDEST:
+                    result.dropped += 1
+                result.enqueued += 1
+            else:
+                result.failed.append(ctx.connection_id)
+                if status == OVERFLOW:
+                    failed.append(ctx)
+        
+        # 统一断开队列溢出的慢连接
+        failed = [ctx for ctx in failed if ctx.websocket in self.connections]
+        if failed:
+            self.slow_consumer_disconnects += len(failed)
+            self._disconnect_batch(failed)
         
-        # 清理登录手机号映射
-        if websocket in self.websocket_phone_map:
-            del self.websocket_phone_map[websocket]
+        result.finish()
+        stats = self.fan_out_stats
+        stats["messages"] += 1
+        stats["recipients"] += result.recipients
+        stats["enqueued"] += result.enqueued
+        stats["failed"] += len(result.failed)
+        return result
+
+    def _send(self, ctx: ConnectionContext, message: Union[str, MessagePayload], bulk: bool = False) -> bool:
+        """加密消息并放入连接的发送队列"""
+        return self._enqueue(ctx, self._encrypt_payload(ctx, MessagePayload.of(message)), bulk)
+
+    @staticmethod
+    def _negotiate_features(ctx: ConnectionContext, message: Dict):
+        """根据client_type/session_key消息协商二进制帧和压缩"""
+        if message.get(BINARY_FRAMES_FEATURE) == True:
+            ctx.binary_frames = True
+            print("客户端请求使用二进制帧")
+        if message.get(COMPRESSION_FEATURE) == COMPRESSION_CODEC:
+            ctx.compression = True
+            print(f"客户端请求使用{COMPRESSION_CODEC}压缩")
+        if message.get(COMMAND_ACK_FEATURE) == True:
+            ctx.command_ack = True
+            print("客户端支持命令确认")
+
+    def get_queue_stats(self) -> Dict:
+        """获取发送队列统计（队列深度、丢弃数、慢连接断开数）"""
+        depths = [ctx.outbound.qsize() for ctx in self.connections.values()]
+        return {
+            "queue_size": self.queue_size,
+            "queue_policy": self.queue_policy,
+            "total_depth": sum(depths),
+            "max_depth": max(depths) if depths else 0,
+            "dropped_count": sum(ctx.outbound.dropped_count for ctx in self.connections.values()),
+            "slow_consumer_disconnects": self.slow_consumer_disconnects,
+            "fan_out": dict(self.fan_out_stats),
+            "replay_buffer": self.replay_buffer.get_stats(),
+        }
+
+    @staticmethod
+    def _index_add(index: Dict[str, Set[ConnectionContext]], key: Optional[str], ctx: ConnectionContext):
+        """添加到反向索引"""
+        if key:
+            index.setdefault(key, set()).add(ctx)
+
+    @staticmethod
+    def _index_discard(index: Dict[str, Set[ConnectionContext]], key: Optional[str], ctx: ConnectionContext):
+        """从反向索引移除，集合为空时删除键"""
+        if not key:
+            return
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.discard(ctx)
+            if not bucket:
+                del index[key]
+
+    @staticmethod
+    def _route_keys(ctx: ConnectionContext) -> Set[str]:
+        """连接在消息总线上持有的路由键"""
+        if ctx.client_type == CLIENT_TYPE_APP:
+            keys = {ROUTE_APP}
+            if ctx.wxid:
+                keys.add(route_key(ROUTE_APP_WXID, ctx.wxid))
+            if ctx.phone:
+                keys.add(route_key(ROUTE_APP_PHONE, ctx.phone))
+            return keys
+        if ctx.client_type == CLIENT_TYPE_WINDOWS:
+            keys = {ROUTE_WINDOWS}
+            if ctx.wxid:
+                keys.add(route_key(ROUTE_WINDOWS_WXID, ctx.wxid))
+            if ctx.wechat_phone:
+                keys.add(route_key(ROUTE_WINDOWS_PHONE, ctx.wechat_phone))
+            return keys
+        return set()
+
+    def _update_routes(self, ctx: ConnectionContext, before: Set[str], after: Optional[Set[str]] = None):
+        """连接的路由键变化后，更新本进程在消息总线上持有的路由键"""
+        if after is None:
+            after = self._route_keys(ctx)
+        for key in before - after:
+            self.bus.release(key)
+        for key in after - before:
+            self.bus.hold(key)
+
+    def _set_client_type(self, ctx: ConnectionContext, client_type: str):
+        """更新连接的客户端类型（切换类型时清理微信账号ID映射）"""
+        self._type_index[ctx.client_type].discard(ctx)
+        self._set_wxid(ctx, None)
+        before = self._route_keys(ctx)
+        ctx.client_type = client_type
+        self._type_index[client_type].add(ctx)
+        self._update_routes(ctx, before)
+
+    def _set_wxid(self, ctx: ConnectionContext, wxid: Optional[str]) -> bool:
+        """更新连接的微信账号ID
+
+        Returns:
+            bool: 微信账号ID是否变化
+        """
+        if ctx.wxid == wxid:
+            return False
+        before = self._route_keys(ctx)
+        self._index_discard(self._wxid_index, ctx.wxid, ctx)
+        ctx.wxid = wxid
+        # 切换微信账号后，之前上报的联系人版本号不再有效
+        ctx.contacts_version = None
+        self._index_add(self._wxid_index, wxid, ctx)
+        self._update_routes(ctx, before)
+        return True
+
+    def _set_phone(self, ctx: ConnectionContext, phone: Optional[str]):
+        """更新连接的登录手机号"""
+        if ctx.phone == phone:
+            return
+        before = self._route_keys(ctx)
+        self._index_discard(self._phone_index, ctx.phone, ctx)
+        ctx.phone = phone
+        self._index_add(self._phone_index, phone, ctx)
+        self._update_routes(ctx, before)
+
+    def _set_wechat_phone(self, ctx: ConnectionContext, wechat_phone: Optional[str]):
+        """更新Windows端同步的微信手机号"""
+        if ctx.wechat_phone == wechat_phone:
+            return
+        before = self._route_keys(ctx)
+        self._index_discard(self._wechat_phone_index, ctx.wechat_phone, ctx)
+        ctx.wechat_phone = wechat_phone
+        self._index_add(self._wechat_phone_index, wechat_phone, ctx)
+        self._update_routes(ctx, before)
+
+    @staticmethod
+    def _filter_type(contexts: Iterable[ConnectionContext], client_type: str) -> List[ConnectionContext]:
+        """按客户端类型过滤连接"""
+        return [ctx for ctx in contexts if ctx.client_type == client_type]
+
+    def get_app_clients_by_wxid(self, wxid: str) -> List[ConnectionContext]:
+        """获取登录了指定微信账号的App端连接"""
+        return self._filter_type(self._wxid_index.get(wxid, ()), CLIENT_TYPE_APP)
+
+    def get_windows_clients_by_wxid(self, wxid: str) -> List[ConnectionContext]:
+        """获取同步了指定微信账号的Windows端连接"""
+        return self._filter_type(self._wxid_index.get(wxid, ()), CLIENT_TYPE_WINDOWS)
+
+    def get_app_clients_by_phone(self, phone: str) -> List[ConnectionContext]:
+        """获取登录了指定手机号的App端连接"""
+        return self._filter_type(self._phone_index.get(phone, ()), CLIENT_TYPE_APP)
+
+    def get_windows_clients_by_wechat_phone(self, wechat_phone: str) -> List[ConnectionContext]:
+        """获取同步了指定微信手机号的Windows端连接"""
+        return self._filter_type(self._wechat_phone_index.get(wechat_phone, ()), CLIENT_TYPE_WINDOWS)
     
-    def _encrypt_message(self, websocket: WebSocket, message_json: str) -> str:
+    def _encrypt_message(self, ctx: ConnectionContext, message_json: str) -> str:
         """加密消息（辅助方法，使用会话密钥）"""
+        return self._encrypt_payload(ctx, MessagePayload.of(message_json))
+
+    def _encrypt_payload(self, ctx: ConnectionContext, payload: MessagePayload) -> Union[str, bytes]:
+        """加密消息载荷（明文字节在载荷中只编码一次，每个接收方只做AES-GCM加密）
+        
+        协商了二进制帧的连接返回原始的 nonce||ciphertext||tag 字节（由写任务用二进制帧发送），
+        否则返回 {"encrypted": true, "data": "<base64>"} 文本
+        """
         try:
-            connection_id = self._get_connection_id(websocket)
-            
             # 如果会话密钥已设置，使用会话密钥加密
-            if encryption_service.has_session_key(connection_id):
-                encrypted_message = encryption_service.encrypt_string_for_communication(connection_id, message_json)
-                message_wrapper = {
-                    "encrypted": True,
-                    "data": encrypted_message
-                }
-                return json.dumps(message_wrapper, ensure_ascii=False)
+            if ctx.has_session_key():
+                # 协商了压缩的连接使用压缩后的明文（每条消息只压缩一次）
+                plain = payload.compressed_data if ctx.compression else payload.data
+                if ctx.binary_frames:
+                    return ctx.crypto.encrypt(plain)
+                encrypted_message = ctx.crypto.encrypt_b64(plain)
+                # base64字符串无需转义，直接拼接外层包装，等价于json.dumps({"encrypted": True, "data": ...})
+                return '{"encrypted": true, "data": "' + encrypted_message + '"}'
             else:
                 # 会话密钥未设置，使用明文（向后兼容）
-                print(f"警告: 连接 {connection_id[:8]}... 的会话密钥未设置，使用明文发送")
-                return message_json
+                print(f"警告: 连接 {ctx.connection_id[:8]}... 的会话密钥未设置，使用明文发送")
+                return payload.text
         except Exception as e:
             print(f"加密消息失败，使用明文: {e}")
             # 如果加密失败，使用明文（向后兼容）
-            return message_json
+            return payload.text
+
+    def decrypt_message(self, ctx: ConnectionContext, cipher_text: str) -> str:
+        """解密客户端发送的消息（使用会话密钥）"""
+        return ctx.crypto.decrypt_b64(cipher_text).decode('utf-8')
+
+    def decrypt_payload(self, ctx: ConnectionContext, cipher_text: str) -> MessagePayload:
+        """解密客户端发送的消息并解码为消息载荷（信封格式只解析头部）"""
+        plain = ctx.crypto.decrypt_b64(cipher_text)
+        return MessagePayload.decode(encryption_service.decompress_for_communication(plain))
+
+    def decrypt_frame(self, ctx: ConnectionContext, frame: bytes) -> MessagePayload:
+        """解密客户端发送的二进制帧并解码为消息载荷"""
+        plain = ctx.crypto.decrypt(frame)
+        return MessagePayload.decode(encryption_service.decompress_for_communication(plain))
 
     def _get_connection_id(self, websocket: WebSocket) -> str:
-        """获取WebSocket连接的唯一ID"""
-        return str(id(websocket))
+        """生成WebSocket连接的唯一ID（不使用id(websocket)，对象回收后内存地址可能被新连接复用）"""
+        return uuid.uuid4().hex
+    
+    async def handle_message(self, websocket: WebSocket, message: Dict, raw_text: Optional[str] = None):
+        """处理WebSocket消息
+        
+        Args:
+            websocket: 来源连接
+            message: 解析后的消息
+            raw_text: 客户端发来的（解密后）明文JSON，转发时直接复用，避免重新序列化
+        """
+        await self.handle_payload(websocket, MessagePayload(message, raw_text))
     
-    async def handle_message(self, websocket: WebSocket, message: Dict):
-        """处理WebSocket消息"""
+    async def handle_payload(self, websocket: WebSocket, payload: MessagePayload):
+        """处理WebSocket消息载荷"""
+        ctx = self.connections.get(websocket)
+        if ctx is None:
+            print("收到未注册连接的WebSocket消息，忽略")
+            return
+        
+        message = payload.message
         try:
             message_type = message.get("type", "")
             
-            print(f"收到WebSocket消息，类型: {message_type}, 来源: {websocket}")
+            if payload.is_envelope:
+                print(f"收到WebSocket信封消息，类型: {message_type}, 序号: {payload.header.get('seq')}, 大小: {payload.size}, 来源: {websocket}")
+            else:
+                print(f"收到WebSocket消息，类型: {message_type}, 来源: {websocket}")
             
             # 处理会话密钥交换
             if message_type == "session_key":
@@ -117,47 +529,61 @@ class WebSocketManager:
                 if encrypted_key_b64:
                     try:
                         # 使用RSA私钥解密会话密钥
-                        session_key = rsa_key_manager.decrypt_session_key(encrypted_key_b64)
+                        session_key = await rsa_key_manager.decrypt_session_key_async(encrypted_key_b64)
                         
                         # 保存会话密钥
-                        connection_id = self._get_connection_id(websocket)
-                        encryption_service.set_session_key(connection_id, session_key)
+                        connection_id = ctx.connection_id
+                        ctx.set_session_key(session_key)
+                        self._negotiate_features(ctx, message)
                         
-                        # 发送密钥交换成功消息
-                        await websocket.send_text(json.dumps({
-                            "type": "key_exchange_success"
+                        # 发送密钥交换成功消息（明文文本帧，之后的加密消息按协商的帧格式发送）
+                        self._enqueue(ctx, json.dumps({
+                            "type": "key_exchange_success",
+                            "features": [ENVELOPE_FEATURE, BINARY_FRAMES_FEATURE, COMPRESSION_FEATURE, COMMAND_ACK_FEATURE],
+                            BINARY_FRAMES_FEATURE: ctx.binary_frames,
+                            COMPRESSION_FEATURE: COMPRESSION_CODEC if ctx.compression else None
                         }, ensure_ascii=False))
                         
-                        print(f"会话密钥交换成功（连接ID: {connection_id[:8]}...）")
+                        print(f"会话密钥交换成功（连接ID: {connection_id[:8]}..., 二进制帧: {ctx.binary_frames}, 压缩: {ctx.compression}）")
+                        return
+                    except CpuExecutorBusy as e:
+                        # 同时进行密钥交换的客户端过多，断开连接（1013: 稍后重试），客户端重连后重新交换
+                        print(f"处理会话密钥失败: {e}，断开连接")
+                        self.disconnect(websocket)
+                        try:
+                            await websocket.close(code=1013, reason="try again later")
+                        except Exception:
+                            pass
                         return
                     except Exception as e:
                         print(f"处理会话密钥失败: {e}")
                         return
             
             if message_type == "sync_contacts":
-                # Windows端同步联系人数据，只转发到App端（不保存到数据库）
-                print(f"收到联系人数据同步，转发到App端，数据数量: {len(message.get('data', []))}")
-                await self._forward_to_app_clients_by_wxid(message)
+                # Windows端同步联系人数据，保存到数据库并按App端已知版本转发增量
+                print(f"收到联系人数据同步，数据数量: {payload.count}")
+                await self._handle_sync_contacts(payload)
             
             elif message_type == "sync_moments":
                 # Windows端同步朋友圈数据，只转发到App端（不保存到数据库）
-                print(f"收到朋友圈数据同步，转发到App端，数据数量: {len(message.get('data', []))}")
-                await self._forward_to_app_clients_by_wxid(message)
+                print(f"收到朋友圈数据同步，转发到App端，数据数量: {payload.count}")
+                await self._forward_to_app_clients_by_wxid(payload)
             
             elif message_type == "sync_tags":
                 # Windows端同步标签数据，只转发到App端（不保存到数据库）
-                print(f"收到标签数据同步，转发到App端，数据数量: {len(message.get('data', []))}")
-                await self._forward_to_app_clients_by_wxid(message)
+                print(f"收到标签数据同步，转发到App端，数据数量: {payload.count}")
+                await self._forward_to_app_clients_by_wxid(payload)
             
             elif message_type == "sync_chat_message":
-                # Windows端同步聊天消息，只转发到App端（不保存到数据库）
-                print("收到聊天消息同步，转发到App端")
-                await self._forward_to_app_clients_by_wxid(message)
+                # Windows端同步聊天消息，保存到数据库（按msg_id去重）并转发到App端
+                print("收到聊天消息同步，保存并转发到App端")
+                await self._save_chat_messages(payload)
+                await self._forward_to_app_clients_by_wxid(payload)
             
             elif message_type == "sync_official_account":
                 # Windows端同步公众号消息，只转发到App端（不保存到数据库）
                 print("收到公众号消息同步，转发到App端")
-                await self._forward_to_app_clients_by_wxid(message)
+                await self._forward_to_app_clients_by_wxid(payload)
             
             elif message_type == "sync_my_info":
                 # Windows端同步我的信息，保存到数据库并转发到App端
@@ -173,98 +599,111 @@ class WebSocketManager:
                 print(f"保存到数据库并转发到App端")
                 
                 # 建立Windows端与手机号的映射关系（用于权限控制）
-                if phone and websocket in self.windows_clients:
-                    self.windows_client_phone_map[websocket] = phone
+                if phone and ctx.client_type == CLIENT_TYPE_WINDOWS:
+                    self._set_wechat_phone(ctx, phone)
                     print(f"已建立Windows端与手机号的映射: {phone}")
                 
-                await self._save_account_info_to_db(message.get("data", {}), websocket)
+                # 建立Windows端与微信账号的映射关系（用于按target_we_chat_id下发命令）
+                if wxid and ctx.client_type == CLIENT_TYPE_WINDOWS and self._set_wxid(ctx, wxid):
+                    print(f"已建立Windows端与微信账号的映射: {wxid}")
+                    # 新连接（包括重连）或切换了微信账号时，下发该微信账号在离线期间积压的命令；
+                    # 同一连接重复发送sync_my_info（如未读消息数变化）不再触发下发
+                    self.command_dispatcher.schedule_drain(wxid)
+                
+                await self._save_account_info_to_db(message.get("data", {}), ctx)
                 
                 # ========== 按手机号精准转发，而不是广播 ==========
                 if phone:
                     # 只转发给登录了对应手机号的App端
-                    forwarded_count = 0
-                    message_json = json.dumps(message, ensure_ascii=False)
+                    recipients = self.get_app_clients_by_phone(phone)
+                    # 登录了该手机号的App端在其他worker进程上时，通过消息总线转发
+                    remote = self.bus.publish(route_key(ROUTE_APP_PHONE, phone), BUS_EVENT_APP_PHONE, payload, phone=phone)
                     
-                    print(f"开始按手机号精准转发: phone={phone}, App端连接数={len(self.app_clients)}, 手机号映射数={len(self.websocket_phone_map)}")
+                    print(f"开始按手机号精准转发: phone={phone}, App端连接数={len(self.app_clients)}, 匹配连接数={len(recipients)}, 其他worker: {remote}")
                     
-                    for app_client, client_phone in self.websocket_phone_map.items():
-                        if client_phone == phone:
-                            try:
-                                # 加密消息
-                                encrypted_message = self._encrypt_message(websocket, message_json)
-                                await app_client.send_text(encrypted_message)
-                                forwarded_count += 1
-                                print(f"✓ 已转发账号信息到App端（已加密，手机号: {phone}, wxid: {wxid}）")
-                            except Exception as e:
-                                print(f"✗ 转发消息到App端失败: {e}")
+                    # 并发转发（每个接收方使用自己的会话密钥加密）
+                    summary = await self.fan_out(recipients, payload)
+                    enqueued_count = summary.enqueued
+                    if summary.failed_count:
+                        print(f"✗ 转发账号信息到 {summary.failed_count} 个App端失败")
                     
-                    if forwarded_count > 0:
-                        print(f"========== 转发完成: 已转发账号信息到 {forwarded_count} 个App端（手机号: {phone}） ==========")
+                    if enqueued_count > 0:
+                        print(f"========== 转发完成: 已放入 {enqueued_count} 个App端的发送队列（已加密，手机号: {phone}, wxid: {wxid}） ==========")
+                    elif remote:
+                        print(f"========== 转发完成: 已通过消息总线转发账号信息到其他worker进程（手机号: {phone}） ==========")
                     else:
                         print(f"========== 转发完成: 没有找到登录了手机号 {phone} 的App端 ==========")
-                        print(f"当前手机号映射: {list(self.websocket_phone_map.values())}")
+                        print(f"当前已登录手机号: {list(self._phone_index.keys())}")
                 else:
                     # 如果没有手机号，广播给所有App端（兼容旧逻辑）
                     print("警告: sync_my_info消息中没有手机号，广播给所有App端")
-                    await self.broadcast_to_app_clients(message)
+                    await self.broadcast_to_app_clients(payload)
             
             elif message_type == "command":
                 # App端发送命令，转发到Windows端（带权限验证）
-                await self._handle_command(websocket, message)
+                await self._handle_command(ctx, payload)
             
             elif message_type == "command_result":
                 # Windows端返回命令执行结果，转发到App端
                 print("转发命令执行结果到App端")
-                await self.send_to_app_client(message)
+                self.command_finished(message.get("command_id", ""))
+                await self.command_dispatcher.complete(
+                    message.get("command_id", ""), message.get("status", ""), message.get("result")
+                )
+                await self.send_to_app_client(payload)
+            
+            elif message_type == "command_ack":
+                # Windows端确认收到命令
+                await self.command_dispatcher.ack(message.get("command_id", ""))
             
             elif message_type == "client_type":
                 # 客户端类型注册
                 client_type = message.get("client_type", "")
                 print(f"客户端类型注册: {client_type}")
+                self._negotiate_features(ctx, message)
                 
-                # 先从临时连接集合中移除（如果存在）
-                if websocket in self.pending_clients:
-                    self.pending_clients.remove(websocket)
-                
-                # 从其他集合中移除（如果存在）
-                if websocket in self.app_clients:
-                    self.app_clients.remove(websocket)
-                    # 清理App端映射
-                    if websocket in self.app_client_wxid_map:
-                        del self.app_client_wxid_map[websocket]
-                
-                if websocket in self.windows_clients:
-                    self.windows_clients.remove(websocket)
-                
-                # 根据client_type添加到对应的集合
-                if client_type == "windows":
-                    self.windows_clients.add(websocket)
+                # 根据client_type移动到对应的集合（同时清理旧的微信账号ID映射）
+                if client_type == CLIENT_TYPE_WINDOWS:
+                    self._set_client_type(ctx, CLIENT_TYPE_WINDOWS)
                     print(f"Windows端连接数: {len(self.windows_clients)}")
-                elif client_type == "app":
-                    self.app_clients.add(websocket)
+                elif client_type == CLIENT_TYPE_APP:
+                    self._set_client_type(ctx, CLIENT_TYPE_APP)
                     print(f"App端连接数: {len(self.app_clients)}")
                 else:
                     print(f"未知的客户端类型: {client_type}，保持为临时连接")
-                    self.pending_clients.add(websocket)
+                    self._set_client_type(ctx, CLIENT_TYPE_PENDING)
             
             elif message_type == "login":
                 # App端或Windows端登录请求（手机号+授权码）
-                await self._handle_login(websocket, message)
+                await self._handle_login(ctx, message)
             
             elif message_type == "verify_login_code":
                 # App端验证登录码
-                await self._handle_verify_login_code(websocket, message)
+                await self._handle_verify_login_code(ctx, message)
             
             elif message_type == "quick_login":
                 # App端快速登录（使用wxid）
-                await self._handle_quick_login(websocket, message)
+                await self._handle_quick_login(ctx, message)
             
             elif message_type == "set_wxid":
                 # App端设置当前微信账号ID（登录成功后）
                 wxid = message.get("wxid", "")
                 if wxid:
-                    self.app_client_wxid_map[websocket] = wxid
+                    self._set_wxid(ctx, wxid)
                     print(f"App端已设置微信账号ID: {wxid}")
+                    if ctx.client_type == CLIENT_TYPE_APP:
+                        self._replay_missed(ctx, wxid, message.get("contacts_version") is not None)
+                    # App端上报了本地联系人版本号时，补发增量
+                    if ctx.client_type == CLIENT_TYPE_APP and message.get("contacts_version") is not None:
+                        await self._send_contacts_since(ctx, wxid, message.get("contacts_version"))
+            
+            elif message_type == "get_contacts_delta":
+                # App端按本地联系人版本号请求增量
+                wxid = message.get("we_chat_id") or ctx.wxid
+                if ctx.client_type == CLIENT_TYPE_APP and wxid and wxid == ctx.wxid:
+                    await self._send_contacts_since(ctx, wxid, message.get("version", 0))
+                else:
+                    print(f"拒绝联系人增量请求：连接未登录微信账号 {wxid}")
             
         except Exception as e:
             print(f"处理WebSocket消息失败: {e}")
@@ -272,21 +711,29 @@ class WebSocketManager:
             traceback.print_exc()
 
 
-    async def broadcast_to_app_clients(self, message: Dict):
+    async def broadcast_to_app_clients(self, message: Union[Dict, MessagePayload]):
         """广播消息到所有App端"""
         await self.send_to_app_client(message)
     
-    async def _forward_to_app_clients_by_wxid(self, message: Dict):
+    async def _forward_to_app_clients_by_wxid(self, message: Union[Dict, MessagePayload]):
         """根据微信账号ID转发消息到对应的App端"""
-        # 从消息中提取we_chat_id（可能在不同位置）
-        data = message.get("data", [])
-        if not data:
-            # 如果没有数据，直接转发给所有App端
-            await self.broadcast_to_app_clients(message)
-            return
+        payload = MessagePayload.of(message)
+        message = payload.message
+        
+        # 信封消息直接使用头部中的we_chat_id，不解析消息体
+        if payload.is_envelope:
+            we_chat_id = message.get("we_chat_id")
+            data = None
+        else:
+            # 从消息中提取we_chat_id（可能在不同位置）
+            data = message.get("data", [])
+            if not data:
+                # 如果没有数据，直接转发给所有App端
+                await self.broadcast_to_app_clients(payload)
+                return
+            we_chat_id = None
         
         # 提取we_chat_id（从第一条数据中获取）
-        we_chat_id = None
         if isinstance(data, list) and len(data) > 0:
             first_item = data[0]
             if isinstance(first_item, dict):
@@ -296,32 +743,207 @@ class WebSocketManager:
         
         if not we_chat_id:
             # 如果无法提取we_chat_id，转发给所有App端
-            await self.broadcast_to_app_clients(message)
+            await self.broadcast_to_app_clients(payload)
             return
         
         # 只转发给登录了对应微信账号的App端
-        forwarded_count = 0
-        for app_client, client_wxid in self.app_client_wxid_map.items():
-            if client_wxid == we_chat_id:
-                try:
-                    message_json = json.dumps(message, ensure_ascii=False)
-                    # 加密消息
-                    encrypted_message = self._encrypt_message(app_client, message_json)
-                    await app_client.send_text(encrypted_message)
-                    forwarded_count += 1
-                except Exception as e:
-                    print(f"转发消息到App端失败: {e}")
-        
-        if forwarded_count > 0:
-            print(f"已转发消息到 {forwarded_count} 个App端（微信账号ID: {we_chat_id}）")
+        bulk = message.get("type") in BULK_MESSAGE_TYPES
+        recipients = self.get_app_clients_by_wxid(we_chat_id)
+        # 登录了该账号的App端在其他worker进程上时，通过消息总线转发
+        remote = self.bus.publish(
+            route_key(ROUTE_APP_WXID, we_chat_id), BUS_EVENT_APP_WXID, payload, wxid=we_chat_id, bulk=bulk
+        )
+        if not recipients:
+            if remote:
+                print(f"已通过消息总线转发消息到其他worker进程（微信账号ID: {we_chat_id}）")
+                return
+            # App端离线，缓存消息，App端重新上线后补发
+            if self.replay_buffer.add(we_chat_id, payload, bulk):
+                print(f"没有找到登录了微信账号 {we_chat_id} 的App端，已缓存待补发")
+            return
+        
+        summary = await self.fan_out(recipients, payload, bulk)
+        
+        if summary.enqueued > 0:
+            print(f"已转发消息到 {summary.enqueued} 个App端发送队列（微信账号ID: {we_chat_id}）")
+        if summary.failed_count:
+            print(f"转发消息到 {summary.failed_count} 个App端失败（微信账号ID: {we_chat_id}）: {summary.to_dict()}")
+    
+    async def _handle_sync_contacts(self, payload: MessagePayload):
+        """保存Windows端同步的联系人，并按App端已知的联系人版本号转发增量
+        
+        上报过联系人版本号的App端只接收sync_contacts_delta增量；
+        没有上报版本号的App端（旧版本）仍按原方式接收完整的sync_contacts消息。
+        """
+        message = payload.message
+        try:
+            # 保存联系人需要解析消息体（信封消息的消息体仍原样转发给旧版本App端）
+            body = json.loads(bytes(payload.data)) if payload.is_envelope else message
+            records = body.get("data")
+            wxid = message.get("we_chat_id") or body.get("we_chat_id")
+            if not wxid and isinstance(records, list) and records and isinstance(records[0], dict):
+                wxid = records[0].get("we_chat_id") or records[0].get("weChatId")
+            if not wxid or not isinstance(records, list):
+                print("联系人数据中没有微信账号ID，只转发不保存")
+                await self._forward_to_app_clients_by_wxid(payload)
+                return
+            
+            # 批次序号和批次总数用于判断是否收齐本轮所有批次（收齐后才计算删除的联系人）
+            batch_index = body.get("batch_index")
+            batch_count = body.get("batch_count")
+            delta = await contact_service.apply_batch(
+                wxid, records, body.get("snapshot_id"), body.get("last_batch") == True,
+                batch_index if isinstance(batch_index, int) else None,
+                batch_count if isinstance(batch_count, int) else None
+            )
+        except Exception as e:
+            # 保存失败时退回为原样转发，不影响App端接收
+            print(f"保存联系人失败，按原方式转发: {e}")
+            await self._forward_to_app_clients_by_wxid(payload)
+            return
+        
+        recipients = self.get_app_clients_by_wxid(wxid)
+        # 其他worker进程上的App端由该进程按各自的联系人版本号从数据库读取增量
+        remote = self.bus.publish(route_key(ROUTE_APP_WXID, wxid), BUS_EVENT_CONTACTS, payload, wxid=wxid)
+        if not recipients:
+            if remote:
+                print(f"已通过消息总线通知其他worker进程发送联系人数据（微信账号ID: {wxid}）")
+                return
+            # App端离线，缓存完整消息（上报了联系人版本号的App端上线后改为获取增量）
+            if self.replay_buffer.add(wxid, payload, True):
+                print(f"没有找到登录了微信账号 {wxid} 的App端，联系人数据已缓存待补发")
+            return
+        await self._deliver_contacts(wxid, recipients, payload, delta)
+    
+    async def _deliver_contacts(
+        self,
+        wxid: str,
+        recipients: List[ConnectionContext],
+        payload: MessagePayload,
+        delta: Optional[ContactDelta] = None
+    ):
+        """向App端发送联系人数据：旧版本App端接收完整的sync_contacts消息，其他按联系人版本号接收增量
+        
+        delta为本次保存产生的增量（通过消息总线收到时为None，全部从数据库读取）
+        """
+        legacy: List[ConnectionContext] = []
+        by_version: Dict[int, List[ConnectionContext]] = {}
+        for ctx in recipients:
+            if ctx.contacts_version is None:
+                legacy.append(ctx)
+            else:
+                by_version.setdefault(ctx.contacts_version, []).append(ctx)
+        
+        if legacy:
+            summary = await self.fan_out(legacy, payload, True)
+            print(f"已转发完整联系人数据到 {summary.enqueued} 个App端发送队列（微信账号ID: {wxid}）")
+        
+        for version, contexts in by_version.items():
+            if delta is not None and version == delta.base_version:
+                await self._push_contacts_delta(wxid, contexts, delta)
+            else:
+                await self._push_contacts_delta(wxid, contexts, await contact_service.get_delta_since(wxid, version))
+    
+    async def _send_contacts_since(self, ctx: ConnectionContext, wxid: str, version):
+        """按App端上报的联系人版本号发送增量（版本号未知时发送完整列表）"""
+        try:
+            version = int(version)
+        except (TypeError, ValueError):
+            print(f"无效的联系人版本号: {version}")
+            return
+        try:
+            ctx.contacts_version = version
+            await self._push_contacts_delta(wxid, [ctx], await contact_service.get_delta_since(wxid, version))
+        except Exception as e:
+            print(f"发送联系人增量失败: {e}")
+    
+    async def _push_contacts_delta(self, wxid: str, recipients: List[ConnectionContext], delta: Optional[ContactDelta]):
+        """发送联系人增量，delta为None（App端版本号未知）时发送数据库中的完整列表
+        
+        增量依赖App端的版本号连续，因此不作为可丢弃的批量消息入队
+        """
+        if delta is None:
+            version = await contact_service.get_version(wxid)
+            if version == 0:
+                # 服务器还没有该账号的联系人，等待Windows端同步
+                return
+            message = {
+                "type": "sync_contacts",
+                "we_chat_id": wxid,
+                "version": version,
+                "full": True,
+                "data": await contact_service.get_contacts(wxid),
+            }
+            print(f"App端联系人版本号未知，发送完整联系人列表: wxid={wxid}, 版本={version}, 数量={len(message['data'])}")
+        elif delta.base_version == delta.version:
+            # App端已是最新版本
+            return
         else:
-            print(f"没有找到登录了微信账号 {we_chat_id} 的App端")
+            version = delta.version
+            message = delta.to_message()
+            print(f"发送联系人增量: {delta}")
+        
+        for ctx in recipients:
+            ctx.contacts_version = version
+        summary = await self.fan_out(recipients, MessagePayload(message))
+        if summary.failed_count:
+            print(f"发送联系人数据到 {summary.failed_count} 个App端失败（微信账号ID: {wxid}）")
+    
+    def _replay_missed(self, ctx: ConnectionContext, wxid: str, skip_contacts: bool = False):
+        """按原顺序补发App端离线期间缓存的消息
+        
+        消息同步放入发送队列，保证排在之后的实时消息之前；
+        写任务确认发送成功后才从缓冲区移除，连接中途断开时未发送的消息仍保留给下次补发。
+        
+        Args:
+            ctx: App端连接
+            wxid: 微信账号ID
+            skip_contacts: 是否跳过完整联系人消息（App端会改为获取联系人增量）
+        """
+        entries = self.replay_buffer.pending(wxid)
+        if skip_contacts:
+            entries = [entry for entry in entries if entry.message_type != "sync_contacts"]
+        if not entries:
+            return
+        
+        loop = asyncio.get_running_loop()
+        waiting: List[tuple] = []
+        for entry in entries:
+            done = loop.create_future()
+            if not self._enqueue(ctx, self._encrypt_payload(ctx, entry.payload), entry.bulk, done):
+                break
+            waiting.append((entry, done))
+        
+        print(f"开始补发离线消息: wxid={wxid}, 数量={len(waiting)}/{len(entries)}（连接ID: {ctx.connection_id[:8]}...）")
+        if waiting:
+            asyncio.create_task(self._confirm_replay(wxid, waiting))
+    
+    async def _confirm_replay(self, wxid: str, waiting: List[tuple]):
+        """等待补发完成，移除已发送的消息"""
+        await asyncio.gather(*(done for _, done in waiting))
+        delivered: List[ReplayEntry] = [entry for entry, done in waiting if done.result()]
+        self.replay_buffer.acknowledge(wxid, delivered)
+        print(f"离线消息补发完成: wxid={wxid}, 已发送={len(delivered)}/{len(waiting)}")
+    
+    async def _save_chat_messages(self, payload: MessagePayload):
+        """保存同步的聊天消息，失败时只记录日志，不影响转发"""
+        try:
+            # 信封消息需要解析消息体才能保存
+            body = json.loads(bytes(payload.data)) if payload.is_envelope else payload.message
+            saved = await ChatMessageService.save_sync_message(
+                body.get("data"), payload.message.get("we_chat_id") or body.get("we_chat_id")
+            )
+            if saved == 0:
+                print("聊天消息已存在或缺少msg_id，未重复保存")
+        except Exception as e:
+            print(f"保存聊天消息失败: {e}")
     
-    async def _handle_command(self, websocket: WebSocket, message: Dict):
+    async def _handle_command(self, ctx: ConnectionContext, payload: MessagePayload):
         """处理App端发送的命令（带权限验证）"""
+        message = payload.message
         try:
             # 验证App端是否已登录
-            if websocket not in self.websocket_phone_map:
+            if not ctx.phone:
                 print("警告: App端未登录，拒绝执行命令")
                 response = json.dumps({
                     "type": "command_result",
@@ -329,10 +951,10 @@ class WebSocketManager:
                     "status": "error",
                     "result": "未登录，无法执行命令"
                 }, ensure_ascii=False)
-                await websocket.send_text(self._encrypt_message(websocket, response))
+                self._send(ctx, response)
                 return
             
-            app_phone = self.websocket_phone_map[websocket]
+            app_phone = ctx.phone
             command_type = message.get("command_type", "")
             
             print(f"收到App端命令: command_type={command_type}, phone={app_phone}")
@@ -340,43 +962,51 @@ class WebSocketManager:
             # 对于get_logs命令，只转发给该手机号对应的Windows端
             if command_type == "get_logs":
                 # 查找该手机号对应的Windows端
-                target_windows_client = None
-                for windows_client, windows_phone in self.windows_client_phone_map.items():
-                    if windows_phone == app_phone:
-                        target_windows_client = windows_client
-                        break
+                windows_matches = self.get_windows_clients_by_wechat_phone(app_phone)
+                target_windows_client = windows_matches[0] if windows_matches else None
                 
                 if target_windows_client:
                     print(f"找到匹配的Windows端（手机号: {app_phone}），转发get_logs命令")
-                    message_json = json.dumps(message, ensure_ascii=False)
-                    try:
-                        encrypted_message = self._encrypt_message(target_windows_client, message_json)
-                        await target_windows_client.send_text(encrypted_message)
-                        print(f"get_logs命令已成功转发到Windows端（手机号: {app_phone}）")
-                    except Exception as e:
-                        print(f"转发get_logs命令到Windows端失败: {e}")
+                    if not await self._forward_get_logs(target_windows_client, payload):
                         response = json.dumps({
                             "type": "command_result",
                             "command_id": message.get("command_id", ""),
                             "status": "error",
-                            "result": f"转发命令失败: {str(e)}"
+                            "result": "转发命令失败: Windows端连接不可用"
                         }, ensure_ascii=False)
-                        await websocket.send_text(self._encrypt_message(websocket, response))
+                        self._send(ctx, response)
+                elif self.bus.publish(
+                    route_key(ROUTE_WINDOWS_PHONE, app_phone), BUS_EVENT_GET_LOGS, payload, one=True, phone=app_phone
+                ):
+                    # 对应的Windows端在其他worker进程上，由该进程保存命令并转发
+                    print(f"get_logs命令已通过消息总线转发到其他worker进程（手机号: {app_phone}）")
                 else:
                     print(f"未找到匹配的Windows端（手机号: {app_phone}），拒绝get_logs命令")
-                    print(f"当前Windows端手机号映射: {list(self.windows_client_phone_map.values())}")
-                    print(f"当前App端手机号映射: {list(self.websocket_phone_map.values())}")
+                    print(f"当前Windows端手机号映射: {list(self._wechat_phone_index.keys())}")
+                    print(f"当前登录手机号: {list(self._phone_index.keys())}")
                     response = json.dumps({
                         "type": "command_result",
                         "command_id": message.get("command_id", ""),
                         "status": "error",
                         "result": "未找到对应的Windows端，无法获取日志"
                     }, ensure_ascii=False)
-                    await websocket.send_text(self._encrypt_message(websocket, response))
+                    self._send(ctx, response)
             else:
-                # 对于其他命令，转发给所有Windows端（保持原有逻辑）
-                print(f"转发命令到Windows端: {command_type}")
-                await self.send_to_windows_client(message)
+                # 对于其他命令，按target_we_chat_id转发给负载最低的Windows端
+                target_we_chat_id = message.get("target_we_chat_id", "")
+                print(f"转发命令到Windows端: {command_type}, 目标微信账号: {target_we_chat_id or '任意'}")
+                if await self.send_to_windows_client(payload):
+                    pass
+                elif self._publish_command(payload):
+                    print(f"命令已通过消息总线转发到其他worker进程: {command_type}, 目标微信账号: {target_we_chat_id or '任意'}")
+                else:
+                    response = json.dumps({
+                        "type": "command_result",
+                        "command_id": message.get("command_id", ""),
+                        "status": "error",
+                        "result": self.offline_error(target_we_chat_id)
+                    }, ensure_ascii=False)
+                    self._send(ctx, response)
         except Exception as e:
             print(f"处理命令失败: {e}")
             import traceback
@@ -388,63 +1018,192 @@ class WebSocketManager:
                     "status": "error",
                     "result": f"处理命令失败: {str(e)}"
                 }, ensure_ascii=False)
-                await websocket.send_text(self._encrypt_message(websocket, response))
+                self._send(ctx, response)
             except:
                 pass
     
-    async def send_to_windows_client(self, message: Dict):
-        """发送消息到Windows端（单播）"""
-        if not self.windows_clients:
-            print(f"没有Windows端连接（Windows端连接数: {len(self.windows_clients)}, App端连接数: {len(self.app_clients)}, 临时连接数: {len(self.pending_clients)}）")
+    async def _forward_get_logs(self, ctx: ConnectionContext, payload: MessagePayload) -> bool:
+        """保存get_logs命令并转发给指定的Windows端，返回是否已放入发送队列"""
+        message = payload.message
+        # 先保存命令，Windows端通过HTTP上传日志时需要按命令ID查找
+        await self._record_forwarded_command(ctx, message)
+        # 附带服务器已保存到的日志偏移，Windows端只上传之后新增的日志
+        payload = await self._with_log_cursor(ctx, message) or payload
+        if self._send(ctx, payload):
+            print(f"get_logs命令已成功转发到Windows端（手机号: {ctx.wechat_phone}）")
+            return True
+        print("转发get_logs命令到Windows端失败: 发送队列已满或连接已关闭")
+        return False
+    
+    def _publish_command(self, payload: MessagePayload) -> bool:
+        """目标Windows端在其他worker进程上时，通过消息总线转发命令"""
+        target_we_chat_id = payload.message.get("target_we_chat_id") or ""
+        key = route_key(ROUTE_WINDOWS_WXID, target_we_chat_id) if target_we_chat_id else ROUTE_WINDOWS
+        return self.bus.publish(key, BUS_EVENT_COMMAND, payload, one=True)
+    
+    def notify_drain(self, target_we_chat_id: str) -> bool:
+        """目标Windows端在其他worker进程上时，通知该进程下发积压的命令（命令已保存在数据库中）"""
+        key = route_key(ROUTE_WINDOWS_WXID, target_we_chat_id) if target_we_chat_id else ROUTE_WINDOWS
+        return self.bus.publish(key, BUS_EVENT_DRAIN, one=True, wxid=target_we_chat_id)
+    
+    async def _record_forwarded_command(self, ctx: ConnectionContext, message: Dict):
+        """保存直接转发给指定Windows端的命令，保存失败时只记录日志，不影响转发"""
+        command_id = message.get("command_id", "")
+        if not command_id:
             return
+        try:
+            await self.command_dispatcher.record_forwarded(Command(
+                command_id=command_id,
+                command_type=message.get("command_type", ""),
+                command_data=json.dumps(message.get("command_data") or {}, ensure_ascii=False),
+                target_we_chat_id=ctx.wxid or ""
+            ), ctx.connection_id)
+            self._track_command(ctx, command_id)
+        except Exception as e:
+            print(f"保存转发的命令失败: {command_id}, {e}")
+    
+    @staticmethod
+    async def _with_log_cursor(ctx: ConnectionContext, message: Dict) -> Optional[Dict]:
+        """在get_logs命令的command_data中附带该Windows端已上传到的日志文件名和字节偏移（没有记录时返回None）"""
+        try:
+            cursor = await log_store.find_cursor(ctx.wxid)
+        except Exception as e:
+            print(f"查询日志偏移失败: {e}")
+            return None
+        if cursor is None:
+            return None
+        command_data = dict(
+            message.get("command_data") or {},
+            log_file_name=cursor.log_file_name,
+            offset=cursor.source_offset
+        )
+        return dict(message, command_data=command_data)
+    
+    async def send_to_windows_client(self, message: Union[Dict, MessagePayload]) -> bool:
+        """发送命令到Windows端（单播）
         
-        message_json = json.dumps(message, ensure_ascii=False)
+        Returns:
+            bool: 是否已发送（目标Windows端不在线或全部发送失败时为False）
+        """
+        return self.dispatch_command(message) is not None
+    
+    def dispatch_command(self, message: Union[Dict, MessagePayload], done: Optional[asyncio.Future] = None) -> Optional[ConnectionContext]:
+        """选择Windows端并放入其发送队列
         
-        disconnected = set()
+        指定了target_we_chat_id时只发送给同步了该微信账号的Windows端，否则可以发送给任意Windows端；
+        有多个候选时选择负载最低的一个。
         
-        for client in self.windows_clients:
-            try:
-                # 加密消息（每个连接使用自己的会话密钥）
-                encrypted_message = self._encrypt_message(client, message_json)
-                await client.send_text(encrypted_message)
-                print(f"消息已成功发送到Windows端（已加密，命令类型: {message.get('command_type', 'unknown')}）")
-                break  # 只发送给第一个连接的Windows客户端
-            except Exception as e:
-                print(f"发送消息到Windows端失败: {e}")
-                disconnected.add(client)
-        
-        # 移除断开的连接
-        for client in disconnected:
-            self.disconnect(client)
+        Args:
+            message: command消息
+            done: 可选的发送完成通知
+        
+        Returns:
+            ConnectionContext: 接收命令的Windows端，目标Windows端不在线或全部发送失败时为None
+        """
+        payload = MessagePayload.of(message)
+        message = payload.message
+        target_we_chat_id = message.get("target_we_chat_id") or ""
+        candidates = self.get_windows_clients_by_wxid(target_we_chat_id) if target_we_chat_id else list(self.windows_clients)
+        if not candidates:
+            print(f"{self.offline_error(target_we_chat_id)}（Windows端连接数: {len(self.windows_clients)}, App端连接数: {len(self.app_clients)}, 临时连接数: {len(self.pending_clients)}）")
+            return None
+        
+        # 按负载从低到高尝试，入队失败的慢连接已在 _enqueue 中断开
+        for client in sorted(candidates, key=lambda c: c.load):
+            if self._enqueue(client, self._encrypt_payload(client, payload), False, done):
+                self._track_command(client, message.get("command_id"))
+                print(f"消息已成功发送到Windows端（已加密，命令类型: {message.get('command_type', 'unknown')}, 目标微信账号: {target_we_chat_id or '任意'}, 负载: {client.load}）")
+                return client
+            print("发送消息到Windows端失败: 发送队列已满或连接已关闭")
+        return None
+    
+    @staticmethod
+    def offline_error(target_we_chat_id: Optional[str]) -> str:
+        """目标Windows端不在线时的错误信息"""
+        if target_we_chat_id:
+            return f"目标微信账号 {target_we_chat_id} 的Windows端不在线"
+        return "没有Windows端连接"
+    
+    def _track_command(self, ctx: ConnectionContext, command_id: Optional[str]):
+        """记录已下发给Windows端的命令（计入负载）"""
+        if command_id:
+            ctx.inflight_commands.add(command_id)
+            self._command_owners[command_id] = ctx
+    
+    def command_finished(self, command_id: str):
+        """命令已返回结果（WebSocket或HTTP），从执行该命令的Windows端负载中移除"""
+        ctx = self._command_owners.pop(command_id, None)
+        if ctx is not None:
+            ctx.inflight_commands.discard(command_id)
     
-    async def send_to_app_client(self, message: Dict):
+    async def send_to_app_client(self, message: Union[Dict, MessagePayload]):
         """发送消息到App端（单播）"""
+        payload = MessagePayload.of(message)
         if not self.app_clients:
-            print("没有App端连接，无法转发消息")
+            # 本进程没有App端连接时，交给其他worker进程上的App端
+            if self.bus.publish(ROUTE_APP, BUS_EVENT_APP, payload, one=True):
+                print("已通过消息总线转发消息到其他worker进程上的App端")
+            else:
+                print("没有App端连接，无法转发消息")
             return
-        
-        message_json = json.dumps(message, ensure_ascii=False)
-        
-        disconnected = set()
-        
+        self._send_to_local_app_client(payload)
+    
+    def _send_to_local_app_client(self, payload: MessagePayload):
+        """发送消息到本进程的第一个可用App端"""
+        message = payload.message
         print(f"正在转发消息到App端，App端连接数: {len(self.app_clients)}")
         
-        for client in self.app_clients:
-            try:
-                # 加密消息（每个连接使用自己的会话密钥）
-                encrypted_message = self._encrypt_message(client, message_json)
-                await client.send_text(encrypted_message)
+        for client in list(self.app_clients):
+            # 加密消息（每个连接使用自己的会话密钥）并放入发送队列
+            # 入队失败的慢连接已在 _enqueue 中断开
+            if self._send(client, payload):
                 print(f"消息已成功转发到App端（已加密），消息类型: {message.get('type', 'unknown')}")
                 break  # 只发送给第一个连接的App客户端
-            except Exception as e:
-                print(f"发送消息到App端失败: {e}")
-                disconnected.add(client)
-        
-        # 移除断开的连接
-        for client in disconnected:
-            self.disconnect(client)
+            print("发送消息到App端失败: 发送队列已满或连接已关闭")
+
+    def start_message_bus(self):
+        """开始接收其他worker进程通过消息总线转发的消息"""
+        # 接收发给所有worker进程的广播（如授权缓存失效）
+        self.bus.hold(route_key(ROUTE_WORKERS))
+        self.bus.start(self.handle_bus_message)
+    
+    async def handle_bus_message(self, event: str, payload: Optional[MessagePayload], args: Dict):
+        """处理其他worker进程发布的消息（只投递给本进程的连接，不再发布到总线）"""
+        if event == BUS_EVENT_APP_WXID:
+            recipients = self.get_app_clients_by_wxid(args.get("wxid", ""))
+            if recipients:
+                summary = await self.fan_out(recipients, payload, args.get("bulk") == True)
+                print(f"已转发消息总线消息到 {summary.enqueued} 个App端发送队列（微信账号ID: {args.get('wxid')}）")
+        elif event == BUS_EVENT_CONTACTS:
+            wxid = args.get("wxid", "")
+            # 其他worker进程保存了联系人，本进程的内存状态已过期
+            contact_service.invalidate(wxid)
+            recipients = self.get_app_clients_by_wxid(wxid)
+            if recipients:
+                await self._deliver_contacts(wxid, recipients, payload)
+        elif event == BUS_EVENT_APP_PHONE:
+            recipients = self.get_app_clients_by_phone(args.get("phone", ""))
+            if recipients:
+                summary = await self.fan_out(recipients, payload)
+                print(f"已转发消息总线消息到 {summary.enqueued} 个App端发送队列（手机号: {args.get('phone')}）")
+        elif event == BUS_EVENT_APP:
+            if self.app_clients:
+                self._send_to_local_app_client(payload)
+        elif event == BUS_EVENT_COMMAND:
+            self.dispatch_command(payload)
+        elif event == BUS_EVENT_GET_LOGS:
+            windows_matches = self.get_windows_clients_by_wechat_phone(args.get("phone", ""))
+            if windows_matches:
+                await self._forward_get_logs(windows_matches[0], payload)
+        elif event == BUS_EVENT_DRAIN:
+            self.command_dispatcher.schedule_drain(args.get("wxid", ""))
+        elif event == BUS_EVENT_LICENSE:
+            # 其他worker进程修改了授权（phone为None时清空全部缓存）
+            self.license_cache.invalidate(args.get("phone"), publish=False)
+        else:
+            print(f"未知的消息总线事件: {event}")
 
-    async def _save_account_info_to_db(self, account_data: Dict, websocket: WebSocket = None):
+    async def _save_account_info_to_db(self, account_data: Dict, ctx: Optional[ConnectionContext] = None):
         """保存账号信息到数据库"""
         try:
             if not account_data:
@@ -462,9 +1221,9 @@ class WebSocketManager:
                 print("账号信息缺少手机号，跳过保存")
                 return
             
-            # 如果提供了websocket，验证手机号匹配
-            if websocket and websocket in self.websocket_phone_map:
-                login_phone = self.websocket_phone_map[websocket]
+            # 如果提供了连接上下文，验证手机号匹配
+            if ctx and ctx.phone:
+                login_phone = ctx.phone
                 # 验证绑定的微信手机号是否匹配
                 is_match, error_msg = await LicenseService.verify_wechat_phone_match(login_phone, wechat_phone)
                 if not is_match:
@@ -474,49 +1233,15 @@ class WebSocketManager:
                     # 如果是App端，应该在客户端处理这个错误
                 return
 
-            async with AsyncSessionLocal() as session:
-                # 检查是否已存在
-                stmt = select(AccountInfo).where(AccountInfo.wxid == wxid)
-                result = await session.execute(stmt)
-                existing = result.scalar_one_or_none()
-
-                if existing:
-                    # 更新现有记录
-                    existing.nickname = account_data.get("nickname", existing.nickname)
-                    existing.avatar = account_data.get("avatar", existing.avatar)
-                    existing.account = account_data.get("account", existing.account)
-                    existing.device_id = account_data.get("device_id", existing.device_id)
-                    existing.phone = account_data.get("phone", existing.phone)
-                    existing.wx_user_dir = account_data.get("wx_user_dir", existing.wx_user_dir)
-                    existing.unread_msg_count = account_data.get("unread_msg_count", existing.unread_msg_count)
-                    existing.is_fake_device_id = account_data.get("is_fake_device_id", existing.is_fake_device_id)
-                    existing.pid = account_data.get("pid", existing.pid)
-                    print(f"更新账号信息到数据库: wxid={wxid}")
-                else:
-                    # 创建新记录
-                    account_info = AccountInfo(
-                        wxid=wxid,
-                        nickname=account_data.get("nickname", ""),
-                        avatar=account_data.get("avatar", ""),
-                        account=account_data.get("account", ""),
-                        device_id=account_data.get("device_id", ""),
-                        phone=account_data.get("phone", ""),
-                        wx_user_dir=account_data.get("wx_user_dir", ""),
-                        unread_msg_count=account_data.get("unread_msg_count", 0),
-                        is_fake_device_id=account_data.get("is_fake_device_id", 0),
-                        pid=account_data.get("pid", 0)
-                    )
-                    session.add(account_info)
-                    print(f"保存账号信息到数据库: wxid={wxid}")
-
-                await session.commit()
-                print(f"账号信息已保存到数据库: wxid={wxid}")
+            # 按wxid合并到写缓冲，由后台任务批量写入数据库
+            await account_buffer.put(wxid, account_data)
+            print(f"账号信息已加入写缓冲: wxid={wxid}")
         except Exception as e:
             print(f"保存账号信息到数据库失败: {e}")
             import traceback
             traceback.print_exc()
 
-    async def _handle_login(self, websocket: WebSocket, message: Dict):
+    async def _handle_login(self, ctx: ConnectionContext, message: Dict):
         """处理App端或Windows端登录请求（手机号+授权码）"""
         try:
             phone = message.get("phone", "").strip()
@@ -528,7 +1253,7 @@ class WebSocketManager:
                     "success": False,
                     "message": "手机号不能为空"
                 }, ensure_ascii=False)
-                await websocket.send_text(self._encrypt_message(websocket, response))
+                self._send(ctx, response)
                 return
             
             if not license_key:
@@ -537,7 +1262,7 @@ class WebSocketManager:
                     "success": False,
                     "message": "授权码不能为空"
                 }, ensure_ascii=False)
-                await websocket.send_text(self._encrypt_message(websocket, response))
+                self._send(ctx, response)
                 return
                 
             # 验证授权码
@@ -549,7 +1274,7 @@ class WebSocketManager:
                     "success": False,
                     "message": error_msg or "授权验证失败"
                 }, ensure_ascii=False)
-                await websocket.send_text(self._encrypt_message(websocket, response))
+                self._send(ctx, response)
                 return
             
             # 获取授权信息
@@ -560,11 +1285,11 @@ class WebSocketManager:
                     "success": False,
                     "message": "获取授权信息失败"
                 }, ensure_ascii=False)
-                await websocket.send_text(self._encrypt_message(websocket, response))
+                self._send(ctx, response)
                 return
             
             # 保存WebSocket与登录手机号的映射关系（用于后续验证手机号匹配）
-            self.websocket_phone_map[websocket] = phone
+            self._set_phone(ctx, phone)
             
             # 登录成功，返回授权信息
             response = json.dumps({
@@ -573,7 +1298,7 @@ class WebSocketManager:
                 "message": "登录成功",
                 "has_manage_permission": license_info.has_manage_permission
             }, ensure_ascii=False)
-            await websocket.send_text(self._encrypt_message(websocket, response))
+            self._send(ctx, response)
                 
             print(f"手机号 {phone} 登录成功")
         except Exception as e:
@@ -586,11 +1311,11 @@ class WebSocketManager:
                     "success": False,
                     "message": f"登录失败: {str(e)}"
                 }, ensure_ascii=False)
-                await websocket.send_text(self._encrypt_message(websocket, response))
+                self._send(ctx, response)
             except:
                 pass
     
-    async def _handle_verify_login_code(self, websocket: WebSocket, message: Dict):
+    async def _handle_verify_login_code(self, ctx: ConnectionContext, message: Dict):
         """处理App端或Windows端验证登录码（已废弃，保留用于兼容）"""
         # 此方法已废弃，登录现在直接通过 _handle_login 完成（手机号+授权码）
         response = json.dumps({
@@ -598,9 +1323,9 @@ class WebSocketManager:
             "success": False,
             "message": "请使用手机号+授权码方式登录"
         }, ensure_ascii=False)
-        await websocket.send_text(self._encrypt_message(response))
+        self._send(ctx, response)
     
-    async def _handle_quick_login(self, websocket: WebSocket, message: Dict):
+    async def _handle_quick_login(self, ctx: ConnectionContext, message: Dict):
         """处理App端或Windows端快速登录（使用wxid）"""
         try:
             wxid = message.get("wxid", "").strip()
@@ -610,10 +1335,11 @@ class WebSocketManager:
                     "success": False,
                     "message": "微信账号ID不能为空"
                 }, ensure_ascii=False)
-                await websocket.send_text(self._encrypt_message(websocket, response))
+                self._send(ctx, response)
                 return
             
-            # 验证wxid是否存在
+            # 验证wxid是否存在（账号信息还在写缓冲中时先写入数据库）
+            await account_buffer.ensure_flushed(wxid)
             async with AsyncSessionLocal() as session:
                 stmt = select(AccountInfo).where(AccountInfo.wxid == wxid)
                 result = await session.execute(stmt)
@@ -625,17 +1351,17 @@ class WebSocketManager:
                         "success": False,
                         "message": "微信账号不存在"
                     }, ensure_ascii=False)
-                    await websocket.send_text(self._encrypt_message(websocket, response))
+                    self._send(ctx, response)
                     return
                 
                 # 如果是App端，设置App端的微信账号ID映射
-                if websocket in self.app_clients:
-                    self.app_client_wxid_map[websocket] = wxid
+                if ctx.client_type == CLIENT_TYPE_APP:
+                    self._set_wxid(ctx, wxid)
                 
-                # ========== 维护websocket_phone_map（用于精准转发） ==========
+                # ========== 维护登录手机号索引（用于精准转发） ==========
                 # 从账号信息中提取手机号并保存到映射关系
                 if account_info.phone:
-                    self.websocket_phone_map[websocket] = account_info.phone
+                    self._set_phone(ctx, account_info.phone)
                     print(f"快速登录：已保存手机号映射关系: {account_info.phone}")
                 
                 account_data = {
@@ -658,11 +1384,17 @@ class WebSocketManager:
                 "wxid": wxid,
                 "account_info": account_data
             }, ensure_ascii=False)
-            await websocket.send_text(self._encrypt_message(websocket, response))
+            self._send(ctx, response)
             
             # 判断是App端还是Windows端
-            client_type = "App端" if websocket in self.app_clients else "Windows端"
+            client_type = "App端" if ctx.client_type == CLIENT_TYPE_APP else "Windows端"
             print(f"{client_type}快速登录成功: wxid={wxid}")
+
+            # 补发App端离线期间的消息；上报了本地联系人版本号时，再补发联系人增量（无需Windows端重新同步）
+            if ctx.client_type == CLIENT_TYPE_APP:
+                self._replay_missed(ctx, wxid, message.get("contacts_version") is not None)
+            if ctx.client_type == CLIENT_TYPE_APP and message.get("contacts_version") is not None:
+                await self._send_contacts_since(ctx, wxid, message.get("contacts_version"))
         except Exception as e:
             print(f"快速登录失败: {e}")
             import traceback
@@ -673,7 +1405,7 @@ class WebSocketManager:
                     "success": False,
                     "message": f"快速登录失败: {str(e)}"
                 }, ensure_ascii=False)
-                await websocket.send_text(self._encrypt_message(websocket, response))
+                self._send(ctx, response)
             except:
                 pass
 
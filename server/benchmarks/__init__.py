@@ -0,0 +1 @@
+# 性能基准测试脚本（在server目录下使用 python -m benchmarks.<脚本名> 运行）
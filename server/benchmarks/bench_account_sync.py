@@ -0,0 +1,88 @@
+"""
+账号信息同步基准测试
+模拟多个Windows端反复发送sync_my_info（每次只有未读消息数变化），对比：
+- 逐条写入：写缓冲的写入间隔为0，每条消息执行一次UPSERT事务
+- 写缓冲：按wxid合并更新，定期批量写入
+统计每秒处理的sync_my_info消息数、实际写入的数据库语句数，并确认数据库中保存的是最后一次更新的值。
+
+运行方式（在server目录下）:
+    python -m benchmarks.bench_account_sync [账号数] [每个账号的更新次数]
+"""
+import io
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import contextlib
+
+os.environ.setdefault("MYWECHAT_DATABASE_URL", "sqlite+aiosqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_account.db"))
+
+from sqlalchemy import select, func
+from app.models import database
+from app.models.database import AsyncSessionLocal, AccountInfo
+from app.services import account_buffer as buffer_module
+from app.services.account_buffer import AccountWriteBuffer
+from app.websocket import websocket_manager as manager_module
+from app.websocket.websocket_manager import websocket_manager
+
+
+def build_account(i: int, unread: int) -> dict:
+    return {
+        "wxid": f"wxid_bench_{i:05d}",
+        "nickname": f"用户{i}",
+        "avatar": f"https://example.com/avatar/{i}.jpg",
+        "account": f"account_{i}",
+        "device_id": f"DEVICE-{i:08d}",
+        "phone": f"138{i:08d}",
+        "wx_user_dir": f"C:\\Users\\bench\\WeChat Files\\wxid_bench_{i:05d}",
+        "unread_msg_count": unread,
+        "is_fake_device_id": 0,
+        "pid": 10000 + i,
+    }
+
+
+async def run(label: str, buffer: AccountWriteBuffer, accounts: int, updates: int):
+    async with database.engine.begin() as conn:
+        await conn.run_sync(AccountInfo.__table__.drop, checkfirst=True)
+        await conn.run_sync(AccountInfo.__table__.create)
+    # 替换websocket_manager使用的全局写缓冲
+    manager_module.account_buffer = buffer
+    buffer.start()
+
+    async def windows_client(i: int):
+        for unread in range(updates):
+            await websocket_manager._save_account_info_to_db(build_account(i, unread))
+            # 让出事件循环，模拟消息间隔
+            await asyncio.sleep(0)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        await asyncio.gather(*(windows_client(i) for i in range(accounts)))
+        elapsed = time.perf_counter() - started
+        await buffer.stop()
+
+    async with AsyncSessionLocal() as session:
+        count = await session.scalar(select(func.count()).select_from(AccountInfo))
+        latest = await session.scalar(
+            select(func.count()).select_from(AccountInfo).where(AccountInfo.unread_msg_count == updates - 1)
+        )
+    stats = buffer.get_stats()
+    total = accounts * updates
+    print(f"{label:8s} {total / elapsed:9.0f} 条/s  写入语句 {stats['statements']:6d}  "
+          f"写入次数 {stats['flushes']:6d}  账号数 {count}  最新值正确 {latest == accounts}")
+
+
+async def main():
+    accounts = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    updates = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    with contextlib.redirect_stdout(io.StringIO()):
+        await database.init_db()
+    print(f"账号数: {accounts}, 每个账号更新次数: {updates}, 写入间隔: {buffer_module.ACCOUNT_FLUSH_INTERVAL}s")
+    await run("逐条写入", AccountWriteBuffer(flush_interval=0), accounts, updates)
+    await run("写缓冲", AccountWriteBuffer(), accounts, updates)
+    await database.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""
+加密前压缩基准测试
+使用合成的联系人/朋友圈/公众号批量同步数据，对比不压缩与不同zlib级别压缩后的
+传输体积、CPU耗时（压缩+加密+解密+解压）以及在移动网络带宽下的估算总延迟
+
+运行方式（在server目录下）:
+    python -m benchmarks.bench_compression [联系人数量] [带宽Mbps]
+"""
+import os
+import sys
+import json
+import time
+import zlib
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from app.utils.encryption_service import COMPRESSION_MAGIC
+from benchmarks.bench_forward_serialization import build_contacts_message
+
+
+def build_moments_message(count: int) -> dict:
+    """构造朋友圈同步消息"""
+    return {
+        "type": "sync_moments",
+        "data": [
+            {
+                "we_chat_id": "wxid_benchmark_owner",
+                "moment_id": f"{13900000000000000000 + i}",
+                "friend_id": f"wxid_friend_{i % 500:06d}",
+                "nickname": f"联系人{i % 500}",
+                "content": "今天天气不错，出去走走" if i % 2 else "分享一篇文章",
+                "images": [f"https://szmmsns.qpic.cn/mmsns/{i:08d}/{j}/0" for j in range(i % 4)],
+                "create_time": 1700000000 + i * 60,
+                "like_count": i % 17,
+            }
+            for i in range(count)
+        ],
+    }
+
+
+def build_official_account_message(count: int) -> dict:
+    """构造公众号消息同步数据"""
+    return {
+        "type": "sync_official_account",
+        "data": [
+            {
+                "we_chat_id": "wxid_benchmark_owner",
+                "account_id": f"gh_{i % 50:012d}",
+                "title": f"第{i}期 | 每日资讯精选",
+                "url": f"https://mp.weixin.qq.com/s?__biz=MzA{i % 50:07d}==&mid={2650000000 + i}&idx=1",
+                "cover": f"https://mmbiz.qpic.cn/mmbiz_jpg/{i:010d}/0?wx_fmt=jpeg",
+                "digest": "点击查看今日要闻",
+                "send_time": 1700000000 + i * 3600,
+            }
+            for i in range(count)
+        ],
+    }
+
+
+def round_trip(plain: bytes, level: int, cipher: AESGCM) -> int:
+    """压缩（level为None时不压缩）+ 加密 + 解密 + 解压，返回传输字节数"""
+    body = COMPRESSION_MAGIC + zlib.compress(plain, level) if level is not None else plain
+    nonce = os.urandom(12)
+    frame = nonce + cipher.encrypt(nonce, body, None)
+    decrypted = cipher.decrypt(frame[:12], frame[12:], None)
+    if level is not None:
+        zlib.decompress(decrypted[len(COMPRESSION_MAGIC):])
+    return len(frame)
+
+
+def measure(plain: bytes, level, cipher: AESGCM, rounds: int = 10):
+    """返回(传输字节数, 每次往返CPU毫秒)"""
+    size = round_trip(plain, level, cipher)
+    start = time.process_time()
+    for _ in range(rounds):
+        round_trip(plain, level, cipher)
+    return size, (time.process_time() - start) * 1000 / rounds
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    bandwidth_mbps = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    bytes_per_ms = bandwidth_mbps * 1000 * 1000 / 8 / 1000
+    cipher = AESGCM(os.urandom(32))
+
+    payloads = [
+        ("sync_contacts", build_contacts_message(count)),
+        ("sync_moments", build_moments_message(count)),
+        ("sync_official_account", build_official_account_message(count)),
+    ]
+
+    print(f"数据条数: {count}, 估算带宽: {bandwidth_mbps} Mbps")
+    for message_type, message in payloads:
+        plain = json.dumps(message, ensure_ascii=False).encode("utf-8")
+        print(f"\n{message_type}（明文 {len(plain) / 1024:.1f} KB）")
+        print(f"  {'方式':<10}{'传输体积':>12}{'压缩率':>10}{'CPU':>12}{'传输':>12}{'总延迟':>12}")
+        for label, level in (("不压缩", None), ("zlib-1", 1), ("zlib-6", 6)):
+            size, cpu_ms = measure(plain, level, cipher)
+            transfer_ms = size / bytes_per_ms
+            print(f"  {label:<10}{size / 1024:>10.1f}KB{size / len(plain):>10.3f}{cpu_ms:>10.2f}ms{transfer_ms:>10.1f}ms{cpu_ms + transfer_ms:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+转发序列化基准测试
+对比旧转发路径（每个接收方重新json.dumps + 每次新建AESGCM + 外层json.dumps）
+与序列化一次的转发路径（复用明文字节 + 每个接收方的会话加密上下文 + 直接拼接外层包装，同WebSocketManager._encrypt_payload）
+在转发一批联系人数据时的CPU耗时
+
+运行方式（在server目录下）:
+    python -m benchmarks.bench_forward_serialization [联系人数量] [接收方数量] [轮数]
+"""
+import os
+import sys
+import json
+import time
+import base64
+import secrets
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from app.utils.session_crypto import SessionCrypto
+from app.websocket.message_payload import MessagePayload
+
+
+def build_contacts_message(count: int) -> dict:
+    """构造联系人同步消息"""
+    return {
+        "type": "sync_contacts",
+        "data": [
+            {
+                "we_chat_id": "wxid_benchmark_owner",
+                "friend_id": f"wxid_friend_{i:06d}",
+                "nickname": f"联系人{i}",
+                "remark": f"备注{i}",
+                "avatar": f"https://wx.qlogo.cn/mmhead/ver_1/{i:08d}/132",
+                "province": "广东",
+                "city": "深圳",
+                "sex": i % 3,
+            }
+            for i in range(count)
+        ],
+    }
+
+
+def legacy_forward(message: dict, keys: list) -> int:
+    """旧路径：每个接收方都重新序列化、重新编码、重新构建AESGCM"""
+    total = 0
+    for key in keys:
+        message_json = json.dumps(message, ensure_ascii=False)
+        nonce = secrets.token_bytes(12)
+        encrypted = nonce + AESGCM(key).encrypt(nonce, message_json.encode("utf-8"), None)
+        wrapper = json.dumps({"encrypted": True, "data": base64.b64encode(encrypted).decode("utf-8")}, ensure_ascii=False)
+        total += len(wrapper)
+    return total
+
+
+def pipelined_forward(raw_text: str, message: dict, sessions: list) -> int:
+    """新路径：明文只编码一次，每个接收方只做AES-GCM加密"""
+    payload = MessagePayload(message, raw_text)
+    total = 0
+    for crypto in sessions:
+        encrypted = crypto.encrypt_b64(payload.data)
+        wrapper = '{"encrypted": true, "data": "' + encrypted + '"}'
+        total += len(wrapper)
+    return total
+
+
+def measure(func, *args, rounds: int) -> float:
+    """返回每轮平均CPU耗时（毫秒）"""
+    func(*args)
+    start = time.process_time()
+    for _ in range(rounds):
+        func(*args)
+    return (time.process_time() - start) * 1000 / rounds
+
+
+def main():
+    contact_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    recipient_count = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    message = build_contacts_message(contact_count)
+    # 模拟main.py中客户端发来的解密后明文
+    raw_text = json.dumps(message, ensure_ascii=False)
+    keys = [os.urandom(32) for _ in range(recipient_count)]
+    sessions = [SessionCrypto(f"bench_{i}", key) for i, key in enumerate(keys)]
+
+    legacy_ms = measure(legacy_forward, message, keys, rounds=rounds)
+    pipelined_ms = measure(pipelined_forward, raw_text, message, sessions, rounds=rounds)
+
+    print(f"联系人数量: {contact_count}, 接收方数量: {recipient_count}, 明文大小: {len(raw_text.encode('utf-8')) / 1024:.1f} KB")
+    print(f"旧转发路径:     {legacy_ms:8.2f} ms/批次  ({legacy_ms * 1000 / contact_count:.2f} µs/联系人)")
+    print(f"序列化一次路径: {pipelined_ms:8.2f} ms/批次  ({pipelined_ms * 1000 / contact_count:.2f} µs/联系人)")
+    print(f"节省CPU:        {legacy_ms - pipelined_ms:8.2f} ms/批次  ({(1 - pipelined_ms / legacy_ms) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
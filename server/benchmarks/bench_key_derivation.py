@@ -0,0 +1,100 @@
+"""
+机器ID密钥派生基准测试
+模拟一批get_logs命令结果（多台机器，每台机器多次上报），对比在事件循环中同步派生密钥（旧路径）
+与线程池派生 + LRU缓存 + 并发合并（KeyDerivationService）时的事件循环延迟
+
+事件循环延迟：每1毫秒唤醒一次的探测任务实际被唤醒的时间比预期晚多少，
+代表同一时刻所有WebSocket连接的消息处理会被推迟多久
+
+运行方式（在server目录下）:
+    python -m benchmarks.bench_key_derivation [结果数量] [机器数量]
+"""
+import sys
+import time
+import asyncio
+from typing import List
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+from app.utils.key_derivation import KeyDerivationService
+
+
+class LoopLagMonitor:
+    """事件循环延迟探测"""
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.lags: List[float] = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(loop.time() - expected, 0.0))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def summary(self) -> str:
+        if not self.lags:
+            return "无数据"
+        lags = sorted(self.lags)
+        p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+        return f"最大 {lags[-1] * 1000:7.1f}ms  p99 {p99 * 1000:7.1f}ms  平均 {sum(lags) / len(lags) * 1000:6.2f}ms"
+
+
+def derive_on_loop(machine_id: str) -> bytes:
+    """旧路径：每个结果都在事件循环中执行一次PBKDF2"""
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=b"MyWeChat_Encryption_Salt_2024", iterations=100000)
+    return kdf.derive(machine_id.encode("utf-8"))
+
+
+async def handle_results_on_loop(machine_ids: List[str]):
+    for machine_id in machine_ids:
+        derive_on_loop(machine_id)
+        # 每个HTTP请求之间让出事件循环
+        await asyncio.sleep(0)
+
+
+async def handle_results_with_service(machine_ids: List[str], service: KeyDerivationService):
+    await asyncio.gather(*(service.get_machine_key(machine_id) for machine_id in machine_ids))
+
+
+async def measure(label: str, coroutine):
+    monitor = LoopLagMonitor()
+    monitor.start()
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await coroutine
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+    print(f"  {label:<18}耗时 {elapsed * 1000:8.1f}ms  事件循环延迟: {monitor.summary()}")
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    machines = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    machine_ids = [f"00:1A:2B:3C:4D:{i % machines:02X}-BFEBFBFF000906EA" for i in range(count)]
+
+    print(f"get_logs结果数量: {count}, 机器数量: {machines}")
+    await measure("事件循环中派生", handle_results_on_loop(machine_ids))
+    service = KeyDerivationService()
+    await measure("线程池+缓存(冷)", handle_results_with_service(machine_ids, service))
+    await measure("线程池+缓存(热)", handle_results_with_service(machine_ids, service))
+    service.shutdown()
+    print(f"  统计: {service.get_stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+"""
+重连风暴密钥交换负载测试
+模拟服务器重启或网络抖动后大量客户端同时重连：每个客户端建立WebSocket连接后立即发送session_key，
+统计从发送session_key到收到key_exchange_success的时间，以及期间的事件循环延迟（同一时刻其他连接的消息会被推迟多久）。
+对比在事件循环中直接解密（旧路径）与在私钥运算执行器中解密
+
+运行方式（在server目录下）:
+    python -m benchmarks.bench_key_exchange [客户端数量]
+"""
+import io
+import os
+import sys
+import time
+import json
+import base64
+import asyncio
+import contextlib
+from typing import List, Optional
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+
+from app.utils.rsa_key_manager import rsa_key_manager, rsa_executor
+from app.websocket.websocket_manager import WebSocketManager
+from benchmarks.bench_key_derivation import LoopLagMonitor
+
+
+class SimulatedClient:
+    """模拟的WebSocket客户端（记录收到key_exchange_success的时间）"""
+
+    def __init__(self, encrypted_key: str):
+        self.encrypted_key = encrypted_key
+        self.sent_at = 0.0
+        self.exchanged_at: Optional[float] = None
+        self.exchanged = asyncio.Event()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        if self.exchanged_at is None and "key_exchange_success" in text:
+            self.exchanged_at = time.perf_counter()
+            self.exchanged.set()
+
+    async def send_bytes(self, data: bytes):
+        pass
+
+    async def close(self, code: int = 1000, reason: Optional[str] = None):
+        self.exchanged.set()
+
+
+def encrypt_session_keys(count: int) -> List[str]:
+    """客户端使用服务器公钥加密随机会话密钥"""
+    public_key = serialization.load_pem_public_key(rsa_key_manager.get_public_key_pem().encode("utf-8"))
+    oaep = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+    return [base64.b64encode(public_key.encrypt(os.urandom(32), oaep)).decode("ascii") for _ in range(count)]
+
+
+async def reconnect(manager: WebSocketManager, client: SimulatedClient):
+    await manager.connect(client)
+    client.sent_at = time.perf_counter()
+    await manager.handle_message(client, {"type": "session_key", "encrypted_key": client.encrypted_key})
+    await client.exchanged.wait()
+
+
+async def run_storm(label: str, encrypted_keys: List[str]):
+    manager = WebSocketManager()
+    clients = [SimulatedClient(key) for key in encrypted_keys]
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(reconnect(manager, client) for client in clients))
+        elapsed = time.perf_counter() - started
+        await monitor.stop()
+        for client in clients:
+            manager.disconnect(client)
+
+    times = sorted(client.exchanged_at - client.sent_at for client in clients if client.exchanged_at)
+    failed = len(clients) - len(times)
+    p50 = times[len(times) // 2] if times else 0.0
+    p99 = times[min(len(times) - 1, int(len(times) * 0.99))] if times else 0.0
+    print(f"\n{label}")
+    print(f"  全部完成 {elapsed * 1000:8.1f}ms  密钥交换耗时: p50 {p50 * 1000:7.1f}ms  p99 {p99 * 1000:7.1f}ms  "
+          f"最大 {(times[-1] if times else 0.0) * 1000:7.1f}ms  失败 {failed}")
+    print(f"  事件循环延迟: {monitor.summary()}")
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print(f"客户端数量: {count}, 私钥运算线程数: {rsa_executor.max_workers}")
+    encrypted_keys = encrypt_session_keys(count)
+
+    # 旧路径：在事件循环中直接解密
+    executor_decrypt = rsa_key_manager.decrypt_session_key_async
+
+    async def decrypt_on_loop(encrypted_key_b64: str) -> bytes:
+        return rsa_key_manager.decrypt_session_key(encrypted_key_b64)
+
+    rsa_key_manager.decrypt_session_key_async = decrypt_on_loop
+    await run_storm("事件循环中解密", encrypted_keys)
+
+    rsa_key_manager.decrypt_session_key_async = executor_decrypt
+    await run_storm("私钥运算执行器", encrypted_keys)
+    print(f"  执行器统计: {json.dumps(rsa_executor.get_stats(), ensure_ascii=False)}")
+    rsa_executor.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+"""
+跨worker授权撤销基准测试
+两个WebSocketManager模拟两个worker，各自有独立的授权缓存，通过真实的总线代理（Unix域套接字）连接。
+每轮在worker A上撤销一个授权（更新数据库并使缓存失效），统计worker B的缓存多久之后读到撤销状态：
+- 不通过总线通知：worker B在缓存有效期内仍读到有效的授权
+- 通过总线通知：worker B收到失效通知后重新查询数据库
+
+运行方式（在server目录下）:
+    python -m benchmarks.bench_license_revocation [轮数]
+"""
+import io
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import contextlib
+from datetime import datetime, timedelta
+from typing import List
+
+os.environ.setdefault("MYWECHAT_DATABASE_URL", "sqlite+aiosqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_license.db"))
+
+from sqlalchemy import update
+from app.models import database
+from app.models.database import AsyncSessionLocal, UserLicense
+from app.services.license_service import LicenseCache
+from app.websocket.message_bus import MessageBroker, MessageBus, BrokerMessageBus, route_key, ROUTE_WORKERS
+from app.websocket.websocket_manager import WebSocketManager
+
+# 等待worker B读到撤销状态的最长时间（秒）
+WAIT_LIMIT = 0.2
+
+
+async def create_licenses(phones: List[str]):
+    async with AsyncSessionLocal() as session:
+        session.add_all([
+            UserLicense(
+                phone=phone, license_key=f"KEY{i:017d}", status="active",
+                expire_date=datetime.utcnow() + timedelta(days=365)
+            )
+            for i, phone in enumerate(phones)
+        ])
+        await session.commit()
+
+
+async def revoke(cache: LicenseCache, phone: str):
+    """与授权管理接口相同：更新数据库后使缓存失效"""
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(UserLicense).where(UserLicense.phone == phone).values(status="revoked"))
+        await session.commit()
+    cache.invalidate(phone)
+
+
+async def measure(cache_a: LicenseCache, cache_b: LicenseCache, phones: List[str]) -> List[float]:
+    """逐个撤销授权，返回worker B读到撤销状态的时间（超过WAIT_LIMIT仍未读到时为None）"""
+    times = []
+    for phone in phones:
+        # 两个worker都已缓存有效的授权
+        await cache_a.get(phone)
+        await cache_b.get(phone)
+        started = time.perf_counter()
+        await revoke(cache_a, phone)
+        while (await cache_b.get(phone)).status != "revoked":
+            if time.perf_counter() - started > WAIT_LIMIT:
+                times.append(None)
+                break
+            await asyncio.sleep(0)
+        else:
+            times.append(time.perf_counter() - started)
+    return times
+
+
+def report(label: str, times: List[float]):
+    seen = sorted(t for t in times if t is not None)
+    line = f"  {label}: 撤销生效 {len(seen)}/{len(times)}"
+    if seen:
+        p50 = seen[len(seen) // 2]
+        p99 = seen[min(len(seen) - 1, int(len(seen) * 0.99))]
+        line += f"  p50 {p50 * 1e3:7.2f}ms  p99 {p99 * 1e3:7.2f}ms"
+    print(line)
+
+
+async def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    address = "unix:" + os.path.join(tempfile.mkdtemp(), "bench_bus.sock")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        await database.init_db()
+        server = await MessageBroker("bench").start(address)
+        bus_a = BrokerMessageBus(address, "bench", "worker-a")
+        bus_b = BrokerMessageBus(address, "bench", "worker-b")
+        worker_a = WebSocketManager(bus=bus_a)
+        worker_b = WebSocketManager(bus=bus_b)
+        worker_a.license_cache = LicenseCache(bus=bus_a)
+        worker_b.license_cache = LicenseCache(bus=bus_b)
+        worker_a.start_message_bus()
+        worker_b.start_message_bus()
+        await asyncio.gather(bus_a.ready.wait(), bus_b.ready.wait())
+        # 等待两个worker都收到对方的广播订阅
+        while not (bus_a.has_remote(route_key(ROUTE_WORKERS)) and bus_b.has_remote(route_key(ROUTE_WORKERS))):
+            await asyncio.sleep(0.01)
+
+    local_phones = [f"137{i:08d}" for i in range(rounds)]
+    bus_phones = [f"138{i:08d}" for i in range(rounds)]
+    await create_licenses(local_phones + bus_phones)
+
+    print(f"轮数: {rounds}, 缓存有效期: {worker_b.license_cache.ttl}s, 等待上限: {WAIT_LIMIT}s")
+    with contextlib.redirect_stdout(io.StringIO()):
+        # 不通过总线通知（与只在本进程失效相同）
+        without_bus = await measure(LicenseCache(bus=MessageBus()), LicenseCache(bus=MessageBus()), local_phones)
+        with_bus = await measure(worker_a.license_cache, worker_b.license_cache, bus_phones)
+    report("只在本进程失效", without_bus)
+    report("总线通知失效  ", with_bus)
+    print(f"\nworker B授权缓存统计: {worker_b.license_cache.get_stats()}")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        await bus_a.stop()
+        await bus_b.stop()
+        server.close()
+        await asyncio.sleep(0.1)
+    await database.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
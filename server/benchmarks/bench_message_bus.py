@@ -0,0 +1,148 @@
+"""
+跨worker转发延迟基准测试
+对比Windows端和App端连接在同一个worker进程时的转发延迟，与连接在不同worker进程、
+经过消息总线代理（Unix域套接字）转发时的延迟。
+
+两个WebSocketManager模拟两个worker，各自通过独立的总线连接连到真实的总线代理；
+为便于计时，它们和代理运行在同一个事件循环中，因此跨worker延迟包含两端和代理的全部CPU耗时
+（实际部署中三者在不同进程中并行处理）。
+统计从Windows端消息进入handle_payload到App端连接写出加密消息的时间。
+
+运行方式（在server目录下）:
+    python -m benchmarks.bench_message_bus [轮数] [每条消息的数据条数]
+"""
+import io
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import contextlib
+from typing import List, Optional
+
+from app.websocket.message_bus import MessageBroker, BrokerMessageBus, route_key, ROUTE_APP_WXID
+from app.websocket.message_payload import MessagePayload
+from app.websocket.websocket_manager import WebSocketManager
+
+
+class SimulatedClient:
+    """模拟的WebSocket客户端（记录收到消息的时间）"""
+
+    def __init__(self):
+        self.received = asyncio.Event()
+        self.received_at = 0.0
+        self.ready = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self._record()
+
+    async def send_bytes(self, data: bytes):
+        self._record()
+
+    def _record(self):
+        if self.ready:
+            self.received_at = time.perf_counter()
+            self.received.set()
+
+    async def close(self, code: int = 1000, reason: Optional[str] = None):
+        pass
+
+
+def build_moments_message(wxid: str, count: int) -> dict:
+    """构造朋友圈同步消息（只转发，不访问数据库）"""
+    return {
+        "type": "sync_moments",
+        "data": [
+            {
+                "we_chat_id": wxid,
+                "moment_id": f"{13900000000000000000 + i}",
+                "friend_id": f"wxid_friend_{i:06d}",
+                "content": "今天天气不错，出去走走",
+                "create_time": 1700000000 + i * 60,
+            }
+            for i in range(count)
+        ],
+    }
+
+
+async def register(manager: WebSocketManager, client: SimulatedClient, client_type: str, wxid: Optional[str] = None):
+    """注册连接并设置会话密钥（跳过RSA密钥交换）"""
+    await manager.connect(client)
+    ctx = manager.get_context(client)
+    ctx.set_session_key(os.urandom(32))
+    await manager.handle_message(client, {"type": "client_type", "client_type": client_type})
+    if wxid:
+        manager._set_wxid(ctx, wxid)
+    return ctx
+
+
+async def measure(manager: WebSocketManager, windows: SimulatedClient, app: SimulatedClient, text: str, rounds: int) -> List[float]:
+    """逐条发送消息并等待App端收到，返回每条消息的延迟"""
+    times = []
+    app.ready = True
+    for _ in range(rounds):
+        app.received.clear()
+        started = time.perf_counter()
+        await manager.handle_payload(windows, MessagePayload.decode(text.encode("utf-8")))
+        await app.received.wait()
+        times.append(app.received_at - started)
+    app.ready = False
+    return sorted(times)
+
+
+def report(label: str, times: List[float]):
+    p50 = times[len(times) // 2]
+    p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+    print(f"  {label}: 平均 {sum(times) / len(times) * 1e6:8.1f}us  p50 {p50 * 1e6:8.1f}us  p99 {p99 * 1e6:8.1f}us")
+
+
+async def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    items = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    address = "unix:" + os.path.join(tempfile.mkdtemp(), "bench_bus.sock")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = await MessageBroker("bench").start(address)
+        bus_a = BrokerMessageBus(address, "bench", "worker-a")
+        bus_b = BrokerMessageBus(address, "bench", "worker-b")
+        worker_a = WebSocketManager(bus=bus_a)
+        worker_b = WebSocketManager(bus=bus_b)
+        worker_a.start_message_bus()
+        worker_b.start_message_bus()
+        await asyncio.gather(bus_a.ready.wait(), bus_b.ready.wait())
+
+        windows = SimulatedClient()
+        local_app = SimulatedClient()
+        remote_app = SimulatedClient()
+        await register(worker_a, windows, "windows")
+        await register(worker_a, local_app, "app", "wxid_same_worker")
+        await register(worker_b, remote_app, "app", "wxid_other_worker")
+        # 等待worker A收到worker B的订阅
+        while not bus_a.has_remote(route_key(ROUTE_APP_WXID, "wxid_other_worker")):
+            await asyncio.sleep(0.01)
+
+    print(f"轮数: {rounds}, 每条消息数据条数: {items}, 总线地址: {address}")
+    for count in (1, items):
+        same = MessagePayload(build_moments_message("wxid_same_worker", count)).text
+        other = MessagePayload(build_moments_message("wxid_other_worker", count)).text
+        print(f"\n消息大小: {len(same.encode('utf-8'))} 字节")
+        with contextlib.redirect_stdout(io.StringIO()):
+            same_times = await measure(worker_a, windows, local_app, same, rounds)
+            other_times = await measure(worker_a, windows, remote_app, other, rounds)
+        report("同一worker  ", same_times)
+        report("跨worker转发", other_times)
+
+    print(f"\n总线统计: worker A {bus_a.get_stats()}")
+    with contextlib.redirect_stdout(io.StringIO()):
+        await bus_a.stop()
+        await bus_b.stop()
+        server.close()
+        # 等待代理处理完worker断开
+        await asyncio.sleep(0.1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""
+HTTP会话过期基准测试
+按模拟时钟以每小时10万个会话的速度持续创建会话（每个会话在创建后几分钟内使用几次），
+由清扫任务按间隔清理过期会话，之后停止创建会话（只剩空闲会话）。
+每隔半小时（模拟时间）输出会话存储中的会话数、本地缓存数、Python堆内存和清扫耗时，
+内存应在稳定后保持不变，停止创建后回落。
+
+运行方式（在server目录下）:
+    python -m benchmarks.bench_session_churn [每小时会话数] [创建会话的小时数]
+"""
+import io
+import os
+import sys
+import time
+import heapq
+import random
+import asyncio
+import tempfile
+import tracemalloc
+import contextlib
+
+from app.utils import http_session_manager as session_module
+from app.utils.http_session_manager import HTTPSessionManager, SESSION_SWEEP_INTERVAL
+from app.utils.session_store import MemorySessionStore, SQLiteSessionStore
+
+
+class SimulatedClock:
+    """模拟时钟（替换会话管理器模块中的time，perf_counter仍使用真实时间）"""
+
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return time.perf_counter()
+
+
+async def run(label: str, store, per_hour: int, hours: float):
+    clock = SimulatedClock()
+    session_module.time = clock
+    manager = HTTPSessionManager(store)
+    rng = random.Random(1)
+    step = 3600 / per_hour
+    # 待使用的会话：(使用时间, session_id)
+    pending = []
+    next_sweep = clock.now + SESSION_SWEEP_INTERVAL
+    next_report = clock.now
+    end_create = clock.now + hours * 3600
+    end = end_create + 2 * 3600
+
+    tracemalloc.start()
+    print(f"\n{label}（每小时 {per_hour} 个会话，创建 {hours} 小时后空闲2小时）")
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()) as quiet:
+        while clock.now < end:
+            if clock.now < end_create:
+                session_id = await manager.create_session(os.urandom(32))
+                for _ in range(3):
+                    heapq.heappush(pending, (clock.now + rng.uniform(0, 300), session_id))
+            while pending and pending[0][0] <= clock.now:
+                await manager.get_session_crypto(heapq.heappop(pending)[1])
+            while clock.now >= next_sweep:
+                await manager.expire_sessions()
+                next_sweep += SESSION_SWEEP_INTERVAL
+            if clock.now >= next_report:
+                # 丢弃被屏蔽的日志输出，不计入内存
+                quiet.seek(0)
+                quiet.truncate(0)
+                current, _ = tracemalloc.get_traced_memory()
+                stats = await manager.get_stats()
+                with contextlib.redirect_stdout(sys.__stdout__):
+                    print(f"  {(clock.now - end_create + hours * 3600) / 3600:4.1f}h  会话 {stats['sessions']:7d}  "
+                          f"缓存 {stats['cached']:6d}  内存 {current / 1024 / 1024:7.1f}MB  "
+                          f"清扫 {stats['last_sweep_ms']:7.2f}ms  过期 {stats['expired']:7d}  淘汰 {stats['evicted']:5d}")
+                next_report += 1800
+            clock.now += step if clock.now < end_create else SESSION_SWEEP_INTERVAL
+    tracemalloc.stop()
+    print(f"  实际耗时 {time.perf_counter() - started:.1f}s")
+
+
+async def main():
+    per_hour = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    hours = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+    await run("进程内会话存储", MemorySessionStore(), per_hour, hours)
+    await run("SQLite会话存储", SQLiteSessionStore(os.path.join(tempfile.mkdtemp(), "sessions.db")), per_hour, hours)
+    session_module.time = time
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""
+会话加密上下文微基准测试
+对比小聊天消息（约200字节）每条消息的加解密开销：
+旧路径（按连接ID查会话密钥、每次新建AESGCM、每次读取系统随机数生成nonce）
+与会话加密上下文（预先构建的AESGCM + 随机nonce）
+
+运行方式（在server目录下）:
+    python -m benchmarks.bench_session_crypto [消息数量]
+"""
+import sys
+import json
+import time
+import base64
+import secrets
+import timeit
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from app.utils.session_crypto import SessionCrypto
+
+
+def build_chat_message() -> bytes:
+    """构造一条小聊天消息"""
+    return json.dumps({
+        "type": "sync_chat_message",
+        "data": {
+            "MsgId": "7312345678901234567",
+            "MsgText": "晚上一起吃饭吗？",
+            "SendWxId": "wxid_benchmark_owner",
+            "ReceiveWxId": "wxid_friend_000001",
+            "SendType": 1,
+            "SendTime": "2026-10-16T20:00:00",
+        },
+    }, ensure_ascii=False).encode("utf-8")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    plain = build_chat_message()
+    key = secrets.token_bytes(32)
+    session_keys = {"connection": key}
+    crypto = SessionCrypto("connection", key)
+
+    def old_encrypt() -> str:
+        session_key = session_keys.get("connection")
+        nonce = secrets.token_bytes(12)
+        return base64.b64encode(nonce + AESGCM(session_key).encrypt(nonce, plain, None)).decode("utf-8")
+
+    def new_encrypt() -> str:
+        return crypto.encrypt_b64(plain)
+
+    encrypted = new_encrypt()
+
+    def old_decrypt() -> bytes:
+        session_key = session_keys.get("connection")
+        data = base64.b64decode(encrypted)
+        return AESGCM(session_key).decrypt(data[:12], data[12:], None)
+
+    def new_decrypt() -> bytes:
+        return crypto.decrypt_b64(encrypted)
+
+    assert old_decrypt() == new_decrypt() == plain
+
+    print(f"消息大小: {len(plain)} 字节, 消息数量: {count}")
+    print(f"  {'操作':<8}{'旧路径':>14}{'会话上下文':>14}{'节省':>10}")
+    for label, old, new in (("加密", old_encrypt, new_encrypt), ("解密", old_decrypt, new_decrypt)):
+        old_seconds = min(timeit.repeat(old, number=count, repeat=3))
+        new_seconds = min(timeit.repeat(new, number=count, repeat=3))
+        old_us = old_seconds / count * 1e6
+        new_us = new_seconds / count * 1e6
+        print(f"  {label:<8}{old_us:>12.2f}us{new_us:>12.2f}us{(1 - new_us / old_us) * 100:>9.1f}%")
+
+    started = time.perf_counter()
+    for _ in range(count):
+        crypto.decrypt_b64(crypto.encrypt_b64(plain))
+    elapsed = time.perf_counter() - started
+    print(f"  会话上下文往返吞吐: {count / elapsed:,.0f} 条/秒, 计数: {crypto.get_stats()}")
+
+
+if __name__ == "__main__":
+    main()
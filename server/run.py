@@ -1,14 +1,70 @@
 """
 服务器启动脚本
+
+    python run.py                 # 单进程，开启热重载（开发）
+    python run.py --workers 4     # 启动4个worker进程（HTTP会话保存在共享的SQLite会话存储中，
+                                  # WebSocket消息通过主进程中的消息总线代理在worker之间转发）
 """
+import os
+import asyncio
+import argparse
+import threading
 import uvicorn
 
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="MyWeChat后端服务")
+    parser.add_argument("--host", default=os.getenv("MYWECHAT_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MYWECHAT_PORT", "8000")))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("MYWECHAT_WORKERS", "1")),
+        help="worker进程数（大于1时不能热重载）"
+    )
+    parser.add_argument("--no-reload", action="store_true", help="单进程运行时关闭热重载")
+    return parser.parse_args()
+
+
+def start_message_broker(address: str):
+    """在主进程的后台线程中运行消息总线代理（worker进程启动后连接）"""
+    from app.websocket.message_bus import MessageBroker
+    broker = MessageBroker(os.environ["MYWECHAT_BUS_TOKEN"])
+    started = threading.Event()
+
+    async def serve():
+        server = await broker.start(address)
+        started.set()
+        async with server:
+            await server.serve_forever()
+
+    threading.Thread(target=lambda: asyncio.run(serve()), name="message-broker", daemon=True).start()
+    if not started.wait(10):
+        raise RuntimeError(f"消息总线代理启动失败: {address}")
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    workers = max(1, args.workers)
+
+    if workers > 1:
+        # worker进程继承环境变量：会话存储默认使用共享的SQLite文件
+        os.environ["MYWECHAT_WORKERS"] = str(workers)
+        os.environ.setdefault("MYWECHAT_SESSION_STORE", "sqlite")
+        # 在启动worker前加载或生成RSA密钥对，避免多个worker同时生成不同的密钥
+        from app.utils.rsa_key_manager import rsa_key_manager
+        rsa_key_manager.get_public_key_pem()
+        # 启动消息总线代理，worker进程通过继承的环境变量连接
+        from app.websocket.message_bus import default_address, new_token
+        os.environ.setdefault("MYWECHAT_BUS_ADDRESS", default_address(args.port))
+        os.environ.setdefault("MYWECHAT_BUS_TOKEN", new_token())
+        start_message_broker(os.environ["MYWECHAT_BUS_ADDRESS"])
+        print(f"启动 {workers} 个worker进程，HTTP会话存储: {os.environ['MYWECHAT_SESSION_STORE']}，"
+              f"消息总线: {os.environ['MYWECHAT_BUS_ADDRESS']}")
+
     uvicorn.run(
         "app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        reload=workers == 1 and not args.no_reload,
         log_level="info"
     )
-
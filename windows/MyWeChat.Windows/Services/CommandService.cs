@@ -442,13 +442,22 @@ namespace MyWeChat.Windows.Services
                     return;
                 }
 
-                // 读取最新的日志文件（保持加密状态）
                 var latestLogFile = logFiles[0];
-                string encryptedLogContent = await File.ReadAllTextAsync(latestLogFile.FullName);
 
                 // 获取机器特征（用于服务端生成密钥）
                 string machineId = KeyDerivationService.GetMachineId();
 
+                // 以流的方式上传日志文件（保持加密状态），服务端边接收边解密保存；
+                // 服务器已保存过同一日志文件时只上传之后新增的部分
+                long offset = GetLogUploadOffset(command, latestLogFile);
+                if (await UploadLogFileAsync(command.CommandId, latestLogFile, machineId, offset))
+                {
+                    return;
+                }
+
+                // 旧版本服务端不支持上传日志，在命令结果中返回整个日志
+                string encryptedLogContent = await File.ReadAllTextAsync(latestLogFile.FullName);
+
                 // 构建返回结果
                 var result = new
                 {
@@ -467,6 +476,88 @@ namespace MyWeChat.Windows.Services
             }
         }
 
+        /// <summary>
+        /// 获取日志上传的起始偏移（get_logs命令数据中服务器返回的日志文件名和偏移，日志文件已切换或被截断时从头上传）
+        /// </summary>
+        private static long GetLogUploadOffset(CommandInfo command, FileInfo logFile)
+        {
+            if (string.IsNullOrEmpty(command.CommandData))
+            {
+                return 0;
+            }
+
+            try
+            {
+                var commandData = Newtonsoft.Json.Linq.JObject.Parse(command.CommandData);
+                string? logFileName = commandData.Value<string>("log_file_name");
+                long offset = commandData.Value<long?>("offset") ?? 0;
+                if (logFileName == logFile.Name && offset > 0 && offset <= logFile.Length)
+                {
+                    return offset;
+                }
+            }
+            catch
+            {
+                // 命令数据格式不正确时从头上传
+            }
+            return 0;
+        }
+
+        /// <summary>
+        /// 上传日志文件从offset字节开始的内容到服务器（服务端解密保存后将命令标记为完成）
+        /// </summary>
+        /// <returns>是否已上传；服务端不支持上传日志时返回false</returns>
+        private async Task<bool> UploadLogFileAsync(string commandId, FileInfo logFile, string machineId, long offset = 0)
+        {
+            if (string.IsNullOrEmpty(_serverUrl) || string.IsNullOrEmpty(commandId))
+            {
+                return false;
+            }
+
+            using (var httpClient = new HttpClient())
+            // 日志文件可能正在被写入，允许共享读写
+            using (var stream = new FileStream(logFile.FullName, FileMode.Open, FileAccess.Read, FileShare.ReadWrite))
+            {
+                httpClient.Timeout = TimeSpan.FromMinutes(5);
+
+                stream.Seek(offset, SeekOrigin.Begin);
+                string url = $"{_serverUrl}/api/commands/{commandId}/logs" +
+                    $"?machine_id={Uri.EscapeDataString(machineId)}&log_file_name={Uri.EscapeDataString(logFile.Name)}&offset={offset}";
+                var content = new StreamContent(stream, 81920);
+                content.Headers.ContentType = new System.Net.Http.Headers.MediaTypeHeaderValue("text/plain");
+
+                HttpResponseMessage response = await httpClient.PostAsync(url, content);
+                if (response.StatusCode == System.Net.HttpStatusCode.NotFound || response.StatusCode == System.Net.HttpStatusCode.MethodNotAllowed)
+                {
+                    Logger.LogWarning($"服务器不支持上传日志，改为在命令结果中返回: {commandId}");
+                    return false;
+                }
+                if (response.StatusCode == System.Net.HttpStatusCode.Gone)
+                {
+                    // 命令已结束（如已超期），服务器不再接收结果，无需重新上传或返回错误
+                    Logger.LogWarning($"命令已结束，不再上传日志: {commandId}");
+                    return true;
+                }
+                if (response.StatusCode == System.Net.HttpStatusCode.Conflict && offset > 0)
+                {
+                    // 服务器记录的偏移已变化，从头上传
+                    Logger.LogWarning($"日志偏移不一致，从头上传: {commandId}");
+                    return await UploadLogFileAsync(commandId, logFile, machineId, 0);
+                }
+                if (!response.IsSuccessStatusCode)
+                {
+                    // 上传失败时服务端未保存结果，返回错误
+                    string detail = await response.Content.ReadAsStringAsync();
+                    Logger.LogError($"上传日志失败: {response.StatusCode}, 命令ID: {commandId}, {detail}");
+                    await ReturnCommandResultAsync(commandId, "error", $"上传日志失败: {response.StatusCode}");
+                    return true;
+                }
+
+                Logger.LogInfo($"日志已上传: {commandId}, 文件: {logFile.Name}, 起始偏移: {offset}, 大小: {logFile.Length - offset}字节");
+                return true;
+            }
+        }
+
         /// <summary>
         /// 返回命令执行结果到服务器
         /// </summary>
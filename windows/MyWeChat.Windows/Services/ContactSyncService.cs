@@ -1,6 +1,7 @@
 using System;
 using System.Collections.Generic;
 using System.Linq;
+using System.Threading.Tasks;
 using Newtonsoft.Json;
 using MyWeChat.Windows.Core.Connection;
 using MyWeChat.Windows.Models;
@@ -143,8 +144,8 @@ namespace MyWeChat.Windows.Services
 
                 if (contacts.Count > 0)
                 {
-                    // 同步到服务器
-                    SyncToServer(contacts);
+                    // 同步到服务器（后台按顺序发送各批次）
+                    _ = SyncToServerAsync(contacts);
                 }
             }
             catch (Exception ex)
@@ -155,47 +156,62 @@ namespace MyWeChat.Windows.Services
 
         /// <summary>
         /// 同步好友列表到服务器
+        /// 各批次按顺序逐一发送，前一批发送成功后才发送下一批；某一批发送失败时停止本轮同步，
+        /// 服务器收不到完整的一轮，不会把缺失批次中的好友计为删除
         /// </summary>
-        private void SyncToServer(List<ContactInfo> contacts)
+        private async Task SyncToServerAsync(List<ContactInfo> contacts)
         {
             try
             {
                 Logger.LogInfo($"开始同步好友列表到服务器，数量: {contacts.Count}");
 
                 // 分批同步（每批1000条）
+                // 同一轮同步的各批次使用相同的snapshot_id，并携带批次序号和批次总数，
+                // 服务器收齐本轮所有批次后才计算删除的好友
                 int batchSize = 1000;
+                int batchCount = (contacts.Count + batchSize - 1) / batchSize;
+                string snapshotId = Guid.NewGuid().ToString("N");
                 for (int i = 0; i < contacts.Count; i += batchSize)
                 {
                     var batch = contacts.Skip(i).Take(batchSize).ToList();
+                    int batchIndex = i / batchSize;
                     
-                // 通过WebSocket发送到服务器
-                // 将ContactInfo转换为App端期望的格式（小写下划线命名）
-                var contactData = batch.Select(c => new
-                {
-                    id = c.Id ?? $"{c.WeChatId}_{c.FriendId}",
-                    we_chat_id = c.WeChatId,
-                    friend_id = c.FriendId,
-                    nick_name = c.NickName,
-                    remark = c.Remark,
-                    avatar = c.Avatar,
-                    city = c.City,
-                    province = c.Province,
-                    country = c.Country,
-                    sex = c.Sex,
-                    label_ids = c.LabelIds,
-                    friend_no = c.FriendNo,
-                    is_new_friend = c.IsNewFriend == "1" ? "1" : "0"
-                }).ToList();
-                
-                var syncData = new
-                {
-                    type = "sync_contacts",
-                    data = contactData
-                };
-
-                _ = _webSocketService.SendMessageAsync(syncData);
+                    // 通过WebSocket发送到服务器
+                    // 将ContactInfo转换为App端期望的格式（小写下划线命名）
+                    var contactData = batch.Select(c => new
+                    {
+                        id = c.Id ?? $"{c.WeChatId}_{c.FriendId}",
+                        we_chat_id = c.WeChatId,
+                        friend_id = c.FriendId,
+                        nick_name = c.NickName,
+                        remark = c.Remark,
+                        avatar = c.Avatar,
+                        city = c.City,
+                        province = c.Province,
+                        country = c.Country,
+                        sex = c.Sex,
+                        label_ids = c.LabelIds,
+                        friend_no = c.FriendNo,
+                        is_new_friend = c.IsNewFriend == "1" ? "1" : "0"
+                    }).ToList();
+                    
+                    var syncData = new
+                    {
+                        type = "sync_contacts",
+                        snapshot_id = snapshotId,
+                        batch_index = batchIndex,
+                        batch_count = batchCount,
+                        last_batch = batchIndex == batchCount - 1,
+                        data = contactData
+                    };
+
+                    if (!await _webSocketService.SendMessageAsync(syncData))
+                    {
+                        Logger.LogError($"同步好友列表批次 {batchIndex + 1}/{batchCount} 发送失败，停止本轮同步");
+                        return;
+                    }
 
-                    Logger.LogInfo($"已同步好友列表批次 {i / batchSize + 1}，数量: {batch.Count}");
+                    Logger.LogInfo($"已同步好友列表批次 {batchIndex + 1}/{batchCount}，数量: {batch.Count}");
                 }
 
                 Logger.LogInfo("好友列表同步完成");
@@ -19,6 +19,8 @@ namespace MyWeChat.Windows.Services.WebSocket
         private readonly string _serverUrl;
         private bool _isConnected;
         private CancellationTokenSource? _cancellationTokenSource;
+        // ClientWebSocket不允许并发调用SendAsync，所有发送串行执行
+        private readonly SemaphoreSlim _sendLock = new SemaphoreSlim(1, 1);
 
         /// <summary>
         /// 连接状态
@@ -121,10 +123,12 @@ namespace MyWeChat.Windows.Services.WebSocket
                 await Task.Delay(100);
 
                 // 发送客户端类型（明文，密钥交换前）
+                // command_ack: 收到命令后发送确认，服务器据此判断命令是否需要重新下发
                 await SendMessageAsyncPlain(new
                 {
                     type = "client_type",
-                    client_type = "windows"
+                    client_type = "windows",
+                    command_ack = true
                 });
 
                 return true;
@@ -252,8 +256,7 @@ namespace MyWeChat.Windows.Services.WebSocket
                 }
 
                 string json = Newtonsoft.Json.JsonConvert.SerializeObject(message);
-                byte[] buffer = Encoding.UTF8.GetBytes(json);
-                await _webSocket.SendAsync(new ArraySegment<byte>(buffer), WebSocketMessageType.Text, true, CancellationToken.None);
+                await SendFrameAsync(_webSocket, Encoding.UTF8.GetBytes(json));
                 return true;
             }
             catch (Exception ex)
@@ -305,15 +308,13 @@ namespace MyWeChat.Windows.Services.WebSocket
                     };
                     string jsonMessage = Newtonsoft.Json.JsonConvert.SerializeObject(messageWrapper);
 
-                    byte[] buffer = Encoding.UTF8.GetBytes(jsonMessage);
-                    await _webSocket.SendAsync(new ArraySegment<byte>(buffer), WebSocketMessageType.Text, true, CancellationToken.None);
+                    await SendFrameAsync(_webSocket, Encoding.UTF8.GetBytes(jsonMessage));
                     Logger.LogInfo("WebSocket消息已发送（已加密）");
                 }
                 else
                 {
                     // 会话密钥未设置，发送明文（用于密钥交换阶段）
-                    byte[] buffer = Encoding.UTF8.GetBytes(message);
-                    await _webSocket.SendAsync(new ArraySegment<byte>(buffer), WebSocketMessageType.Text, true, CancellationToken.None);
+                    await SendFrameAsync(_webSocket, Encoding.UTF8.GetBytes(message));
                     Logger.LogInfo("WebSocket消息已发送（明文，密钥交换阶段）");
                 }
                 return true;
@@ -325,6 +326,22 @@ namespace MyWeChat.Windows.Services.WebSocket
             }
         }
 
+        /// <summary>
+        /// 发送一个文本帧（等待之前的发送完成后再发送，避免并发调用SendAsync）
+        /// </summary>
+        private async Task SendFrameAsync(ClientWebSocket webSocket, byte[] buffer)
+        {
+            await _sendLock.WaitAsync();
+            try
+            {
+                await webSocket.SendAsync(new ArraySegment<byte>(buffer), WebSocketMessageType.Text, true, CancellationToken.None);
+            }
+            finally
+            {
+                _sendLock.Release();
+            }
+        }
+
         /// <summary>
         /// 发送消息（同步方法）
         /// 注意：此方法可能导致死锁，建议使用异步方法 SendMessageAsync
@@ -434,6 +451,7 @@ namespace MyWeChat.Windows.Services.WebSocket
                         }
 
                         Logger.LogInfo("WebSocket收到消息（已解密）");
+                        await AcknowledgeCommandAsync(decryptedMessage);
                         OnMessageReceived?.Invoke(this, decryptedMessage);
                     }
                 }
@@ -497,6 +515,42 @@ namespace MyWeChat.Windows.Services.WebSocket
             }
         }
 
+        /// <summary>
+        /// 收到命令后立即向服务器发送确认（command_ack），避免服务器重新下发
+        /// 确认发送完成后再处理命令，确认先于命令结果到达服务器
+        /// </summary>
+        private async Task AcknowledgeCommandAsync(string message)
+        {
+            try
+            {
+                var messageObj = Newtonsoft.Json.JsonConvert.DeserializeObject<dynamic>(message);
+                if (messageObj?.type?.ToString() != "command")
+                {
+                    return;
+                }
+
+                string commandId = messageObj?.command_id?.ToString() ?? "";
+                if (string.IsNullOrEmpty(commandId))
+                {
+                    return;
+                }
+
+                bool sent = await SendMessageAsync(new
+                {
+                    type = "command_ack",
+                    command_id = commandId
+                });
+                if (!sent)
+                {
+                    Logger.LogWarning($"发送命令确认失败，服务器将重新下发: {commandId}");
+                }
+            }
+            catch (Exception ex)
+            {
+                Logger.LogWarning($"发送命令确认失败: {ex.Message}");
+            }
+        }
+
         /// <summary>
         /// 处理密钥交换消息
         /// </summary>